@@ -1,10 +1,21 @@
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, render_template, request, redirect, url_for, jsonify, Response, stream_with_context, g
 import requests
 import time
 import mariadb
-from datetime import datetime
+from datetime import datetime, timedelta
 import paho.mqtt.client as mqtt
 import threading
+import hashlib
+import json
+from recurrence import parse_repeat_days, first_fire_time, alarm_fire_time
+from cache import TTLCache, FragmentCache
+from events import EventBroadcaster
+import bulk_alarms
+import telemetry_query
+import telemetry_format
+import clocks
+import metrics
+import db
 
 # create Flask application instance
 app = Flask(__name__)
@@ -13,154 +24,542 @@ weather_url = 'http://api.weatherapi.com/v1/current.json?key=292d307bc3ac410bb92
 
 weather_api_key = '292d307bc3ac410bb92180019242504'
 
+# weather responses are fresh for WEATHER_CACHE_TTL seconds and served stale while
+# refreshing for WEATHER_STALE_TTL more
+WEATHER_CACHE_TTL = 300
+WEATHER_STALE_TTL = 900
+WEATHER_TIMEOUT = 5
+weather_cache = TTLCache(WEATHER_CACHE_TTL, WEATHER_STALE_TTL)
+
+# shared keep-alive session for calls to the weather API
+weather_session = requests.Session()
+
 #MQTT broker config
 MQTT_BROKER_HOST = "mqtt.bucknell.edu"
 MQTT_BROKER_PORT = 1883
-MQTT_ALARM = "iot/alarm/vk009_csci332"
+# check_alarm.py reloads its schedule whenever a message arrives here, and
+# publishes here after firing alarms
+MQTT_CONTROL = "iot/control/vk009_csci332/alarms"
+# clocks publish telemetry on iot/telemetry/<topic key> and ring on iot/alarm/<topic key>
+clock_registry = clocks.ClockRegistry()
+
+# telemetry history queries are cached for TELEMETRY_CACHE_TTL seconds, keyed on the aligned query
+TELEMETRY_CACHE_TTL = 30
+telemetry_cache = TTLCache(TELEMETRY_CACHE_TTL, max_entries=128)
+
+# rendered alarm pages, reused until the alarms change (set_alarm, bulk import, or a
+# message on MQTT_CONTROL or an alarm topic from check_alarm.py)
+alarm_pages = FragmentCache()
+
+# live events for the dashboards, fed by the one MQTT subscription below
+live_events = EventBroadcaster()
+
+# log one in every LOG_SAMPLE_EVERY page views
+LOG_SAMPLE_EVERY = 100
+
+request_seconds = metrics.histogram('http_request_seconds', 'Flask request latency', labels=('endpoint',))
+metrics.gauge('weather_cache_hit_ratio', 'Share of /weather lookups served from the cache', fn=weather_cache.hit_ratio)
+metrics.gauge('weather_cache_hits', 'Fresh weather cache hits', fn=lambda: weather_cache.hits)
+metrics.gauge('weather_cache_stale_hits', 'Stale weather cache hits served while refreshing', fn=lambda: weather_cache.stale_hits)
+metrics.gauge('weather_cache_misses', 'Weather cache misses', fn=lambda: weather_cache.misses)
+metrics.gauge('telemetry_cache_hit_ratio', 'Share of /api/telemetry queries served from the cache', fn=telemetry_cache.hit_ratio)
+metrics.gauge('alarm_page_cache_hit_ratio', 'Share of alarm page views served from the render cache', fn=alarm_pages.hit_ratio)
+metrics.gauge('sse_clients', 'Connected Server-Sent Events clients', fn=lambda: len(live_events.subscribers))
+mqtt_reconnects = metrics.counter('mqtt_reconnects_total', 'Reconnects to the MQTT broker after the first connect')
+mqtt_connected_once = threading.Event()
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    if 'request_start' in g:
+        request_seconds.observe(time.perf_counter() - g.request_start, request.endpoint or 'unknown')
+    return response
+
+# number of alarms shown per page on /alarm
+ALARM_PAGE_SIZE = 50
+MAX_ALARM_PAGE_SIZE = 500
+
+# rows per executemany during bulk import and per fetchmany during export
+BULK_CHUNK_SIZE = 1000
+# stop reporting import errors after this many
+BULK_MAX_ERRORS = 100
+
+# how long browsers and kiosks may reuse /api/next_alarm before revalidating
+NEXT_ALARM_MAX_AGE = 5
+
+# process-wide cache of the next alarm per clock, reloaded after writes and fire events
+next_alarm_cache = {
+    'alarms': {},       # clock_id -> {'id': ..., 'next_fire_at': ...}
+    'etag': None,
+    'stale': True,
+    'expires_at': None, # earliest next_fire_at, the cache is stale once it has passed
+}
+next_alarm_lock = threading.Lock()
+
+# Function to mark the next alarm cache as out of date
+def invalidate_next_alarms():
+    """
+    Marks the next alarm cache stale so the next reader reloads it.
+    """
+    next_alarm_cache['stale'] = True
+
+# Function to serve a rendered page with its ETag
+def cached_page(html, etag):
+    """
+    Returns a response for a page from the render cache, a 304 if the browser already has it.
+    """
+    response = Response(html, mimetype='text/html')
+    response.set_etag(etag)
+    # the alarms can change at any time, so browsers always revalidate
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+# Function to load the next alarm for every clock
+def load_next_alarms():
+    """
+    Queries the next enabled alarm for every clock. Returns a dict of clock_id -> alarm.
+    """
+    with db.cursor(dictionary=True) as cursor:
+        cursor.execute("""SELECT a.id, a.clock_id, a.next_fire_at FROM alarms a
+                          JOIN (SELECT clock_id, MIN(next_fire_at) AS next_fire_at FROM alarms
+                                WHERE enabled = TRUE AND next_fire_at >= ? GROUP BY clock_id) n
+                          ON a.clock_id = n.clock_id AND a.next_fire_at = n.next_fire_at
+                          WHERE a.enabled = TRUE""", (datetime.now().replace(second=0, microsecond=0),))
+        rows = cursor.fetchall()
+    alarms = {}
+    for row in rows:
+        if row['clock_id'] not in alarms or row['id'] < alarms[row['clock_id']]['id']:
+            alarms[row['clock_id']] = {'id': row['id'], 'next_fire_at': row['next_fire_at']}
+    return alarms
 
-# Cached database connection
-cached_connection = None
+# Function to read the next alarm cache
+def get_next_alarms():
+    """
+    Returns the cached next alarm per clock and its ETag, reloading from the database only if
+    alarms changed, an alarm fired, or the earliest cached alarm time has passed.
+    """
+    with next_alarm_lock:
+        expires_at = next_alarm_cache['expires_at']
+        if next_alarm_cache['stale'] or (expires_at is not None and datetime.now() >= expires_at + timedelta(minutes=1)):
+            # clear the flag first so an invalidation during the query is not lost
+            next_alarm_cache['stale'] = False
+            try:
+                alarms = load_next_alarms()
+            except mariadb.Error:
+                next_alarm_cache['stale'] = True
+                raise
+            body = json.dumps({str(k): v['next_fire_at'].isoformat() for k, v in sorted(alarms.items())})
+            next_alarm_cache['alarms'] = alarms
+            next_alarm_cache['etag'] = hashlib.sha1(body.encode()).hexdigest()
+            next_alarm_cache['expires_at'] = min((v['next_fire_at'] for v in alarms.values()), default=None)
+        return next_alarm_cache['alarms'], next_alarm_cache['etag']
+
+def on_connect(client, userdata, flags, rc, properties=None):
+    """
+    Callback function that is called when the client connects to the MQTT broker.
+    Subscribes to alarm changes, fired alarms and telemetry for the next alarm cache and live events.
+    """
+    client.subscribe([(MQTT_CONTROL, 0), (clocks.ALARM_WILDCARD, 0), (clocks.TELEMETRY_WILDCARD, 0)])
+    if mqtt_connected_once.is_set():
+        mqtt_reconnects.inc()
+    mqtt_connected_once.set()
+    # we may have missed changes while disconnected
+    invalidate_next_alarms()
+    alarm_pages.bump()
+
+def on_message(client, userdata, msg):
+    """
+    Callback function that is called when an alarm changes or fires, or a clock sends telemetry.
+    Updates the next alarm cache and forwards the event to every connected dashboard.
+    """
+    try:
+        if msg.topic == MQTT_CONTROL:
+            invalidate_next_alarms()
+            alarm_pages.bump()
+            live_events.publish('alarm-changed', {'reason': msg.payload.decode()})
+        elif msg.topic.startswith(clocks.TELEMETRY_PREFIX + "/"):
+            clock_id = clock_registry.clock_id(clocks.topic_key(msg.topic))
+            if clock_id is not None:
+                payload = telemetry_format.decode(msg.payload)
+                # JSON that is not an object is not telemetry
+                if isinstance(payload, dict):
+                    live_events.publish('telemetry', {**payload, 'clock_id': clock_id})
+        elif msg.topic.startswith(clocks.ALARM_PREFIX + "/"):
+            clock_id = clock_registry.clock_id(clocks.topic_key(msg.topic))
+            if clock_id is not None:
+                # firing moves next_fire_at and disables one-off alarms
+                alarm_pages.bump()
+                live_events.publish('alarm-fired', {'clock_id': clock_id, 'message': msg.payload.decode()})
+    except ValueError as e:
+        print(f"Error processing message on {msg.topic}: {e}")
 
 #MQTT client config
 client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+client.on_connect = on_connect
+client.on_message = on_message
 client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT)
 client.loop_start()
 
-# Function to establish database connection
-def get_database_connection():
-    global cached_connection
-    if cached_connection is None:
-        try:
-            cached_connection = mariadb.connect(
-                host='eg-db.bucknell.edu',
-                database='vk009_csci332',
-                user='vk009_csci332',
-                password='oat3ceegok1mei1R'
-            )
-        except mariadb.Error as e:
-            print(f"Error connecting to database: {e}")
-    return cached_connection
-
 @app.route('/')
 def home():
     """
     Renders the home page and checks if there is an alarm set for the current time.
-    If an alarm is found, it triggers an alert.
+    If an alarm is found, it triggers an alert. Reads the next alarm cache, not the database.
     """
+    next_alarms = {}
     # Check if there is an alarm set for the current time
-    connection = get_database_connection()
-    if connection:
-        try:
-            now = datetime.now().strftime('%H:%M:00')
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute("SELECT * FROM alarms WHERE alarm_time = ? AND enabled = TRUE", (now,))
-            alarm = cursor.fetchone()
-            cursor.close()
-
-            if alarm:
-                # Found an alarm, trigger an alert or take some action
-                print("Alarm found!")
-            else:
-                print("No alarm set for the current time.")
-        except mariadb.Error as e:
-            print(f"Error querying database: {e}")
-    else:
-        print("Error connecting to database")
-
-    return render_template('home.html')
+    try:
+        next_alarms, _ = get_next_alarms()
+        now = datetime.now().replace(second=0, microsecond=0)
+        if any(alarm['next_fire_at'] == now for alarm in next_alarms.values()):
+            # Found an alarm, trigger an alert or take some action
+            print("Alarm found!")
+        else:
+            metrics.log_sampled('home_no_alarm', LOG_SAMPLE_EVERY)
+    except mariadb.Error as e:
+        print(f"Error querying database: {e}")
+
+    clock_registry.ensure_loaded()
+    return render_template('home.html', next_alarms=next_alarms, clock_names=clock_registry.names)
+
+@app.route('/api/next_alarm')
+def api_next_alarm():
+    """
+    Returns the next alarm per clock as JSON, optionally for a single clock_id.
+    Served from the next alarm cache with an ETag, so polling clients mostly get 304s.
+    """
+    try:
+        next_alarms, etag = get_next_alarms()
+    except mariadb.Error as e:
+        print(f"Error querying database: {e}")
+        return jsonify(error="Error fetching next alarm"), 503
+
+    clock_id = request.args.get('clock_id', type=int)
+    if clock_id is not None:
+        next_alarms = {k: v for k, v in next_alarms.items() if k == clock_id}
+        etag = f"{etag}-{clock_id}"
+
+    response = jsonify({str(k): {'id': v['id'], 'next_fire_at': v['next_fire_at'].isoformat()}
+                        for k, v in sorted(next_alarms.items())})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"max-age={NEXT_ALARM_MAX_AGE}, must-revalidate"
+    return response.make_conditional(request)
+
+@app.route('/metrics')
+def metrics_page():
+    """
+    Serves the process metrics in the Prometheus text format.
+    """
+    return Response(metrics.render(), mimetype=metrics.CONTENT_TYPE)
+
+@app.route('/api/events')
+def api_events():
+    """
+    Streams alarm-fired, alarm-changed and telemetry events to the browser as Server-Sent Events.
+    """
+    response = Response(stream_with_context(live_events.stream()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # stop proxies such as nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/set_alarm', methods=['POST'])
 def set_alarm():
     """
-    Sets a new alarm based on the form data and publishes the alarm time and date to MQTT.
+    Sets a new alarm for the chosen clock based on the form data and publishes the alarm time and date to MQTT.
     """
     alarm_time = request.form['alarm_time']
     alarm_date = request.form['alarm_date']
     repeat_days = request.form['repeat_days']
+    clock_id = request.form.get('clock_id', clocks.DEFAULT_CLOCK_ID, type=int)
+    if clock_registry.topic_key(clock_id) is None:
+        print(f"Alarm for unregistered clock {clock_id}")
+        return "Unknown clock"
 
-    connection = get_database_connection()
-    if connection:
-        try:
-            cursor = connection.cursor()
-            cursor.execute("INSERT INTO alarms (clock_id, alarm_time, alarm_date, repeat_days, enabled) VALUES (1, ?, ?, ?, TRUE)",
-                            (alarm_time, alarm_date, repeat_days))
-            connection.commit()
-            cursor.close()
-
-            # Fetch all alarms after inserting a new one
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute("SELECT * FROM alarms")
-            alarms = cursor.fetchall()
-            #cursor.close()
-            #connection.close()
-
-            return render_template('home.html', alarm_data=alarms)
-        except mariadb.Error as e:
-            print(f"Error inserting data into table: {e}")
-            return "Error setting alarm"
-    else:
-        return "Error connecting to database"
+    try:
+        repeat_mask = parse_repeat_days(repeat_days)
+        next_fire_at = first_fire_time(alarm_date, alarm_time, repeat_mask)
+    except ValueError as e:
+        print(f"Invalid alarm form data: {e}")
+        return "Invalid alarm"
+
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("INSERT INTO alarms (clock_id, alarm_time, alarm_date, repeat_days, repeat_mask, next_fire_at, enabled) "
+                           "VALUES (?, ?, ?, ?, ?, ?, TRUE)",
+                            (clock_id, alarm_time, alarm_date, repeat_days, repeat_mask, next_fire_at))
+            alarm_id = cursor.lastrowid
+
+        # tell the alarm checker its schedule is out of date
+        client.publish(MQTT_CONTROL, "alarms changed")
+        invalidate_next_alarms()
+        alarm_pages.bump()
+        print(f"Alarm {alarm_id} set on clock {clock_id}")
+    except mariadb.Error as e:
+        print(f"Error inserting data into table: {e}")
+        return "Error setting alarm"
+
+    # back to the dashboard, which shows the new next alarm; a reload does not post the form again
+    return redirect(url_for('home'))
+
+# Function to fetch one page of alarms
+def fetch_alarm_page(after=None, limit=ALARM_PAGE_SIZE, clock_id=None, enabled=None):
+    """
+    Returns up to limit alarms ordered by (alarm_date, alarm_time, id), starting after the
+    key in after, together with the key to pass as after for the next page (None on the last page).
+    Seeks on the key instead of using OFFSET, so every page costs the same however deep it is.
+    """
+    conditions = []
+    params = []
+    if clock_id is not None:
+        conditions.append("clock_id = ?")
+        params.append(clock_id)
+    if enabled is not None:
+        conditions.append("enabled = ?")
+        params.append(enabled)
+    if after is not None:
+        after_date, after_time, after_id = after
+        conditions.append("(alarm_date > ? OR (alarm_date = ? AND (alarm_time > ? OR (alarm_time = ? AND id > ?))))")
+        params.extend([after_date, after_date, after_time, after_time, after_id])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with db.cursor(dictionary=True) as cursor:
+        # fetch one extra row to find out if there is another page
+        cursor.execute(f"SELECT * FROM alarms {where} ORDER BY alarm_date, alarm_time, id LIMIT ?", (*params, limit + 1))
+        alarms = cursor.fetchall()
+
+    next_after = None
+    if len(alarms) > limit:
+        alarms = alarms[:limit]
+        last = alarms[-1]
+        # TIME comes back as a timedelta, whose str drops the leading zero of the hour
+        next_after = f"{alarm_fire_time(last['alarm_date'], last['alarm_time']):%Y-%m-%d_%H:%M:%S}_{last['id']}"
+    return alarms, next_after
+
+# Function to read the paging arguments of /alarm
+def parse_alarm_page_args(args):
+    """
+    Parses the after, limit, clock_id and enabled query arguments. Raises ValueError on bad input.
+    """
+    after = None
+    if args.get('after'):
+        after_date, after_time, after_id = args['after'].split('_')
+        after = (after_date, after_time, int(after_id))
+    limit = min(max(int(args.get('limit', ALARM_PAGE_SIZE)), 1), MAX_ALARM_PAGE_SIZE)
+    clock_id = int(args['clock_id']) if args.get('clock_id') else None
+    enabled = None
+    if args.get('enabled'):
+        enabled = args['enabled'].lower() in ('1', 'true', 'yes', 'on')
+    return after, limit, clock_id, enabled
 
 @app.route('/alarm')
 def alarm():
     """
-    Renders the alarm page with a list of all alarms.
+    Renders the alarm page with one page of alarms, optionally filtered by clock and enabled state.
     """
-    cursor = None
     try:
-        connection = get_database_connection()
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("SELECT * FROM alarms")
-        alarms = cursor.fetchall()
-        #cursor.close()
-        #connection.close()
-        return render_template('alarm.html', alarm_data=alarms)
+        after, limit, clock_id, enabled = parse_alarm_page_args(request.args)
+    except ValueError as e:
+        print(f"Invalid alarm page arguments: {e}")
+        return "Invalid page", 400
+
+    def render():
+        alarms, next_after = fetch_alarm_page(after, limit, clock_id, enabled)
+        return render_template('alarm.html', alarm_data=alarms, next_after=next_after, limit=limit,
+                               clock_id=request.args.get('clock_id'), enabled=request.args.get('enabled'))
+
+    # the raw clock_id and enabled strings end up in the next page link, so they are part of the key
+    args = (after, limit, enabled, request.args.get('clock_id'), request.args.get('enabled'))
+    try:
+        html, etag = alarm_pages.get(('alarm', clock_id), args, render)
     except mariadb.Error as e:
         print(f"Error querying database: {e}")
         return "Error fetching alarms"
-    finally:
-        if cursor is not None:
-            cursor.close()
-    return 0
+    return cached_page(html, etag)
 
-@app.route('/weather')
-def weather():
+# Function to fetch the current weather from the API
+def fetch_weather():
     """
-    Renders the weather page with current weather data from the API.
+    Fetches the current weather from the API over the shared session.
+    Raises an exception for failed requests so they are not cached.
     """
     params = {
         'key': weather_api_key,
         'q': 'Lewisburg',
         'aqi': 'no'
     }
+    response = weather_session.get(weather_url, params=params, timeout=WEATHER_TIMEOUT)
+    # Check if the request was successful (status code 200)
+    response.raise_for_status()
+    # Parse the JSON response into a Python dictionary
+    return response.json()
 
+@app.route('/api/alarms/bulk', methods=['POST'])
+def import_alarms():
+    """
+    Imports alarms from a CSV, JSON array or JSON lines body in one transaction.
+    Rows are validated as they stream in and inserted BULK_CHUNK_SIZE at a time with executemany.
+    If any row is invalid nothing is inserted and the errors are returned.
+    """
+    errors = []
+    inserted = 0
     try:
-        # Send GET request to the weather API
-        response = requests.get(weather_url, params=params)
-
-        # Check if the request was successful (status code 200)
-        if response.status_code == 200:
-            # Parse the JSON response into a Python dictionary
-            weather_data = response.json()
-
-            # Extract relevant information from the response
-            location = weather_data['location']['name']
-            region = weather_data['location']['region']
-            country = weather_data['location']['country']
-            localtime = weather_data['location']['localtime']
-            temp_c = weather_data['current']['temp_c']
-            temp_f = weather_data['current']['temp_f']
-            condition = weather_data['current']['condition']['text']
-            wind_kph = weather_data['current']['wind_kph']
-            humidity = weather_data['current']['humidity']
-
-            # Pass weather data to the template
-            return render_template('weather.html', location=location, region=region, country=country,
-                                   localtime=localtime, temp_c=temp_c, temp_f=temp_f, condition=condition,
-                                   wind_kph=wind_kph, humidity=humidity)
-        else:
-            print(f"Error fetching weather data: {response.status_code}")
-            return "Error fetching weather data"
+        with db.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                chunk = []
+                for number, row in bulk_alarms.iter_rows(request.stream, request.content_type or ''):
+                    try:
+                        values = bulk_alarms.validate_row(row, clock_exists=lambda c: clock_registry.topic_key(c) is not None)
+                    except (KeyError, TypeError, ValueError) as e:
+                        errors.append({'line': number, 'error': str(e)})
+                        if len(errors) >= BULK_MAX_ERRORS:
+                            break
+                        continue
+                    if errors:
+                        # keep validating to report errors, but nothing will be inserted
+                        continue
+                    chunk.append(values)
+                    if len(chunk) >= BULK_CHUNK_SIZE:
+                        cursor.executemany(f"INSERT INTO alarms {bulk_alarms.INSERT_COLUMNS} VALUES (?, ?, ?, ?, ?, ?, ?)", chunk)
+                        inserted += len(chunk)
+                        chunk = []
+                if errors:
+                    connection.rollback()
+                    return jsonify(inserted=0, errors=errors), 400
+                if chunk:
+                    cursor.executemany(f"INSERT INTO alarms {bulk_alarms.INSERT_COLUMNS} VALUES (?, ?, ?, ?, ?, ?, ?)", chunk)
+                    inserted += len(chunk)
+                connection.commit()
+            finally:
+                cursor.close()
+    except ValueError as e:
+        # the body itself could not be parsed
+        return jsonify(inserted=0, errors=[{'error': str(e)}]), 400
+    except mariadb.Error as e:
+        print(f"Error importing alarms: {e}")
+        return jsonify(inserted=0, errors=[{'error': "Error inserting alarms"}]), 500
+
+    # tell the alarm checker its schedule is out of date
+    client.publish(MQTT_CONTROL, "alarms changed")
+    invalidate_next_alarms()
+    alarm_pages.bump()
+    return jsonify(inserted=inserted, errors=[])
+
+@app.route('/api/alarms/bulk', methods=['GET'])
+def export_alarms():
+    """
+    Streams every alarm, optionally for one clock_id, as CSV (format=csv) or JSON lines.
+    Rows are read with an unbuffered cursor BULK_CHUNK_SIZE at a time, never all at once.
+    """
+    fmt = request.args.get('format', 'json')
+    clock_id = request.args.get('clock_id', type=int)
+
+    def rows():
+        with db.connection() as connection:
+            cursor = connection.cursor(dictionary=True, buffered=False)
+            try:
+                if clock_id is None:
+                    cursor.execute("SELECT * FROM alarms ORDER BY id")
+                else:
+                    cursor.execute("SELECT * FROM alarms WHERE clock_id = ? ORDER BY id", (clock_id,))
+                while True:
+                    chunk = cursor.fetchmany(BULK_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    yield from chunk
+            finally:
+                cursor.close()
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(bulk_alarms.iter_export(rows(), fmt)), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f"attachment; filename=alarms.{'csv' if fmt == 'csv' else 'jsonl'}"
+    return response
+
+# Function to run one telemetry history query
+def load_telemetry(key):
+    """
+    Returns the bucketed telemetry points for a query key from telemetry_query.parse_args.
+    """
+    with db.cursor() as cursor:
+        return telemetry_query.fetch(cursor, key)
+
+@app.route('/api/telemetry')
+def api_telemetry():
+    """
+    Returns a clock's temperature and humidity history between start and end (ISO datetimes,
+    default the last day) in buckets of bucket seconds, as JSON or CSV (format=csv).
+    """
+    try:
+        key, fmt = telemetry_query.parse_args(request.args)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    try:
+        points = telemetry_cache.get(key, lambda: load_telemetry(key))
+    except mariadb.Error as e:
+        print(f"Error querying telemetry: {e}")
+        return jsonify(error="Error fetching telemetry"), 500
+    if fmt == 'csv':
+        return Response(telemetry_query.iter_csv(points), mimetype='text/csv')
+    return Response(telemetry_query.iter_json(key, points), mimetype='application/json')
+
+@app.route('/api/clocks', methods=['GET'])
+def list_clocks():
+    """
+    Returns every registered clock with its MQTT topics.
+    """
+    clock_registry.refresh()
+    return jsonify(clocks=clock_registry.clocks())
+
+@app.route('/api/clocks', methods=['POST'])
+def add_clock():
+    """
+    Registers a clock from a JSON body {"topic_key": ..., "name": ...} and returns it with its topics.
+    """
+    body = request.get_json(silent=True) or {}
+    try:
+        with db.cursor() as cursor:
+            clock_id = clocks.register_clock(cursor, body.get('topic_key'), body.get('name'))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    except mariadb.IntegrityError:
+        return jsonify(error="topic key is already registered"), 409
+    except mariadb.Error as e:
+        print(f"Error registering clock: {e}")
+        return jsonify(error="Error registering clock"), 500
+    clock_registry.refresh(force=True)
+    return jsonify(next(c for c in clock_registry.clocks() if c['id'] == clock_id)), 201
+
+@app.route('/weather')
+def weather():
+    """
+    Renders the weather page with current weather data from the API, cached for WEATHER_CACHE_TTL seconds.
+    """
+    try:
+        weather_data = weather_cache.get('current', fetch_weather)
+    except requests.RequestException as e:
+        print(f"Error fetching weather data: {e}")
+        return "Error fetching weather data"
+
+    try:
+        # Extract relevant information from the response
+        location = weather_data['location']['name']
+        region = weather_data['location']['region']
+        country = weather_data['location']['country']
+        localtime = weather_data['location']['localtime']
+        temp_c = weather_data['current']['temp_c']
+        temp_f = weather_data['current']['temp_f']
+        condition = weather_data['current']['condition']['text']
+        wind_kph = weather_data['current']['wind_kph']
+        humidity = weather_data['current']['humidity']
+
+        # Pass weather data to the template
+        return render_template('weather.html', location=location, region=region, country=country,
+                               localtime=localtime, temp_c=temp_c, temp_f=temp_f, condition=condition,
+                               wind_kph=wind_kph, humidity=humidity)
     except Exception as e:
         print(f"An error occurred: {e}")
         return "An error occurred"
@@ -171,7 +570,8 @@ def set_alarm_page():
     """
     Render the set alarm page of our online dashboard
     """
-    return render_template('set_alarm.html')
+    clock_registry.refresh()
+    return render_template('set_alarm.html', clocks=clock_registry.clocks())
 
 
 @app.route('/alarm')
@@ -0,0 +1,568 @@
+'''
+Offline benchmarks for the alarm checker, telemetry ingest and decoding, and Flask routes.
+
+Everything runs in this process: MQTT goes through an in-process fake broker,
+the database is a SQLite file that stands in for MariaDB, and /weather talks to
+a local stub of the weather API. Nothing connects to the Bucknell servers.
+
+Results are printed and written as JSON. Passing --baseline compares against an
+earlier results file and exits with status 1 if a metric got worse by more than
+--tolerance.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --quick --baseline bench.json
+'''
+import argparse
+import contextlib
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue
+
+import paho.mqtt.client as mqtt
+
+# ---------------------------------------------------------------------------
+# in-process MQTT broker
+
+class FakeBroker:
+    """
+    Routes publishes to subscribed FakeClients synchronously, with + and # wildcards.
+    """
+    def __init__(self):
+        self.subscriptions = []  # (topic filter, client)
+        self.lock = threading.Lock()
+        self.published = 0
+
+    def subscribe(self, client, topic):
+        with self.lock:
+            self.subscriptions.append((topic, client))
+
+    def publish(self, topic, payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self.lock:
+            self.published += 1
+            targets = [client for pattern, client in self.subscriptions if topic_matches(pattern, topic)]
+        for client in targets:
+            if client.on_message is not None:
+                client.on_message(client, client.userdata, FakeMessage(topic, payload))
+
+def topic_matches(pattern, topic):
+    pattern_parts = pattern.split('/')
+    topic_parts = topic.split('/')
+    for i, part in enumerate(pattern_parts):
+        if part == '#':
+            return True
+        if i >= len(topic_parts) or (part != '+' and part != topic_parts[i]):
+            return False
+    return len(pattern_parts) == len(topic_parts)
+
+class FakeMessage:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+class FakeClient:
+    """
+    Stands in for paho's mqtt.Client, connected to the module level broker.
+    """
+    def __init__(self, *args, **kwargs):
+        self.userdata = None
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+
+    def connect(self, host, port=1883, keepalive=60):
+        if self.on_connect is not None:
+            self.on_connect(self, self.userdata, {}, 0, None)
+        return 0
+
+    connect_async = connect
+
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def subscribe(self, topic, qos=0):
+        topics = topic if isinstance(topic, list) else [(topic, qos)]
+        for t, _ in topics:
+            broker.subscribe(self, t)
+        return (0, 1)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        broker.publish(topic, payload)
+
+broker = FakeBroker()
+
+# ---------------------------------------------------------------------------
+# SQLite stand-in for MariaDB
+
+# SQLite mirror of the schema created by tables.create_tables and migrations.py
+STANDIN_SCHEMA = """
+CREATE TABLE alarms (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    clock_id INTEGER,
+    alarm_time TIME,
+    alarm_date DATE,
+    repeat_days TEXT,
+    repeat_mask INTEGER NOT NULL DEFAULT 0,
+    next_fire_at DATETIME,
+    enabled BOOLEAN,
+    snooze_time DATETIME,
+    snooze_duration INTEGER,
+    state TEXT,
+    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX idx_alarms_next_fire ON alarms (enabled, next_fire_at);
+CREATE INDEX idx_alarms_enabled_date_time ON alarms (enabled, alarm_date, alarm_time);
+CREATE INDEX idx_alarms_date_time_id ON alarms (alarm_date, alarm_time, id);
+CREATE INDEX idx_alarms_clock_date_time_id ON alarms (clock_id, alarm_date, alarm_time, id);
+CREATE TABLE weather_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    clock_id INTEGER,
+    timestamp DATETIME,
+    temperature FLOAT,
+    humidity FLOAT
+);
+CREATE INDEX idx_weather_clock_time ON weather_data (clock_id, timestamp);
+CREATE TABLE alarm_fires (
+    alarm_id INTEGER NOT NULL,
+    fire_at DATETIME NOT NULL,
+    clock_id INTEGER,
+    fired_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    checker TEXT,
+    PRIMARY KEY (alarm_id, fire_at)
+);
+CREATE TABLE clocks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic_key TEXT NOT NULL UNIQUE,
+    name TEXT,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+);
+INSERT INTO clocks (id, topic_key, name) VALUES (1, 'vk009_csci332', 'vk009_csci332');
+"""
+
+ROLLUP_SCHEMA = """
+CREATE TABLE {table} (
+    clock_id INTEGER NOT NULL,
+    bucket_start DATETIME NOT NULL,
+    temp_min FLOAT, temp_max FLOAT, temp_sum DOUBLE,
+    humidity_min FLOAT, humidity_max FLOAT, humidity_sum DOUBLE,
+    humidity_count INTEGER NOT NULL DEFAULT 0,
+    sample_count INTEGER NOT NULL,
+    PRIMARY KEY (clock_id, bucket_start)
+);
+"""
+
+def convert_time(value):
+    # MariaDB returns TIME columns as a timedelta since midnight
+    parts = [int(float(p)) for p in value.decode().split(':')]
+    while len(parts) < 3:
+        parts.append(0)
+    return timedelta(hours=parts[0], minutes=parts[1], seconds=parts[2])
+
+sqlite3.register_adapter(datetime, lambda v: v.isoformat(" "))
+sqlite3.register_adapter(date, lambda v: v.isoformat())
+sqlite3.register_adapter(timedelta, lambda v: str(v))
+sqlite3.register_converter("DATETIME", lambda v: datetime.fromisoformat(v.decode()))
+sqlite3.register_converter("DATE", lambda v: date.fromisoformat(v.decode()))
+sqlite3.register_converter("TIME", convert_time)
+sqlite3.register_converter("BOOLEAN", lambda v: int(v))
+
+def translate(sql):
+    """
+    Rewrites the MariaDB-only SQL the app uses into its SQLite equivalent.
+    """
+    sql = sql.replace("ON DUPLICATE KEY UPDATE", "ON CONFLICT DO UPDATE SET")
+    sql = sql.replace("INSERT IGNORE", "INSERT OR IGNORE")
+    return re.sub(r"VALUES\((\w+)\)", r"excluded.\1", sql)
+
+class StandInCursor:
+    def __init__(self, connection, dictionary):
+        self.connection = connection
+        self.dictionary = dictionary
+        self.cursor = connection.raw.cursor()
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def execute(self, sql, params=()):
+        self.cursor.execute(translate(sql), params)
+
+    def executemany(self, sql, rows):
+        self.cursor.executemany(translate(sql), rows)
+
+    def _row(self, row):
+        if row is None or not self.dictionary:
+            return row
+        return {d[0]: v for d, v in zip(self.cursor.description, row)}
+
+    def fetchone(self):
+        return self._row(self.cursor.fetchone())
+
+    def fetchmany(self, size):
+        return [self._row(r) for r in self.cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(r) for r in self.cursor.fetchall()]
+
+    def close(self):
+        self.cursor.close()
+
+class StandInConnection:
+    """
+    A sqlite3 connection with the parts of the mariadb connection API the app uses.
+    """
+    def __init__(self, path):
+        self.raw = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False, timeout=30)
+        # like MariaDB, NULL if either argument is NULL
+        self.raw.create_function("LEAST", 2, lambda a, b: None if a is None or b is None else min(a, b))
+        self.raw.create_function("GREATEST", 2, lambda a, b: None if a is None or b is None else max(a, b))
+
+    def cursor(self, dictionary=False, buffered=True):
+        return StandInCursor(self, dictionary)
+
+    def ping(self):
+        pass
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def install_standin_db(path):
+    """
+    Creates the stand-in schema and points db.py at it instead of the MariaDB pool.
+    """
+    import db
+    import rollups
+    raw = sqlite3.connect(path)
+    raw.execute("PRAGMA journal_mode=WAL")
+    raw.executescript(STANDIN_SCHEMA)
+    for table in rollups.ROLLUP_TABLES:
+        raw.executescript(ROLLUP_SCHEMA.format(table=table))
+    # fill_alarms spreads alarms over clocks 1 to 10
+    raw.executemany("INSERT OR IGNORE INTO clocks (id, topic_key) VALUES (?, ?)", [(i, f"clock{i}") for i in range(2, 11)])
+    raw.commit()
+    raw.close()
+    db.checkout = lambda: StandInConnection(path)
+    db.connect = lambda: StandInConnection(path)
+
+def reset_table(path, table):
+    raw = sqlite3.connect(path)
+    raw.execute(f"DELETE FROM {table}")
+    raw.commit()
+    raw.close()
+
+def fill_alarms(path, count, clock_ids=10):
+    """
+    Inserts count alarms spread over the next 30 days, a quarter of them disabled.
+    """
+    rng = random.Random(count)
+    now = datetime.now().replace(second=0, microsecond=0)
+    rows = []
+    for _ in range(count):
+        fire_at = now + timedelta(minutes=rng.randint(2, 30 * 24 * 60))
+        rows.append((rng.randint(1, clock_ids), fire_at.strftime('%H:%M:%S'), fire_at.date(), '', 0, fire_at,
+                     rng.random() > 0.25))
+    raw = sqlite3.connect(path)
+    raw.executemany("INSERT INTO alarms (clock_id, alarm_time, alarm_date, repeat_days, repeat_mask, next_fire_at, enabled) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    raw.commit()
+    raw.close()
+
+# ---------------------------------------------------------------------------
+# local weather API stub
+
+WEATHER_RESPONSE = json.dumps({
+    'location': {'name': 'Lewisburg', 'region': 'Pennsylvania', 'country': 'USA', 'localtime': '2024-05-01 07:00'},
+    'current': {'temp_c': 12.0, 'temp_f': 53.6, 'condition': {'text': 'Sunny'}, 'wind_kph': 5.0, 'humidity': 60},
+}).encode()
+
+class WeatherStub(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(WEATHER_RESPONSE)))
+        self.end_headers()
+        self.wfile.write(WEATHER_RESPONSE)
+
+    def log_message(self, *args):
+        pass
+
+def start_weather_stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), WeatherStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ---------------------------------------------------------------------------
+# benchmarks
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+def bench_checker(path, sizes, ticks):
+    """
+    Measures schedule load time and idle / firing tick latency of check_alarm against growing alarm tables.
+    """
+    import check_alarm
+    client = check_alarm.start_mqtt()
+    results = []
+    for size in sizes:
+        reset_table(path, 'alarms')
+        fill_alarms(path, size)
+
+        start = time.perf_counter()
+        heap = check_alarm.load_alarm_schedule()
+        load_ms = (time.perf_counter() - start) * 1000
+
+        idle = []
+        for _ in range(ticks):
+            start = time.perf_counter()
+            check_alarm.seconds_until_next_alarm(heap)
+            check_alarm.check_alarms(client, heap)
+            idle.append((time.perf_counter() - start) * 1e6)
+
+        # make the earliest alarms due and time the tick that fires them
+        firing = []
+        for _ in range(min(ticks, len(heap), 20)):
+            fire_at, alarm_id, clock_id, repeat_mask = heap[0]
+            heap[0] = (datetime.now() - timedelta(seconds=1), alarm_id, clock_id, repeat_mask)
+            start = time.perf_counter()
+            check_alarm.check_alarms(client, heap)
+            firing.append((time.perf_counter() - start) * 1000)
+
+        results.append({
+            'alarms': size,
+            'scheduled': len(heap),
+            'load_ms': round(load_ms, 3),
+            'idle_tick_p50_us': round(percentile(idle, 50), 3),
+            'idle_tick_p99_us': round(percentile(idle, 99), 3),
+            'fire_tick_p50_ms': round(percentile(firing, 50), 3),
+            'fire_tick_p99_ms': round(percentile(firing, 99), 3),
+        })
+    return results
+
+def bench_ingest(path, messages):
+    """
+    Measures telemetry throughput from tables.on_message through the queue, spill log and batching writer into the database.
+    """
+    import tables
+    import db
+    import clocks
+    from spill import SpillLog
+    reset_table(path, 'weather_data')
+    q = Queue(maxsize=tables.QUEUE_SIZE)
+    spill = SpillLog(tempfile.mkdtemp(prefix='spill-'))
+    connection = db.connect()
+    cursor = connection.cursor()
+    payloads = [json.dumps({'temperature': 20 + i % 10, 'humidity': 40 + i % 20}).encode() for i in range(messages)]
+    done = threading.Event()
+
+    def consume():
+        while tables.ingest_stats['rows'] - start_rows < messages:
+            tables.process_once(q, cursor, spill)
+        done.set()
+
+    start_rows = tables.ingest_stats['rows']
+    start_spilled = tables.spilled.values.get((), 0)
+    consumer = threading.Thread(target=consume, daemon=True)
+    start = time.perf_counter()
+    consumer.start()
+    for payload in payloads:
+        tables.on_message(None, None, FakeMessage(clocks.telemetry_topic(clocks.DEFAULT_CLOCK_KEY), payload), dbqueue=q, spill=spill)
+    done.wait()
+    elapsed = time.perf_counter() - start
+    cursor.close()
+    connection.close()
+    spill.close()
+    return {
+        'messages': messages,
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(messages / elapsed, 1),
+        'batches': tables.ingest_stats['batches'],
+        'spilled': tables.spilled.values.get((), 0) - start_spilled,
+    }
+
+def bench_decode(messages):
+    """
+    Measures the cost of decoding one telemetry payload in the JSON and binary formats.
+    """
+    import telemetry_format
+    payloads = {
+        'json': [json.dumps({'temperature': 20 + i % 10, 'humidity': 40 + i % 20}).encode() for i in range(messages)],
+        'binary': [telemetry_format.encode(20 + i % 10, 40 + i % 20, clock_id=1) for i in range(messages)],
+    }
+    results = {}
+    for name, raw in payloads.items():
+        start = time.perf_counter()
+        for payload in raw:
+            telemetry_format.decode(payload)
+        elapsed = time.perf_counter() - start
+        results[name] = {'bytes': len(raw[0]), 'decode_us': round(elapsed / messages * 1e6, 3)}
+    return results
+
+def bench_routes(path, requests_per_route, workers, alarms):
+    """
+    Measures p50 / p99 latency and throughput of the main Flask routes under concurrent load.
+    """
+    reset_table(path, 'alarms')
+    fill_alarms(path, alarms)
+    import alarm_clock
+    stub = start_weather_stub()
+    alarm_clock.weather_url = f"http://127.0.0.1:{stub.server_address[1]}/v1/current.json"
+
+    day = (date.today() + timedelta(days=1)).isoformat()
+    routes = {
+        '/': lambda c: c.get('/'),
+        '/alarm': lambda c: c.get('/alarm'),
+        '/set_alarm': lambda c: c.post('/set_alarm', data={'alarm_time': f"{random.randint(0, 23):02d}:{random.randint(0, 59):02d}",
+                                                             'alarm_date': day, 'repeat_days': 'Mon,Wed'}),
+        '/weather': lambda c: c.get('/weather'),
+    }
+    results = {}
+    for route, call in routes.items():
+        latencies = []
+        lock = threading.Lock()
+
+        def worker(count):
+            client = alarm_clock.app.test_client()
+            local = []
+            for _ in range(count):
+                start = time.perf_counter()
+                response = call(client)
+                local.append((time.perf_counter() - start) * 1000)
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{route} returned {response.status_code}")
+            with lock:
+                latencies.extend(local)
+
+        per_worker = max(1, requests_per_route // workers)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            for future in [pool.submit(worker, per_worker) for _ in range(workers)]:
+                future.result()
+        elapsed = time.perf_counter() - start
+        results[route] = {
+            'requests': len(latencies),
+            'p50_ms': round(percentile(latencies, 50), 3),
+            'p99_ms': round(percentile(latencies, 99), 3),
+            'requests_per_sec': round(len(latencies) / elapsed, 1),
+        }
+    stub.shutdown()
+    return results
+
+# ---------------------------------------------------------------------------
+# regression check
+
+def flatten(results):
+    """
+    Flattens a results document into {metric name: (value, higher is better)}.
+    """
+    metrics = {}
+    for row in results.get('checker', []):
+        for key in ('load_ms', 'idle_tick_p99_us', 'fire_tick_p99_ms'):
+            metrics[f"checker[{row['alarms']}].{key}"] = (row[key], False)
+    if 'ingest' in results:
+        metrics['ingest.rows_per_sec'] = (results['ingest']['rows_per_sec'], True)
+    for name, row in results.get('decode', {}).items():
+        metrics[f"decode[{name}].decode_us"] = (row['decode_us'], False)
+    for route, row in results.get('routes', {}).items():
+        metrics[f"routes[{route}].p99_ms"] = (row['p99_ms'], False)
+        metrics[f"routes[{route}].requests_per_sec"] = (row['requests_per_sec'], True)
+    return metrics
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a list of messages for metrics that regressed by more than tolerance against baseline.
+    """
+    regressions = []
+    old = flatten(baseline)
+    for name, (value, higher_is_better) in flatten(results).items():
+        if name not in old or not old[name][0]:
+            continue
+        before = old[name][0]
+        change = (value - before) / before
+        if (higher_is_better and change < -tolerance) or (not higher_is_better and change > tolerance):
+            regressions.append(f"{name}: {before} -> {value} ({change:+.0%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output', default='bench_results.json', help="where to write the JSON results")
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed relative regression, default 0.25")
+    parser.add_argument('--quick', action='store_true', help="smaller tables and fewer requests")
+    parser.add_argument('--workers', type=int, default=8, help="concurrent clients for the route benchmark")
+    args = parser.parse_args()
+
+    sizes = [100, 1000, 10000] if args.quick else [100, 1000, 10000, 100000]
+    messages = 5000 if args.quick else 50000
+    requests_per_route = 200 if args.quick else 2000
+
+    # swap the network dependencies for in-process stand-ins before the app modules are imported
+    mqtt.Client = FakeClient
+    workdir = tempfile.mkdtemp(prefix='smart-alarm-bench-')
+    path = os.path.join(workdir, 'bench.sqlite3')
+    install_standin_db(path)
+
+    results = {'started_at': datetime.now().isoformat(timespec='seconds'), 'database': 'sqlite stand-in'}
+    # the app prints on every request and message, keep that out of the report but still pay for it
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results['checker'] = bench_checker(path, sizes, ticks=1000)
+        results['ingest'] = bench_ingest(path, messages)
+        results['decode'] = bench_decode(messages * 10)
+        results['routes'] = bench_routes(path, requests_per_route, args.workers, alarms=sizes[-1])
+
+    print(json.dumps(results, indent=2))
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("No regressions against baseline.")
+
+if __name__ == "__main__":
+    main()
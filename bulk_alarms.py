@@ -0,0 +1,159 @@
+'''
+Parsing, validation and formatting for bulk alarm import and export.
+
+Imports are read as a stream, one row at a time, so memory does not grow with
+the size of the upload. Accepted formats are CSV with a header row, JSON lines
+(one object per line) and a JSON array. Every row needs clock_id, alarm_date
+(YYYY-MM-DD) and alarm_time (HH:MM[:SS]), repeat_days and enabled are optional.
+'''
+import csv
+import io
+import json
+from datetime import timedelta
+from recurrence import parse_repeat_days, first_fire_time, format_repeat_days
+
+EXPORT_COLUMNS = ['id', 'clock_id', 'alarm_date', 'alarm_time', 'repeat_days', 'enabled', 'next_fire_at']
+
+# columns every imported row must have
+REQUIRED_COLUMNS = ('clock_id', 'alarm_date', 'alarm_time')
+
+# column order used when inserting validated rows
+INSERT_COLUMNS = "(clock_id, alarm_time, alarm_date, repeat_days, repeat_mask, next_fire_at, enabled)"
+
+# characters read at a time from a JSON array body, and the largest single row accepted
+JSON_CHUNK_SIZE = 64 * 1024
+MAX_JSON_ROW_SIZE = 1024 * 1024
+
+def iter_rows(stream, content_type):
+    """
+    Yields (line number, dict) for every row in an uploaded CSV or JSON body.
+    """
+    if content_type.startswith('application/json'):
+        yield from enumerate(iter_json_array(io.TextIOWrapper(stream, encoding='utf-8')), start=1)
+    elif content_type.startswith('application/x-ndjson') or content_type.startswith('application/jsonl'):
+        for number, line in enumerate(io.TextIOWrapper(stream, encoding='utf-8'), start=1):
+            if line.strip():
+                yield number, json.loads(line)
+    else:
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8', newline=''))
+        # line 1 is the header
+        for number, row in enumerate(reader, start=2):
+            yield number, row
+
+def iter_json_array(text, chunk_size=JSON_CHUNK_SIZE):
+    """
+    Yields the elements of a JSON array one at a time, reading the text chunk_size characters
+    at a time, so only the current element is held in memory. Raises ValueError on bad JSON.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    pos = 0
+    eof = False
+    # what comes next: '[', then a value or ']' ('first'), then ',' or ']' ('separator'), then a 'value'
+    expect = '['
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\n\r':
+            pos += 1
+        if pos == len(buffer):
+            if eof:
+                raise ValueError("unexpected end of JSON array")
+            buffer, pos = text.read(chunk_size), 0
+            eof = not buffer
+            continue
+        char = buffer[pos]
+        if expect == '[':
+            if char != '[':
+                raise ValueError("expected a JSON array of alarms")
+            pos += 1
+            expect = 'first'
+        elif char == ']' and expect != 'value':
+            return
+        elif expect == 'separator':
+            if char != ',':
+                raise ValueError(f"expected ',' or ']' in the JSON array, got {char!r}")
+            pos += 1
+            expect = 'value'
+        else:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                end = None
+            # a value that fails or stops at the end of the buffer may continue in the next chunk
+            if (end is None or end == len(buffer)) and not eof:
+                if len(buffer) - pos > MAX_JSON_ROW_SIZE:
+                    raise ValueError(f"a row is longer than {MAX_JSON_ROW_SIZE} characters")
+                chunk = text.read(chunk_size)
+                buffer, pos = buffer[pos:] + chunk, 0
+                eof = not chunk
+                continue
+            if end is None:
+                # raises the decoder's error for the whole value
+                value, end = decoder.raw_decode(buffer, pos)
+            yield value
+            pos = end
+            expect = 'separator'
+
+def parse_enabled(value):
+    if value is None or value == '':
+        return True
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'on')
+
+def validate_row(row, clock_exists=None):
+    """
+    Turns one uploaded row into a tuple of INSERT_COLUMNS values. Raises ValueError if it is invalid,
+    including when clock_exists is given and returns False for the row's clock_id.
+    """
+    if not isinstance(row, dict):
+        raise ValueError("row is not an object")
+    for column in REQUIRED_COLUMNS:
+        if row.get(column) in (None, ''):
+            raise ValueError(f"missing column '{column}'")
+    clock_id = row['clock_id']
+    # JSON gives numbers and CSV gives strings, anything else (lists, true, 1.5) is rejected
+    if isinstance(clock_id, str) and clock_id.strip().isdigit():
+        clock_id = int(clock_id)
+    if isinstance(clock_id, bool) or not isinstance(clock_id, int):
+        raise ValueError(f"clock_id must be a whole number, got {row['clock_id']!r}")
+    for column in ('alarm_date', 'alarm_time', 'repeat_days'):
+        if not isinstance(row.get(column) or '', str):
+            raise ValueError(f"{column} must be a string, got {row[column]!r}")
+    alarm_date = row['alarm_date'].strip()
+    alarm_time = row['alarm_time'].strip()
+    if clock_exists is not None and not clock_exists(clock_id):
+        raise ValueError(f"unknown clock_id {clock_id}")
+    repeat_days = (row.get('repeat_days') or '').strip()
+    repeat_mask = parse_repeat_days(repeat_days)
+    next_fire_at = first_fire_time(alarm_date, alarm_time, repeat_mask)
+    # store the normalised day list so exported files round trip
+    return (clock_id, alarm_time, alarm_date, format_repeat_days(repeat_mask), repeat_mask, next_fire_at,
+            parse_enabled(row.get('enabled')))
+
+def export_value(value):
+    if isinstance(value, bool) or value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, timedelta):
+        # MariaDB returns TIME as a timedelta, whose str drops the leading zero that imports need
+        seconds = int(value.total_seconds())
+        return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+    return str(value)
+
+def iter_export(rows, fmt):
+    """
+    Yields the export body for an iterator of alarm dicts, as CSV or JSON lines.
+    """
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow([export_value(row[column]) for column in EXPORT_COLUMNS])
+            if buffer.tell() > 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        for row in rows:
+            yield json.dumps({column: export_value(row[column]) for column in EXPORT_COLUMNS}) + "\n"
@@ -0,0 +1,166 @@
+'''
+Small in-process caches shared by the web app.
+'''
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+class TTLCache:
+    """
+    A thread-safe cache whose entries are fresh for ttl seconds.
+
+    After that an entry is served stale for up to stale_ttl more seconds while a single
+    background thread refreshes it. Concurrent misses on the same key wait for one
+    loader call instead of each calling it (single-flight).
+
+    example:
+
+    cache = TTLCache(ttl=60, stale_ttl=300)
+    data = cache.get('weather', fetch_weather)
+    """
+    def __init__(self, ttl, stale_ttl=0, max_entries=256):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.entries = {}   # key -> (value, time loaded)
+        self.inflight = {}  # key -> _Flight for loads in progress
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                age = now - entry[1]
+                if age < self.ttl:
+                    self.hits += 1
+                    return entry[0]
+                if age < self.ttl + self.stale_ttl:
+                    self.stale_hits += 1
+                    if key not in self.inflight:
+                        flight = self.inflight[key] = _Flight()
+                        threading.Thread(target=self._load, args=(key, loader, flight), daemon=True).start()
+                    return entry[0]
+            self.misses += 1
+            flight = self.inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[key] = _Flight()
+        if leader:
+            self._load(key, loader, flight)
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def invalidate(self, key=None):
+        """
+        Drops one key, or every key if none is given.
+        """
+        with self.lock:
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def hit_ratio(self):
+        lookups = self.hits + self.stale_hits + self.misses
+        return (self.hits + self.stale_hits) / lookups if lookups else 0.0
+
+    def _load(self, key, loader, flight):
+        try:
+            flight.value = loader()
+            with self.lock:
+                if key not in self.entries and len(self.entries) >= self.max_entries:
+                    # evict the oldest entry
+                    oldest = min(self.entries, key=lambda k: self.entries[k][1])
+                    del self.entries[oldest]
+                self.entries[key] = (flight.value, time.monotonic())
+        except Exception as e:
+            flight.error = e
+            print(f"Error refreshing cache entry {key}: {e}")
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            flight.done.set()
+
+class FragmentCache:
+    """
+    Rendered pages tagged with the version of the data they were rendered from.
+
+    Every change to the data bumps the version, which makes all entries stale at once
+    without touching them; a stale entry is rendered again on its next request. Entries
+    are grouped by page and clock, and each group keeps its max_entries most recently
+    used argument combinations, so paging deep into one clock cannot push out the
+    first page of another. The ETag is a hash of the HTML, so it is strong and the
+    same in every process.
+
+    example:
+
+    pages = FragmentCache()
+    html, etag = pages.get(('alarm', clock_id), args, lambda: render_template(...))
+    pages.bump()  # after changing the alarms table
+    """
+    def __init__(self, max_entries=16, max_groups=256):
+        self.max_entries = max_entries
+        self.max_groups = max_groups
+        self.version = 0
+        self.groups = OrderedDict()  # (page, clock) -> OrderedDict of args -> (version, html, etag)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self):
+        """
+        Marks every cached page as out of date.
+        """
+        with self.lock:
+            self.version += 1
+
+    def get(self, group, args, render):
+        """
+        Returns (html, etag) for the page, calling render only if there is no entry for the current version.
+        """
+        with self.lock:
+            # read the version before rendering, so a bump during the render leaves the entry stale
+            version = self.version
+            entries = self.groups.get(group)
+            entry = entries.get(args) if entries is not None else None
+            if entry is not None and entry[0] == version:
+                self.groups.move_to_end(group)
+                entries.move_to_end(args)
+                self.hits += 1
+                return entry[1], entry[2]
+            self.misses += 1
+        html = render()
+        etag = hashlib.sha1(html.encode()).hexdigest()
+        with self.lock:
+            entries = self.groups.get(group)
+            if entries is None:
+                entries = self.groups[group] = OrderedDict()
+                if len(self.groups) > self.max_groups:
+                    self.groups.popitem(last=False)
+            self.groups.move_to_end(group)
+            entries[args] = (version, html, etag)
+            entries.move_to_end(args)
+            if len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        return html, etag
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+class _Flight:
+    """
+    One loader call in progress, shared by every request waiting on the same key.
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
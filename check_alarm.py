@@ -1,95 +1,438 @@
 import mariadb
-from datetime import datetime
+import heapq
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
 import paho.mqtt.client as mqtt
 import time
+from queue import SimpleQueue, Empty
+from recurrence import next_occurrence_after
+import db
+import metrics
+import clocks
+from timing_wheel import TimingWheel
 
 # MQTT broker config
 MQTT_BROKER_HOST = "mqtt.bucknell.edu"
 MQTT_BROKER_PORT = 1883
-MQTT_ALARM = "iot/alarm/vk009_csci332"
-cached_connection = None
+# alarm_clock.py publishes here whenever the alarms table changes
+MQTT_CONTROL = "iot/control/vk009_csci332/alarms"
+# what we publish on MQTT_CONTROL after firing alarms, so the web app refreshes its next alarm cache
+FIRED_MESSAGE = "alarm fired"
+# clocks publish SNOOZE_ACTION (payload: seconds) and DISMISS_ACTION on iot/alarm/<topic key>/<action>
+SNOOZE_ACTION = "snooze"
+DISMISS_ACTION = "dismiss"
+DEFAULT_SNOOZE_SECONDS = 60
+MAX_SNOOZE_SECONDS = 3600
+# QoS for alarm messages, 1 makes the broker redeliver until the clock acknowledges
+MQTT_QOS = 1
+# bounds for the exponential backoff paho uses when reconnecting
+MQTT_RECONNECT_MIN_DELAY = 1
+MQTT_RECONNECT_MAX_DELAY = 60
 
-# Function to establish database connection
-def get_database_connection():
+# overdue alarms up to this old still ring, e.g. after the checker was down or stalled
+CATCH_UP_GRACE = timedelta(minutes=10)
+
+# recorded in the fire ledger so we can tell which replica fired an alarm
+CHECKER_ID = f"{socket.gethostname()}-{os.getpid()}"
+
+# reload the schedule at least this often in case a change message was missed
+SCHEDULE_RESYNC_SECONDS = 300
+
+# where the /metrics endpoint of this daemon listens
+METRICS_PORT = 9101
+
+# set by the MQTT thread when the alarms table changed and the heap must be rebuilt
+schedule_changed = threading.Event()
+# (topic key, action, payload) from the clocks' snooze and dismiss buttons, handled by the main loop
+snooze_events = SimpleQueue()
+# set by the MQTT thread to wake the main loop early
+wakeup = threading.Event()
+# registered clocks, for the topic of each clock and the clock of each topic
+clock_registry = clocks.ClockRegistry()
+
+schedule_loads = metrics.histogram('alarm_schedule_load_seconds', 'Time to load the alarm schedule from the database')
+schedule_size = metrics.gauge('alarm_schedule_size', 'Alarms in the in-memory schedule')
+alarms_fired = metrics.counter('alarms_fired_total', 'Alarm occurrences fired')
+fire_lag = metrics.histogram('alarm_fire_lag_seconds', 'Delay between an alarm\'s scheduled time and its MQTT publish',
+                             buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60))
+alarms_missed = metrics.counter('alarms_missed_total', 'Alarm occurrences older than the catch-up grace window')
+alarms_claimed_elsewhere = metrics.counter('alarms_claimed_elsewhere_total', 'Due alarms another checker fired first')
+snoozes_pending = metrics.gauge('alarm_snoozes_pending', 'Snoozed alarms waiting to ring again')
+snoozes_rung = metrics.counter('alarm_snoozes_rung_total', 'Snoozed alarms rung again')
+mqtt_reconnects = metrics.counter('mqtt_reconnects_total', 'Reconnects to the MQTT broker after the first connect')
+mqtt_connected_once = threading.Event()
+
+def load_alarm_schedule():
     """
-    A function to establish a connection with our database
+    Loads every enabled alarm that is still due into a min-heap keyed on its next fire time.
+    This is a single range lookup on the (enabled, next_fire_at) index. Alarms up to
+    CATCH_UP_GRACE overdue are included, so they fire on the next tick.
+    Returns None if the database could not be queried.
     """
+    try:
+        with schedule_loads.time(), db.cursor(dictionary=True) as cursor:
+            cursor.execute("SELECT id, clock_id, repeat_mask, next_fire_at FROM alarms WHERE enabled = TRUE AND next_fire_at >= ?",
+                           (datetime.now() - CATCH_UP_GRACE,))
+            rows = cursor.fetchall()
+    except mariadb.Error as e:
+        print(f"Error querying database: {e}")
+        return None
 
-    global cached_connection
-    if cached_connection is None:
-        try:
-            cached_connection = mariadb.connect(
-                host='eg-db.bucknell.edu',
-                database='vk009_csci332',
-                user='vk009_csci332',
-                password='oat3ceegok1mei1R'
-            )
-        except mariadb.Error as e:
-            print(f"Error connecting to database: {e}")
-    return cached_connection
-
-def check_alarms():
-    """
-    Checks the database for alarms set for the current time and publishes a message to MQTT if any are found.
-    """
-    connection = get_database_connection()
-    if connection:
-        try:
-            # retreive current date and time and print it on the server
-            current_datetime = datetime.now()
-            current_date = current_datetime.strftime("%Y-%m-%d")
-            current_time = current_datetime.strftime("%H:%M:00")
-            print("Current date & time:", current_date, current_time)
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute("SELECT * FROM alarms WHERE alarm_date = ? AND alarm_time >= ? AND enabled = TRUE ORDER BY alarm_date ASC, alarm_time ASC LIMIT 1", (current_date, current_time))
-            next_alarm = cursor.fetchall()
-            connection.commit()
-            if next_alarm:
-                next_alarm = next_alarm[0]
-                alarm_time = next_alarm['alarm_time']
-                alarm_date = next_alarm['alarm_date']
-                print(f"Next alarm is at {alarm_time} on {alarm_date}")
-                # checks the next alarm in the database and checks that time against the current time and publishes a message if the times match
-                if(str(alarm_time) == current_time and str(alarm_date) == current_date):
-                    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-                    client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT)
-                    client.publish(MQTT_ALARM, "Alarm is ringing")
-                    print("alarm is ringing")
-                    cursor.execute("UPDATE alarms SET enabled = FALSE WHERE alarm_date = ? AND alarm_time = ?", (alarm_date, alarm_time))
-                    connection.commit()
-                else:
-                    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-                    client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT)
-                    print("alarm is not ringing")
-            else:
-                print("No alarms scheduled.")
-
-        except mariadb.Error as e:
-            print(f"Error querying database: {e}")
+    heap = [(row['next_fire_at'], row['id'], row['clock_id'], row['repeat_mask']) for row in rows]
+    heapq.heapify(heap)
+    schedule_size.set(len(heap))
+    if heap:
+        print(f"Loaded {len(heap)} alarms, next alarm is at {heap[0][0]}")
     else:
-        print("Error connecting to database")
+        print("No alarms scheduled.")
+    return heap
+
+def alarm_topic(clock_id):
+    """
+    Returns the MQTT topic a single clock listens on for its alarms, iot/alarm/<topic key>,
+    or None if the clock is not in the registry.
+    """
+    key = clock_registry.topic_key(clock_id)
+    return None if key is None else clocks.alarm_topic(key)
+
+def publish_alarms(client, clock_ids):
+    """
+    Publishes the ringing message once to every clock in clock_ids over the shared client.
+    Clocks missing from the registry are logged and skipped, no device listens for them.
+    """
+    for clock_id in clock_ids:
+        topic = alarm_topic(clock_id)
+        if topic is None:
+            print(f"alarm for unregistered clock {clock_id}, not publishing it")
+            continue
+        client.publish(topic, "Alarm is ringing", qos=MQTT_QOS)
+        print(f"alarm is ringing on clock {clock_id}")
+
+def claim_alarms(due):
+    """
+    Records each due occurrence in the fire ledger and, in the same transaction, moves
+    repeating alarms on to their next occurrence and disables one-off alarms.
+    due is a list of (fire_at, alarm_id, clock_id, next_fire_at) with next_fire_at None for one-off alarms.
+
+    Returns the entries this checker claimed. Occurrences already in the ledger were fired by
+    another checker and are left out. If the database is unreachable every entry is returned,
+    an alarm that might ring twice is better than one that does not ring.
+    """
+    claimed = []
+    try:
+        with db.cursor() as cursor:
+            for entry in due:
+                fire_at, alarm_id, clock_id, next_fire_at = entry
+                cursor.execute("INSERT IGNORE INTO alarm_fires (alarm_id, fire_at, clock_id, checker) VALUES (?, ?, ?, ?)",
+                               (alarm_id, fire_at, clock_id, CHECKER_ID))
+                if cursor.rowcount != 1:
+                    alarms_claimed_elsewhere.inc()
+                    continue
+                if next_fire_at is None:
+                    cursor.execute("UPDATE alarms SET enabled = FALSE WHERE id = ? AND next_fire_at = ?", (alarm_id, fire_at))
+                else:
+                    cursor.execute("UPDATE alarms SET next_fire_at = ? WHERE id = ? AND next_fire_at = ?",
+                                   (next_fire_at, alarm_id, fire_at))
+                claimed.append(entry)
+    except mariadb.Error as e:
+        print(f"Error recording fired alarms {[entry[1] for entry in due]}, ringing them anyway: {e}")
+        return due
+    return claimed
+
+def skip_missed_alarms():
+    """
+    Deals with alarms that are more than CATCH_UP_GRACE overdue, which happens when the checker
+    was down or stalled, or an alarm was written with a time in the past. Repeating alarms move
+    on to their next future occurrence and one-off alarms are disabled, so neither rings late
+    nor stays stuck outside the window load_alarm_schedule reads. Returns how many it changed.
+    """
+    now = datetime.now()
+    missed = []
+    try:
+        with db.cursor(dictionary=True) as cursor:
+            cursor.execute("SELECT id, repeat_mask, next_fire_at FROM alarms WHERE enabled = TRUE AND next_fire_at < ?",
+                           (now - CATCH_UP_GRACE,))
+            missed = cursor.fetchall()
+            for row in missed:
+                print(f"alarm {row['id']} scheduled for {row['next_fire_at']} was missed")
+                next_fire_at = next_occurrence_after(row['repeat_mask'], row['next_fire_at'], now)
+                if next_fire_at is None:
+                    cursor.execute("UPDATE alarms SET enabled = FALSE WHERE id = ? AND next_fire_at = ?",
+                                   (row['id'], row['next_fire_at']))
+                else:
+                    cursor.execute("UPDATE alarms SET next_fire_at = ? WHERE id = ? AND next_fire_at = ?",
+                                   (next_fire_at, row['id'], row['next_fire_at']))
+        alarms_missed.inc(len(missed))
+    except mariadb.Error as e:
+        print(f"Error skipping missed alarms: {e}")
+        return 0
+    return len(missed)
+
+def resync_schedule(client):
+    """
+    Moves missed alarms on, then reloads the heap and the clock registry, so alarms of a clock
+    registered since the last load find its topic. Returns None if the database could not be queried.
+    """
+    clock_registry.refresh(force=True)
+    if skip_missed_alarms():
+        # let the web app refresh, our own on_message ignores this notice
+        client.publish(MQTT_CONTROL, FIRED_MESSAGE, qos=MQTT_QOS)
+    return load_alarm_schedule()
+
+def check_alarms(client, heap):
+    """
+    Pops every alarm whose fire time has passed off the heap, claims the occurrences in the
+    fire ledger and publishes one message per clock to MQTT for the ones we claimed.
+    Repeating alarms are pushed back onto the heap at their next occurrence.
+    """
+    now = datetime.now()
+    due = []
+    repeating = []
+    while heap and heap[0][0] <= now:
+        fire_at, alarm_id, clock_id, repeat_mask = heapq.heappop(heap)
+        print(f"alarm {alarm_id} scheduled for {fire_at} is due")
+        next_fire_at = next_occurrence_after(repeat_mask, fire_at, now) if repeat_mask else None
+        due.append((fire_at, alarm_id, clock_id, next_fire_at))
+        if next_fire_at is not None:
+            repeating.append((next_fire_at, alarm_id, clock_id, repeat_mask))
+    if not due:
+        return
+    claimed = claim_alarms(due)
+    if claimed:
+        publish_alarms(client, sorted({clock_id for _, _, clock_id, _ in claimed}))
+        published_at = datetime.now()
+        for fire_at, _, _, _ in claimed:
+            fire_lag.observe((published_at - fire_at).total_seconds())
+        alarms_fired.inc(len(claimed))
+        client.publish(MQTT_CONTROL, FIRED_MESSAGE, qos=MQTT_QOS)
+    for entry in repeating:
+        heapq.heappush(heap, entry)
+    schedule_size.set(len(heap))
+
+def load_snoozes(wheel):
+    """
+    Puts every snooze recorded in the alarms table onto the timing wheel, so snoozes survive
+    restarts of both the checker and the clock. Overdue ones ring on the next tick.
+    """
+    try:
+        with db.cursor(dictionary=True) as cursor:
+            cursor.execute("SELECT id, clock_id, snooze_time FROM alarms WHERE snooze_time IS NOT NULL")
+            rows = cursor.fetchall()
+    except mariadb.Error as e:
+        print(f"Error loading snoozed alarms: {e}")
+        return
+    for row in rows:
+        wheel.add(row['id'], row['snooze_time'].timestamp(), (row['clock_id'], row['snooze_time']))
+    snoozes_pending.set(len(wheel))
+    print(f"Loaded {len(rows)} snoozed alarms")
+
+def snooze_alarm(wheel, clock_id, seconds):
+    """
+    Snoozes the alarm the clock last rang: records snooze_time and snooze_duration and
+    puts the alarm on the timing wheel to ring again in seconds. Every checker gets the
+    event, so each one puts the stored snooze_time on its wheel, whichever checker wrote last.
+    """
+    snooze_time = (datetime.now() + timedelta(seconds=seconds)).replace(microsecond=0)
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT alarm_id FROM alarm_fires WHERE clock_id = ? ORDER BY fire_at DESC LIMIT 1", (clock_id,))
+            row = cursor.fetchone()
+            if row is None:
+                print(f"clock {clock_id} snoozed but has never rung, ignoring")
+                return
+            alarm_id = row[0]
+            cursor.execute("UPDATE alarms SET snooze_time = ?, snooze_duration = ? WHERE id = ?", (snooze_time, seconds, alarm_id))
+            cursor.execute("SELECT snooze_time FROM alarms WHERE id = ?", (alarm_id,))
+            row = cursor.fetchone()
+            if row is not None and row[0] is not None:
+                snooze_time = row[0]
+    except mariadb.Error as e:
+        print(f"Error recording snooze for clock {clock_id}: {e}")
+        return
+    wheel.add(alarm_id, snooze_time.timestamp(), (clock_id, snooze_time))
+    print(f"alarm {alarm_id} on clock {clock_id} snoozed until {snooze_time}")
+
+def dismiss_alarms(wheel, clock_id):
+    """
+    Cancels every pending snooze of the clock.
+    """
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT id FROM alarms WHERE clock_id = ? AND snooze_time IS NOT NULL", (clock_id,))
+            alarm_ids = [row[0] for row in cursor.fetchall()]
+            if alarm_ids:
+                cursor.execute("UPDATE alarms SET snooze_time = NULL WHERE clock_id = ? AND snooze_time IS NOT NULL", (clock_id,))
+    except mariadb.Error as e:
+        print(f"Error dismissing snoozes for clock {clock_id}: {e}")
+        return
+    for alarm_id in alarm_ids:
+        wheel.cancel(alarm_id)
+    if alarm_ids:
+        print(f"snoozed alarms {alarm_ids} on clock {clock_id} dismissed")
+
+def handle_snooze_events(wheel):
+    """
+    Applies the snooze and dismiss events the MQTT thread queued since the last call.
+    """
+    while True:
+        try:
+            key, action, payload = snooze_events.get_nowait()
+        except Empty:
+            break
+        clock_id = clock_registry.clock_id(key)
+        if clock_id is None:
+            print(f"{action} from unregistered clock {key}, ignoring")
+            continue
+        if action == SNOOZE_ACTION:
+            try:
+                seconds = int(payload or DEFAULT_SNOOZE_SECONDS)
+            except ValueError:
+                seconds = DEFAULT_SNOOZE_SECONDS
+            snooze_alarm(wheel, clock_id, min(max(seconds, 1), MAX_SNOOZE_SECONDS))
+        elif action == DISMISS_ACTION:
+            dismiss_alarms(wheel, clock_id)
+    snoozes_pending.set(len(wheel))
+
+def ring_snoozed_alarms(client, wheel):
+    """
+    Rings the snoozed alarms whose time has come. Each one is claimed by clearing its
+    snooze_time only if it still holds the time we scheduled, so exactly one checker rings it,
+    and the ring is recorded in the fire ledger. If the alarm was snoozed again meanwhile,
+    the stored time goes back on the wheel.
+    """
+    expired = wheel.advance()
+    if not expired:
+        return
+    claimed = []
+    try:
+        with db.cursor() as cursor:
+            for alarm_id, (clock_id, snooze_time), _ in expired:
+                cursor.execute("UPDATE alarms SET snooze_time = NULL WHERE id = ? AND snooze_time = ?", (alarm_id, snooze_time))
+                if cursor.rowcount != 1:
+                    alarms_claimed_elsewhere.inc()
+                    cursor.execute("SELECT snooze_time FROM alarms WHERE id = ?", (alarm_id,))
+                    row = cursor.fetchone()
+                    if row is not None and row[0] is not None and row[0] != snooze_time:
+                        wheel.add(alarm_id, row[0].timestamp(), (clock_id, row[0]))
+                    continue
+                cursor.execute("INSERT IGNORE INTO alarm_fires (alarm_id, fire_at, clock_id, checker) VALUES (?, ?, ?, ?)",
+                               (alarm_id, snooze_time, clock_id, CHECKER_ID))
+                claimed.append(clock_id)
+    except mariadb.Error as e:
+        print(f"Error recording snoozed alarms, ringing them anyway: {e}")
+        claimed = [clock_id for _, (clock_id, _), _ in expired]
+    if claimed:
+        publish_alarms(client, sorted(set(claimed)))
+        snoozes_rung.inc(len(claimed))
+    snoozes_pending.set(len(wheel))
+
+def seconds_until_next_alarm(heap):
+    """
+    Returns how long the checker may sleep before the next alarm is due or the schedule needs a resync.
+    """
+    if not heap:
+        return SCHEDULE_RESYNC_SECONDS
+    delay = (heap[0][0] - datetime.now()).total_seconds()
+    return max(0, min(delay, SCHEDULE_RESYNC_SECONDS))
+
+def seconds_until_next_snooze(wheel):
+    """
+    Returns how long the checker may sleep before the timing wheel needs advancing, or None if nothing is snoozed.
+    """
+    due = wheel.next_expiry()
+    if due is None:
+        return None
+    return max(0, due - time.time())
 
 def on_connect(client, userdata, flags, rc, properties=None):
     """
     Callback function that is called when the client connects to the MQTT broker.
-    Subscribes to the MQTT_ALARM topic to receive alarm messages.
+    Subscribes to the MQTT_CONTROL topic to hear about changes to the alarms table,
+    and to the clocks' snooze and dismiss events.
     """
     print(f"Connected to MQTT Broker with result code {rc}")
-    client.subscribe(MQTT_ALARM)
+    if mqtt_connected_once.is_set():
+        mqtt_reconnects.inc()
+    mqtt_connected_once.set()
+    client.subscribe([(MQTT_CONTROL, MQTT_QOS), (clocks.ALARM_EVENT_WILDCARD, MQTT_QOS)])
+    # we may have missed change messages while disconnected
+    schedule_changed.set()
+    wakeup.set()
 
+def on_disconnect(client, userdata, flags, rc, properties=None):
+    """
+    Callback function that is called when the connection to the MQTT broker drops.
+    The network loop reconnects on its own, messages published meanwhile are queued.
+    """
+    print(f"Disconnected from MQTT Broker with result code {rc}, reconnecting...")
 
-def main():
+def on_message(client, userdata, msg):
+    """
+    Callback function that is called when a change message is received on the MQTT_CONTROL topic,
+    or a clock sends a snooze or dismiss event.
+    Wakes the scheduler so it reloads the alarm heap. Our own fire notices are ignored,
+    the heap is already up to date for those. Snooze events are queued for the main loop.
+    """
+    if msg.topic == MQTT_CONTROL:
+        if msg.payload.decode() != FIRED_MESSAGE:
+            schedule_changed.set()
+            wakeup.set()
+        return
+    action = clocks.topic_action(msg.topic)
+    if action in (SNOOZE_ACTION, DISMISS_ACTION):
+        snooze_events.put((clocks.topic_key(msg.topic), action, msg.payload.decode()))
+        wakeup.set()
+
+def start_mqtt():
     """
-    Main function that sets up the MQTT client, connects to the broker, and starts checking for alarms.
+    Creates the long-lived MQTT client used both to publish alarms and to listen for schedule changes.
+    The background loop keeps the connection alive and reconnects with backoff if the broker goes away.
     """
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    client.on_message = on_message
+    client.reconnect_delay_set(min_delay=MQTT_RECONNECT_MIN_DELAY, max_delay=MQTT_RECONNECT_MAX_DELAY)
+    client.connect_async(MQTT_BROKER_HOST, MQTT_BROKER_PORT)
+    client.loop_start()
+    return client
 
+def main():
+    """
+    Main function that sets up the MQTT client, connects to the broker, and sleeps until each alarm is due.
+    """
+    metrics.start_http_server(METRICS_PORT)
+    client = start_mqtt()
+    # catch up after downtime: alarms within the grace window are loaded and fire on the first tick
+    heap = resync_schedule(client) or []
+    wheel = TimingWheel()
+    load_snoozes(wheel)
+    last_load = time.monotonic()
     try:
         while True:
-            check_alarms()
-            time.sleep(5)  # Check for alarms every 5 seconds
+            # sleep until the next alarm or snooze is due, waking early if the schedule changes or a clock snoozes
+            timeout = seconds_until_next_alarm(heap)
+            snooze_timeout = seconds_until_next_snooze(wheel)
+            if snooze_timeout is not None:
+                timeout = min(timeout, snooze_timeout)
+            wakeup.wait(timeout)
+            wakeup.clear()
+            if schedule_changed.is_set() or time.monotonic() - last_load >= SCHEDULE_RESYNC_SECONDS:
+                schedule_changed.clear()
+                reloaded = resync_schedule(client)
+                if reloaded is not None:
+                    heap = reloaded
+                last_load = time.monotonic()
+            handle_snooze_events(wheel)
+            check_alarms(client, heap)
+            ring_snoozed_alarms(client, wheel)
     except KeyboardInterrupt:
         print("Stopping alarm checking...")
-        #client.loop_stop()
+    finally:
+        client.disconnect()
+        client.loop_stop()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,163 @@
+'''
+The registry of clocks served by one deployment, and their MQTT topics.
+
+Every clock has a row in the clocks table with a topic key. It publishes telemetry on
+iot/telemetry/<key>, listens for alarms on iot/alarm/<key> and sends its button
+events on iot/alarm/<key>/snooze and iot/alarm/<key>/dismiss. The server processes
+subscribe with wildcards and map the key in a topic back to the clock id with a
+dict lookup, so one set of processes serves any number of clocks.
+
+example:
+
+registry = ClockRegistry()
+clock_id = registry.clock_id(topic_key(msg.topic))
+'''
+import re
+import threading
+import time
+import mariadb
+import db
+
+TELEMETRY_PREFIX = "iot/telemetry"
+ALARM_PREFIX = "iot/alarm"
+TELEMETRY_WILDCARD = f"{TELEMETRY_PREFIX}/+"
+ALARM_WILDCARD = f"{ALARM_PREFIX}/+"
+ALARM_EVENT_WILDCARD = f"{ALARM_PREFIX}/+/+"
+
+# the clock this deployment served before the registry existed, it keeps its topics
+DEFAULT_CLOCK_ID = 1
+DEFAULT_CLOCK_KEY = "vk009_csci332"
+
+# topic keys are a single topic level without MQTT wildcards
+TOPIC_KEY_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# how often an unknown topic key may trigger a reload of the registry, in seconds
+RELOAD_INTERVAL = 30
+
+def telemetry_topic(key):
+    return f"{TELEMETRY_PREFIX}/{key}"
+
+def alarm_topic(key):
+    return f"{ALARM_PREFIX}/{key}"
+
+def topic_key(topic):
+    """
+    Returns the clock's topic key from a topic like iot/telemetry/<key> or iot/alarm/<key>/snooze.
+    """
+    parts = topic.split('/')
+    return parts[2] if len(parts) > 2 else None
+
+def topic_action(topic):
+    """
+    Returns what follows the topic key, e.g. snooze for iot/alarm/<key>/snooze, or None.
+    """
+    parts = topic.split('/', 3)
+    return parts[3] if len(parts) > 3 else None
+
+def register_clock(cursor, key, name=None):
+    """
+    Adds a clock to the registry and returns its id. Raises ValueError for an invalid key.
+    """
+    if not TOPIC_KEY_PATTERN.match(key or ''):
+        raise ValueError("topic key must be 1 to 64 letters, digits, _ or -")
+    cursor.execute("INSERT INTO clocks (topic_key, name) VALUES (?, ?)", (key, name or key))
+    return cursor.lastrowid
+
+class ClockRegistry:
+    """
+    An in-memory copy of the clocks table, keyed both ways.
+
+    The first lookup loads the registry if nothing has yet. After that, lookups are plain
+    dict reads and never wait on the database, so they are safe in MQTT callbacks. A miss
+    starts a reload in a background thread, at most once every reload_interval seconds, so
+    a new clock is picked up without a restart and a flood of messages for unknown keys
+    does not hit the database.
+    """
+    def __init__(self, reload_interval=RELOAD_INTERVAL):
+        self.reload_interval = reload_interval
+        self.by_key = {}
+        self.by_id = {}
+        self.names = {}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+        self.reloading = False
+
+    def load(self):
+        with db.cursor() as cursor:
+            cursor.execute("SELECT id, topic_key, name FROM clocks ORDER BY id")
+            rows = cursor.fetchall()
+        # swap in whole dicts so readers never see a half loaded registry
+        self.by_key = {key: clock_id for clock_id, key, _ in rows}
+        self.by_id = {clock_id: key for clock_id, key, _ in rows}
+        self.names = {clock_id: name or key for clock_id, key, name in rows}
+        self.loaded_at = time.monotonic()
+
+    def refresh(self, force=False):
+        """
+        Reloads the registry if forced or if the last load is older than reload_interval.
+        Returns True if it reloaded.
+        """
+        with self.lock:
+            if not force and self.loaded_at is not None and time.monotonic() - self.loaded_at < self.reload_interval:
+                return False
+            try:
+                self.load()
+            except mariadb.Error as e:
+                # try again after reload_interval instead of on every message
+                self.loaded_at = time.monotonic()
+                print(f"Error loading the clock registry: {e}")
+                return False
+        return True
+
+    def refresh_in_background(self):
+        """
+        Starts a reload in a background thread unless one is running or the last load is
+        younger than reload_interval.
+        """
+        with self.lock:
+            if self.reloading or (self.loaded_at is not None and time.monotonic() - self.loaded_at < self.reload_interval):
+                return
+            self.reloading = True
+        threading.Thread(target=self._background_refresh, daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        finally:
+            self.reloading = False
+
+    def ensure_loaded(self):
+        """
+        Loads the registry unless it has been loaded (or tried) before.
+        """
+        if self.loaded_at is None:
+            self.refresh()
+
+    def clock_id(self, key):
+        """
+        Returns the id of the clock with this topic key, or None if it is not registered (yet).
+        """
+        self.ensure_loaded()
+        clock_id = self.by_key.get(key)
+        if clock_id is None and key is not None:
+            self.refresh_in_background()
+        return clock_id
+
+    def topic_key(self, clock_id):
+        """
+        Returns the topic key of a clock id, or None if it is not registered (yet).
+        """
+        self.ensure_loaded()
+        key = self.by_id.get(clock_id)
+        if key is None and clock_id is not None:
+            self.refresh_in_background()
+        return key
+
+    def clocks(self):
+        """
+        Returns every registered clock as a list of dicts, ordered by id.
+        """
+        self.ensure_loaded()
+        return [{'id': clock_id, 'topic_key': key, 'name': self.names.get(clock_id, key),
+                 'telemetry_topic': telemetry_topic(key), 'alarm_topic': alarm_topic(key)}
+                for clock_id, key in sorted(self.by_id.items())]
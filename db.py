@@ -0,0 +1,107 @@
+'''
+Shared database access for the web app, the alarm checker and the printer.
+
+Connections come from one bounded pool, are pinged before use and reconnected if
+the server dropped them, and always go back to the pool with their cursor closed.
+
+example:
+
+with db.cursor(dictionary=True) as cursor:
+    cursor.execute("SELECT * FROM alarms WHERE id = ?", (alarm_id,))
+    alarm = cursor.fetchone()
+'''
+import time
+from contextlib import contextmanager
+import threading
+import mariadb
+import metrics
+
+DB_CONFIG = {
+    'host': 'eg-db.bucknell.edu',
+    'database': 'vk009_csci332',
+    'user': 'vk009_csci332',
+    'password': 'oat3ceegok1mei1R',
+}
+
+POOL_NAME = 'smart_alarm'
+POOL_SIZE = 8
+# how long to wait for a free connection before giving up
+POOL_TIMEOUT = 5
+
+pool = None
+pool_lock = threading.Lock()
+
+checkout_seconds = metrics.histogram('db_checkout_seconds', 'Time spent waiting for a pooled connection')
+reconnects = metrics.counter('db_reconnects_total', 'Pooled connections that had to reconnect')
+query_seconds = metrics.histogram('db_query_seconds', 'Time spent running queries in a db.cursor() block')
+commit_seconds = metrics.histogram('db_commit_seconds', 'Time spent committing a db.cursor() block')
+
+def connect():
+    """
+    Opens a dedicated connection outside the pool, for long running writers such as tables.py.
+    """
+    return mariadb.connect(**DB_CONFIG)
+
+def get_pool():
+    """
+    Creates the connection pool on first use.
+    """
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = mariadb.ConnectionPool(pool_name=POOL_NAME, pool_size=POOL_SIZE, **DB_CONFIG)
+    return pool
+
+def checkout():
+    """
+    Takes a healthy connection from the pool, waiting up to POOL_TIMEOUT seconds for one to be free.
+    """
+    with checkout_seconds.time():
+        deadline = time.monotonic() + POOL_TIMEOUT
+        while True:
+            try:
+                conn = get_pool().get_connection()
+                break
+            except mariadb.PoolError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.01)
+        try:
+            conn.ping()
+        except mariadb.Error:
+            # the server closed the connection while it sat in the pool
+            reconnects.inc()
+            conn.reconnect()
+    return conn
+
+@contextmanager
+def connection():
+    """
+    Checks a connection out of the pool for the duration of the block.
+    Uncommitted work is rolled back if the block raises.
+    """
+    conn = checkout()
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        # closing a pooled connection returns it to the pool
+        conn.close()
+
+@contextmanager
+def cursor(dictionary=False):
+    """
+    Yields a cursor on a pooled connection and commits when the block finishes.
+    The cursor is always closed and the connection returned to the pool.
+    """
+    with connection() as conn:
+        cur = conn.cursor(dictionary=dictionary)
+        try:
+            with query_seconds.time():
+                yield cur
+            with commit_seconds.time():
+                conn.commit()
+        finally:
+            cur.close()
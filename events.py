@@ -0,0 +1,71 @@
+'''
+Fan-out of live events to Server-Sent Events clients.
+
+One MQTT subscriber publishes into an EventBroadcaster, every connected browser
+reads from its own bounded queue.
+'''
+import json
+import queue
+import threading
+
+class EventBroadcaster:
+    """
+    Delivers each published event to every subscriber's queue.
+
+    A subscriber that stops reading is not allowed to hold up the others, once its
+    queue is full new events for it are dropped.
+
+    example:
+
+    events = EventBroadcaster()
+    q = events.subscribe()
+    events.publish('alarm-fired', {'clock_id': 1})
+    print(q.get())
+    events.unsubscribe(q)
+    """
+    def __init__(self, max_queued=100):
+        self.max_queued = max_queued
+        self.subscribers = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        q = queue.Queue(maxsize=self.max_queued)
+        with self.lock:
+            self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def publish(self, event, data):
+        message = format_sse(event, data)
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                pass
+
+    def stream(self, heartbeat=15):
+        """
+        Generator of SSE text for one client. Sends a comment every heartbeat seconds
+        so proxies keep the connection open and disconnects are noticed.
+        """
+        q = self.subscribe()
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield q.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(q)
+
+def format_sse(event, data):
+    """
+    Formats one Server-Sent Event with a JSON data line.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
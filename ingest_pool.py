@@ -0,0 +1,177 @@
+'''
+Multi-process telemetry ingest for a fleet of clocks.
+
+A supervisor process subscribes to every clock's telemetry topic and hands each
+raw message to one of WORKERS worker processes, picked by a hash of the topic key,
+so all messages of a clock go to the same worker in order. Each worker decodes the messages, appends every one of them to
+its spill log first and writes them from there with the batching writer of
+tables.py, on its own database connection. Workers are started with the spawn
+method, so they share no connections or locks with the supervisor. The
+supervisor restarts workers that die, and the replacement replays whatever the
+dead worker had not committed yet from its spill log.
+
+    python ingest_pool.py [--workers 4]
+'''
+import argparse
+import multiprocessing
+import os
+import signal
+import threading
+import zlib
+from datetime import datetime
+from queue import Queue, Empty
+import mariadb
+import paho.mqtt.client as mqtt
+import tables
+import clocks
+import db
+import metrics
+from spill import SpillLog
+
+# number of worker processes, defaults to one per core
+WORKERS = os.cpu_count() or 1
+# how often the supervisor checks that every worker is alive, in seconds
+SUPERVISE_INTERVAL = 1
+# workers serve their metrics on METRICS_PORT + 1 + worker index
+METRICS_PORT = 9110
+
+# workers start in a fresh interpreter instead of a fork, so they do not inherit
+# the supervisor's pooled database connections, MQTT socket or held locks
+mp = multiprocessing.get_context('spawn')
+
+restarts = metrics.counter('telemetry_worker_restarts_total', 'Ingest worker processes restarted after dying')
+
+# Function to pick the worker for a telemetry topic
+def worker_for(topic, workers):
+    """
+    Returns the index of the worker handling a topic, from a hash of its topic key alone.
+    It does not depend on the clock registry, so a clock keeps its worker when it is
+    registered while messages are arriving (unknown clocks are dropped by the worker).
+    """
+    key = clocks.topic_key(topic)
+    return zlib.crc32((key or topic).encode()) % workers
+
+# Function run by every worker process
+def run_worker(index, inbox):
+    """
+    Appends raw messages from the supervisor to the worker's spill log and writes them to
+    the database from there until it receives None. A message is only removed from the
+    log once its batch is committed, so a replacement for a crashed worker replays the rest.
+    """
+    # the supervisor handles Ctrl-C and stops the workers with None
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # this process's own registry, loaded over its own connections
+    tables.clock_registry = clocks.ClockRegistry()
+    tables.clock_registry.refresh(force=True)
+    q = Queue(maxsize=tables.QUEUE_SIZE)
+    spill = SpillLog(os.path.join(tables.SPILL_DIR, f"worker-{index}"))
+    stop = threading.Event()
+    metrics.gauge('telemetry_spill_pending', 'Whether telemetry is waiting in the spill log', fn=lambda: int(spill.pending()))
+    metrics.start_http_server(METRICS_PORT + 1 + index)
+
+    def receive():
+        while True:
+            item = inbox.get()
+            if item is None:
+                break
+            topic, raw, received = item
+            tables.handle_payload(topic, raw, q, spill, received, write_ahead=True)
+        stop.set()
+
+    threading.Thread(target=receive, daemon=True).start()
+    try:
+        with db.connect() as con:
+            print(f"Ingest worker {index} (pid {os.getpid()}) connected to database")
+            tables.process_queue(q, con.cursor(), spill, stop=stop)
+    finally:
+        spill.close()
+
+class Supervisor:
+    """
+    Owns the MQTT client and the worker processes, and restarts workers that exit.
+    """
+    def __init__(self, workers=WORKERS):
+        self.workers = workers
+        self.inboxes = [None] * workers
+        self.processes = [None] * workers
+        # held while routing a message and while swapping a worker's inbox, so no message
+        # lands in an inbox after it was drained
+        self.lock = threading.Lock()
+
+    def start_worker(self, index):
+        inbox = mp.Queue()
+        with self.lock:
+            old = self.inboxes[index]
+            if old is not None:
+                # hand over messages the dead worker had not picked up yet, in order
+                while True:
+                    try:
+                        inbox.put(old.get(timeout=0.1))
+                    except (Empty, OSError, EOFError):
+                        break
+            self.inboxes[index] = inbox
+        process = mp.Process(target=run_worker, args=(index, inbox), name=f"ingest-worker-{index}", daemon=True)
+        process.start()
+        self.processes[index] = process
+
+    def on_connect(self, client, userdata, flags, rc, props):
+        print(f"Connected to {tables.MQTT_BROKER_HOST}:{tables.MQTT_BROKER_PORT} with result code {rc}/{props}")
+        client.subscribe(clocks.TELEMETRY_WILDCARD)
+        print(f"Subscribed to {clocks.TELEMETRY_WILDCARD}...")
+
+    def on_message(self, client, userdata, msg):
+        """
+        Routes the raw payload to its worker without decoding it, so the supervisor stays cheap.
+        """
+        index = worker_for(msg.topic, self.workers)
+        with self.lock:
+            self.inboxes[index].put((msg.topic, msg.payload, datetime.now()))
+
+    def supervise(self, stop):
+        while not stop.wait(SUPERVISE_INTERVAL):
+            for index, process in enumerate(self.processes):
+                if not process.is_alive():
+                    print(f"Ingest worker {index} exited with code {process.exitcode}, restarting it")
+                    restarts.inc()
+                    self.start_worker(index)
+
+    def run(self):
+        for index in range(self.workers):
+            self.start_worker(index)
+        client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
+        client.connect(tables.MQTT_BROKER_HOST, tables.MQTT_BROKER_PORT, 60)
+        client.loop_start()
+        stop = threading.Event()
+        try:
+            self.supervise(stop)
+        except KeyboardInterrupt:
+            print("Stopping ingest workers...")
+        finally:
+            client.loop_stop()
+            for inbox in self.inboxes:
+                inbox.put(None)
+            for process in self.processes:
+                process.join()
+
+# Main function
+def main():
+    """
+    Creates the tables once, then starts the supervisor and its worker processes.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=WORKERS, help='number of worker processes')
+    args = parser.parse_args()
+    try:
+        with db.connection() as con:
+            tables.create_tables(con.cursor())
+    except mariadb.Error as error:
+        print("Failed to create tables:", error)
+        return
+    metrics.start_http_server(METRICS_PORT)
+    print(f"Starting {args.workers} ingest workers")
+    Supervisor(args.workers).run()
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,82 @@
 import usocket as socket
 import time
-import random
 import json
+import struct
 import umqtt.simple as mqtt
 import neopixel
 import framebuf
+from array import array
+import machine
 from machine import Pin
 import utime
+import uasyncio as asyncio
 import network
 import ntptime
 from secMgr import SecretsManager
 
-# Set up the alarm output pin (assuming the light is connected to GPIO pin 0)
-alarm_pin = Pin(1, Pin.OUT)
+# The pins, sensor and display are created by setup_hardware, so the module can be imported without the board
+alarm_pin = None
+button1_LED_pin = None
+button1_value = None
+button2_LED_pin = None
+button2_value = None
 
-# Intialize button & button_LED values
-button1_LED_pin = Pin(5, Pin.OUT)
-button1_value = Pin(4, Pin.IN, pull = Pin.PULL_UP)
-
-button2_LED_pin = Pin(12, Pin.OUT)
-button2_value = Pin(13, Pin.IN, pull = Pin.PULL_UP)
-
-# global boolean check if there is a snoozed alarm
+# when a snoozed alarm should ring again, only used if the snooze could not be sent to the server
 next_alarm = None
 
-# Turn the alarm and buttons off initially
-alarm_pin.value(0)
-button1_LED_pin.value(0)
-button2_LED_pin.value(0)
+# how long a snooze lasts and how long to ignore contact bounce after a press
+SNOOZE_SECONDS = 60
+DEBOUNCE_MS = 200
 
 # MQTT Broker configuration
 MQTT_BROKER_HOST = "mqtt.bucknell.edu"
 MQTT_BROKER_PORT = 1883
-MQTT_TOPIC = "iot/telemetry/vk009_csci332"  # Adjust to your MQTT topic
-MQTT_ALARM = "iot/alarm/vk009_csci332"
+# the topic key and id this clock is registered under in the clocks table (POST /api/clocks)
+CLOCK_KEY = "vk009_csci332"
+CLOCK_ID = 1
+MQTT_TOPIC = f"iot/telemetry/{CLOCK_KEY}"
+MQTT_ALARM = f"iot/alarm/{CLOCK_KEY}"
+# how often to poll for MQTT messages, and the keepalive we promise the broker
+MQTT_POLL_MS = 100
+MQTT_KEEPALIVE = 60
+MQTT_RETRY_SECONDS = 5
+# check_alarm.py tracks snoozes on the server, the buttons publish to these subtopics of this clock's alarm topic
+SNOOZE_TOPIC = f"{MQTT_ALARM}/snooze"
+DISMISS_TOPIC = f"{MQTT_ALARM}/dismiss"
+
+# Telemetry is published every TELEMETRY_SECONDS in the binary format of telemetry_format.py:
+# magic, version, clock id, unix time and temperature in hundredths. Version 2 has no humidity,
+# the clock has no humidity sensor.
+TELEMETRY_SECONDS = 60
+TELEMETRY_MAGIC = 0xA7
+TELEMETRY_VERSION = 2
+TELEMETRY_FORMAT = '<BBHIh'
+# some ports count seconds from 2000 instead of 1970
+EPOCH_OFFSET = 946684800 if utime.gmtime(0)[0] == 2000 else 0
+# the RP2040's internal temperature sensor
+temperature_sensor = None
+# the current MQTT client, replaced by mqtt_task when it reconnects
+mqtt_client = None
+
+# button presses recorded by the pin interrupts and handled by button_task
+SNOOZE = 0
+OFF = 1
+pressed = [False, False]
+last_press_ms = [0, 0]
+button_event = asyncio.ThreadSafeFlag()
+
+def make_button_handler(button):
+    """
+    Returns a pin interrupt handler that records a debounced press of button and wakes button_task.
+    """
+    def handler(pin):
+        now = utime.ticks_ms()
+        if utime.ticks_diff(now, last_press_ms[button]) < DEBOUNCE_MS:
+            return
+        last_press_ms[button] = now
+        pressed[button] = True
+        button_event.set()
+    return handler
 
 def connect_wifi():
     """
@@ -75,7 +118,7 @@ def connect_wifi():
         if time.time() - start_time > timeout:
             print("Failed to connect to WiFi. Timeout reached.")
             return None  # Return None to indicate failure
-        #time.sleep(1)  # Wait 1 second before checking again
+        time.sleep(1)  # Wait 1 second before checking again
 
     print("Wifi connected successfully.")
     return wlan
@@ -109,108 +152,157 @@ def xyindex_to_string_pos(i, width=32, height=8):
 assert xyindex_to_string_pos(0) == 0
 assert xyindex_to_string_pos(1) == 15
 assert xyindex_to_string_pos(2) == 16
-time.sleep(1)
+
+# lookup table from an RGB565 colour to its bytes in the neopixel strip order, filled on first use
+color_lut = {}
+
+def strip_bytes(neop, color):
+    """
+    Returns the strip bytes for an RGB565 colour, converting it once and caching it in color_lut.
+    """
+    b = color_lut.get(color)
+    if b is None:
+        rgb = rgb565.get_rgb(color)
+        b = bytearray(3)
+        for i in range(3):
+            b[neop.ORDER[i]] = rgb[i]
+        color_lut[color] = b
+    return b
 
 # display function to update neopixel display with the given pixmap and data
 def display(neop, pixmap, pixels):
-    global np_width, np_height, fb_width, fb_height
-    for y in range(0, np_height):
-        for x in range(0, np_width):
-            # this is the framebuffer index, two bytes per pixel
-            p = 2 * (y * fb_width + x)
-            neop[pixmap[p // 2]] = rgb565.get_rgb((pixels[p] << 8) | pixels[p + 1])
+    """
+    Copies the visible part of the framebuffer into the strip buffer and writes it out.
+    pixmap holds pairs of (framebuffer byte offset, strip byte offset) for every LED.
+    """
+    buf = neop.buf
+    for i in range(0, len(pixmap), 2):
+        p = pixmap[i]
+        s = pixmap[i + 1]
+        buf[s:s + 3] = strip_bytes(neop, (pixels[p] << 8) | pixels[p + 1])
     neop.write()
 
 # Create a pixmap mapping for the given width, height, framebuffer width, and framebuffer height
 def make_pix_map(width, height, fb_width, fb_height):
-    pixmap = []
-    for y in range(0, fb_height):
-        for x in range(0, fb_width):
-            pixmap.append(xyindex_to_string_pos(y * np_width + x))
+    """
+    Precomputes the byte offsets used by display, so the per-frame loop does no index math.
+    Only the width x height pixels shown on the strip are mapped.
+    """
+    pixmap = array('H')
+    for y in range(0, height):
+        for x in range(0, width):
+            # two bytes per pixel in the framebuffer, three per LED on the strip
+            pixmap.append(2 * (y * fb_width + x))
+            pixmap.append(3 * xyindex_to_string_pos(y * width + x, width, height))
     return pixmap
 
-# 256 LED strip connected to pin0.
-p = Pin(0)
+# 256 LED strip connected to pin0, created by setup_hardware
 np_width = 32
 np_height = 8
-n = neopixel.NeoPixel(p, np_width * np_height)
+n = None
 
 # framebuffer, adding one extra 8 pixel column for scrolling (5 chars)
 fb_width = 40
 fb_height = 8
 pixels = bytearray(fb_width * fb_height * 2)
-
-# Create a frame buffer for the display. (one extra pixel for scrolling)
-fb = framebuf.FrameBuffer(pixels, fb_width, fb_height, framebuf.RGB565)
+fb = None
 
 # map the frame buffer to the neopixel strip array
 pixmap = make_pix_map(np_width, np_height, fb_width, fb_height)
 
+# the HH:MM currently on the display, so we only redraw when it changes
+shown_time = None
+
+def setup_hardware():
+    """
+    Sets up the alarm and button pins, the button interrupts, the temperature sensor and the LED display,
+    and turns the alarm and button LEDs off.
+    """
+    global alarm_pin, button1_LED_pin, button1_value, button2_LED_pin, button2_value
+    global temperature_sensor, n, fb
+
+    # Set up the alarm output pin (assuming the light is connected to GPIO pin 1)
+    alarm_pin = Pin(1, Pin.OUT)
+
+    # Intialize button & button_LED values
+    button1_LED_pin = Pin(5, Pin.OUT)
+    button1_value = Pin(4, Pin.IN, pull = Pin.PULL_UP)
+
+    button2_LED_pin = Pin(12, Pin.OUT)
+    button2_value = Pin(13, Pin.IN, pull = Pin.PULL_UP)
+
+    # Turn the alarm and buttons off initially
+    alarm_pin.value(0)
+    button1_LED_pin.value(0)
+    button2_LED_pin.value(0)
+
+    # snooze is the button on pin 4, off is the button on pin 13
+    button1_value.irq(trigger=Pin.IRQ_FALLING, handler=make_button_handler(SNOOZE))
+    button2_value.irq(trigger=Pin.IRQ_FALLING, handler=make_button_handler(OFF))
+
+    temperature_sensor = machine.ADC(4)
+
+    n = neopixel.NeoPixel(Pin(0), np_width * np_height)
+    # Create a frame buffer for the display. (one extra pixel for scrolling)
+    fb = framebuf.FrameBuffer(pixels, fb_width, fb_height, framebuf.RGB565)
+    time.sleep(1)
+
 
 def clock_time():
     """
-    A function to retreive the current time and display it on the LEDs
+    A function to retreive the current time and display it on the LEDs.
+    The display is only redrawn and written when the minute changes.
     """
+    global shown_time
 
     # retreives the local time from the network
     current_time = utime.localtime()
     hour = current_time[3] - 4
     minute = current_time[4]
 
-    # update time every minute
-    if current_time[5] == 0:
-        current_time = utime.localtime()
-        hour = current_time[3] - 4
-        minute = current_time[4]
+    text = "{:02d}{:02d}".format(hour, minute)
+    if text == shown_time:
+        return
+    shown_time = text
 
     # displays the current time on the LEDs
     fb.fill(0)
-    fb.text("{:02d}{:02d}".format(hour, minute), 0, 0, rgb565.as_int16(0x1f, 0x2f, 0x1f))
+    fb.text(text, 0, 0, rgb565.as_int16(0x1f, 0x2f, 0x1f))
     display(n, pixmap, pixels)
 
-def on_message(topic, message):
+def start_ringing():
     """
-    Callback function that is called when a new message is received on the MQTT topic.
-    If the message contains alarm information, it checks if it's time for the alarm to ring
-    and triggers an alert if so.
+    Turns the alarm and the button LEDs on. Presses from before the alarm started are ignored.
     """
-    global next_alarm
-    global message_received
+    pressed[SNOOZE] = False
+    pressed[OFF] = False
+    alarm_pin.value(1)
+    button1_LED_pin.value(1)
+    button2_LED_pin.value(1)
 
-    message_received = True  # Set the flag to True when a message is received
+def stop_ringing():
+    """
+    Turns the alarm and the button LEDs off.
+    """
+    button1_LED_pin.value(0)
+    button2_LED_pin.value(0)
+    alarm_pin.value(0)
 
+def on_message(topic, message):
+    """
+    Callback function that is called when a new message is received on the MQTT topic.
+    If the message says the alarm is ringing it turns the alarm on, the buttons are
+    handled by button_task so MQTT keeps being serviced while it rings.
+    """
+    payload = message
     try:
         payload = message.decode()
         print(f"Received message: {payload}")
         if payload == "Alarm is ringing":
             # turn alarm on & button on if the received message says the alarm is ringing
-            alarm_pin.value(1)
-            button1_LED_pin.value(1)
-            button2_LED_pin.value(1)
+            start_ringing()
             print("Alarm is ringing!")
 
-            # need to check buttons while alarm is ringing
-            while (alarm_pin.value() == 1):
-                clock_time()
-                if button1_value.value() == 0: # this is snooze, so set another alarm
-                    print("Snooze button pushed! Another alarm will go off in approximately 1 minute.")
-                    button1_LED_pin.value(0)
-                    button2_LED_pin.value(0)
-
-                    # set the time for the snoozed alarm to go off
-                    if next_alarm is None:
-                        next_alarm = (utime.time() + 1 * 60)
-
-                    # turn the alarm off if snooze was pressed
-                    alarm_pin.value(0)
-
-                # checks if the off button was pressed and turns the alarm abd buttons off if so
-                elif button2_value.value() == 0:
-                    print("Off button pushed. Your alarm has been turned off completely. Hope you are awake!!")
-                    button1_LED_pin.value(0)
-                    button2_LED_pin.value(0)
-                    alarm_pin.value(0)
-
         # the alarm or buttons should not be going off if the alarm is not rining
         else:
             alarm_pin.value(0)
@@ -218,6 +310,20 @@ def on_message(topic, message):
     except Exception as e:
         print(f"Error processing message {payload}: {e}")
 
+def encode_telemetry(temperature):
+    """
+    Packs a reading into the 10 byte binary telemetry format, which is much smaller than JSON over the radio.
+    """
+    return struct.pack(TELEMETRY_FORMAT, TELEMETRY_MAGIC, TELEMETRY_VERSION, CLOCK_ID,
+                       utime.time() + EPOCH_OFFSET, round(temperature * 100))
+
+def read_temperature():
+    """
+    Reads the temperature from the internal sensor. The clock has no humidity sensor, so no humidity is sent.
+    """
+    volts = temperature_sensor.read_u16() * 3.3 / 65535
+    return 27 - (volts - 0.706) / 0.001721
+
 def check_alarm():
     """
     A function to check if the snooze button was pushed on an alarm.
@@ -231,29 +337,44 @@ def check_alarm():
     if next_alarm is not None and utime.time() >= next_alarm:
         print("Snoozed alarm is ringing! Time to get up!")
         # turn on alarm and button if a snoozed alarm was triggered
-        alarm_pin.value(1)
-        button1_LED_pin.value(1)
-        button2_LED_pin.value(1)
         next_alarm = None
+        start_ringing()
 
-        # handles when an alarm is ringing and button pushes
-        while (alarm_pin.value() == 1):
-            clock_time()
-            if button1_value.value() == 0: # this is snooze, so set another one
-            # turn current_alarm_enabled = false and generate a new alarm for 5 minutes later
-                print("Snooze button pushed! Another alarm will go off in approximately 1 minute.")
-                button1_LED_pin.value(0)
-                button2_LED_pin.value(0)
-
-                if next_alarm is None:
-                    next_alarm = (utime.time() + 1 * 60)
-                alarm_pin.value(0)
-
-            elif button2_value.value() == 0:
-                print("Off button pushed. Your snoozed alarm has been turned off completely. Hope you are awake!!")
-                button1_LED_pin.value(0)
-                button2_LED_pin.value(0)
-                alarm_pin.value(0)
+def send_button_event(topic, payload):
+    """
+    Publishes a snooze or dismiss event to the server. Returns False if it could not be sent.
+    """
+    try:
+        mqtt_client.publish(topic, payload, qos=1)
+        return True
+    except (OSError, AttributeError) as e:
+        print(f"Error sending {topic}: {e}")
+        return False
+
+def handle_buttons():
+    """
+    Acts on the button presses recorded since the last call while the alarm is ringing.
+    Snooze asks the server to ring again SNOOZE_SECONDS from now, off turns the alarm off completely.
+    The server keeps the snooze, so it survives a reboot; if it can't be reached the snooze is kept here.
+    """
+    global next_alarm
+
+    if alarm_pin.value() == 1:
+        if pressed[SNOOZE]: # this is snooze, so set another alarm
+            print("Snooze button pushed! Another alarm will go off in approximately 1 minute.")
+            stop_ringing()
+            # fall back to a local snooze if the server does not hear about it
+            if not send_button_event(SNOOZE_TOPIC, str(SNOOZE_SECONDS)) and next_alarm is None:
+                next_alarm = utime.time() + SNOOZE_SECONDS
+
+        # checks if the off button was pressed and turns the alarm abd buttons off if so
+        elif pressed[OFF]:
+            print("Off button pushed. Your alarm has been turned off completely. Hope you are awake!!")
+            stop_ringing()
+            next_alarm = None
+            send_button_event(DISMISS_TOPIC, "")
+    pressed[SNOOZE] = False
+    pressed[OFF] = False
 
 def set_time():
     """
@@ -271,34 +392,96 @@ def set_time():
         else:
             print(f"Error setting time: {e}")
 
-def main():
+def connect_mqtt():
     """
-    Main function that sets up the MQTT client, connects to the broker, and checks for alarm set by the user.
+    Connects to the MQTT broker and subscribes to this clock's alarm topic.
     """
-    connect_wifi()
-    ntptime.settime()
-    clock_time()
-    client = mqtt.MQTTClient(client_id=machine.unique_id().hex(), server=MQTT_BROKER_HOST, port=MQTT_BROKER_PORT)
-    client.connect()
+    client = mqtt.MQTTClient(client_id=machine.unique_id().hex(), server=MQTT_BROKER_HOST, port=MQTT_BROKER_PORT,
+                             keepalive=MQTT_KEEPALIVE)
     client.set_callback(on_message)
+    client.connect()
     client.subscribe(MQTT_ALARM)
+    return client
 
-    message_received = False  # Flag to track whether a message has been received
-
-    while not message_received:
-        client.check_msg()
+async def mqtt_task(client):
+    """
+    Polls for MQTT messages and pings the broker so the keepalive never lapses, reconnecting on errors.
+    """
+    global mqtt_client
+    last_ping = utime.ticks_ms()
+    while True:
+        try:
+            client.check_msg()
+            if utime.ticks_diff(utime.ticks_ms(), last_ping) > MQTT_KEEPALIVE * 500:
+                client.ping()
+                last_ping = utime.ticks_ms()
+        except OSError as e:
+            print(f"MQTT connection lost ({e}), reconnecting...")
+            await asyncio.sleep(MQTT_RETRY_SECONDS)
+            try:
+                client = mqtt_client = connect_mqtt()
+                last_ping = utime.ticks_ms()
+            except OSError as e:
+                print(f"Error reconnecting to MQTT broker: {e}")
+        await asyncio.sleep_ms(MQTT_POLL_MS)
+
+async def telemetry_task():
+    """
+    Publishes a binary telemetry reading every TELEMETRY_SECONDS.
+    """
+    while True:
+        try:
+            mqtt_client.publish(MQTT_TOPIC, encode_telemetry(read_temperature()))
+        except OSError as e:
+            # mqtt_task reconnects, the next reading will go out then
+            print(f"Error publishing telemetry: {e}")
+        await asyncio.sleep(TELEMETRY_SECONDS)
+
+async def display_task():
+    """
+    Redraws the clock, then sleeps until the next minute starts.
+    """
+    while True:
         clock_time()
+        await asyncio.sleep(60 - utime.localtime()[5])
+
+async def snooze_task():
+    """
+    Rings snoozed alarms once they are due.
+    """
+    while True:
         check_alarm()
-        if message_received:
-            break
+        await asyncio.sleep(1)
 
+async def button_task():
+    """
+    Waits for a button interrupt and handles the press.
+    """
+    while True:
+        await button_event.wait()
+        handle_buttons()
+
+async def run():
+    """
+    Starts the MQTT, telemetry, display, snooze and button tasks on the cooperative scheduler.
+    """
+    global mqtt_client
+    client = mqtt_client = connect_mqtt()
+    await asyncio.gather(mqtt_task(client), telemetry_task(), display_task(), snooze_task(), button_task())
+
+def main():
+    """
+    Main function that sets up the hardware, connects to the wifi, sets the time and runs the alarm clock tasks.
+    """
+    setup_hardware()
+    connect_wifi()
+    set_time()
     try:
-        while True:
-            client.check_msg()
-            clock_time()
-            check_alarm()
+        asyncio.run(run())
     except KeyboardInterrupt:
         print("Stopping telemetry data simulation...")
+    finally:
+        asyncio.new_event_loop()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,206 @@
+'''
+Process metrics in the Prometheus text format, and sampled logging for hot paths.
+
+Metrics are registered once at module level and updated from the code that does
+the work. The Flask app serves them on /metrics, the check_alarm and tables
+daemons call start_http_server() to serve them on their own port.
+
+example:
+
+inserts = metrics.counter('telemetry_rows_inserted_total', 'Telemetry rows written to weather_data')
+inserts.inc(len(rows))
+'''
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# default latency buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = {}
+registry_lock = threading.Lock()
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{v}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+class Metric:
+    """
+    Base class holding one value per combination of label values.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = dict(self.values)
+        if not values and not self.label_names:
+            values[()] = 0
+        return self.header() + [f"{self.name}{format_labels(self.label_names, k)} {v}" for k, v in values.items()]
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. If fn is given it is called at scrape time instead.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), fn=None):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+
+    def set(self, value, *label_values):
+        with self.lock:
+            self.values[label_values] = value
+
+    def render(self):
+        if self.fn is not None:
+            values = {(): self.fn()}
+        else:
+            with self.lock:
+                values = dict(self.values)
+        return self.header() + [f"{self.name}{format_labels(self.label_names, k)} {v}" for k, v in values.items()]
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.values.get(label_values)
+            if series is None:
+                series = self.values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *label_values):
+        """
+        Context manager that observes how long its block took.
+        """
+        return _Timer(self, label_values)
+
+    def render(self):
+        with self.lock:
+            values = {k: (list(v[0]), v[1], v[2]) for k, v in self.values.items()}
+        lines = self.header()
+        for label_values, (counts, total, count) in values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                labels = format_labels(self.label_names + ('le',), label_values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.label_names + ('le',), label_values + ('+Inf',))
+            lines.append(f"{self.name}_bucket{labels} {count}")
+            plain = format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{plain} {total}")
+            lines.append(f"{self.name}_count{plain} {count}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+def register(metric):
+    """
+    Adds a metric to the registry, or returns the one already registered under its name.
+    """
+    with registry_lock:
+        return registry.setdefault(metric.name, metric)
+
+def counter(name, help_text, labels=()):
+    return register(Counter(name, help_text, labels))
+
+def gauge(name, help_text, labels=(), fn=None):
+    return register(Gauge(name, help_text, labels, fn))
+
+def histogram(name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+    return register(Histogram(name, help_text, labels, buckets))
+
+def render():
+    """
+    Returns every registered metric in the Prometheus text exposition format.
+    """
+    with registry_lock:
+        metrics = list(registry.values())
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_http_server(port, host='0.0.0.0'):
+    """
+    Serves /metrics from a background thread, for the daemons that do not run Flask.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+# ---------------------------------------------------------------------------
+# sampled structured logging
+
+log_counts = {}
+log_lock = threading.Lock()
+
+def log_sampled(event, every=100, **fields):
+    """
+    Prints one JSON log line for the first and then every Nth occurrence of event,
+    with the number of occurrences so far, so hot paths do not flood the log.
+    """
+    with log_lock:
+        count = log_counts.get(event, 0) + 1
+        log_counts[event] = count
+    if count == 1 or count % every == 0:
+        fields = {'time': datetime.now().isoformat(timespec='milliseconds'), 'event': event, 'count': count, **fields}
+        print(json.dumps(fields, default=str))
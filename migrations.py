@@ -0,0 +1,185 @@
+'''
+Versioned schema migrations.
+
+Each migration runs once, in order, and records its version in schema_version.
+Steps only use IF NOT EXISTS DDL so re-running a half applied migration is safe
+(MariaDB commits DDL immediately, so a migration can not be rolled back).
+
+Run this file to bring the database up to date:
+
+    python migrations.py
+'''
+import mariadb
+from recurrence import parse_repeat_days, first_fire_time
+from clocks import DEFAULT_CLOCK_ID, DEFAULT_CLOCK_KEY
+import db
+
+# Function to fill in the recurrence columns for alarms written before they existed
+def backfill_next_fire(cursor):
+    """
+    Computes repeat_mask and next_fire_at for enabled alarms that do not have them yet.
+    """
+    cursor.execute("SELECT id, alarm_date, alarm_time, repeat_days FROM alarms WHERE enabled = TRUE AND next_fire_at IS NULL")
+    rows = cursor.fetchall()
+    updates = []
+    for alarm_id, alarm_date, alarm_time, repeat_days in rows:
+        try:
+            mask = parse_repeat_days(repeat_days)
+        except ValueError as e:
+            print(f"Alarm {alarm_id} has invalid repeat days, treating it as one-off: {e}")
+            mask = 0
+        updates.append((mask, first_fire_time(alarm_date, alarm_time, mask), alarm_id))
+    if updates:
+        cursor.executemany("UPDATE alarms SET repeat_mask = ?, next_fire_at = ? WHERE id = ?", updates)
+        print(f"Backfilled next_fire_at for {len(updates)} alarms.")
+
+def add_recurrence_columns(cursor):
+    """
+    Adds repeat_mask and next_fire_at to alarms tables created before recurrence support.
+    """
+    cursor.execute("ALTER TABLE alarms ADD COLUMN IF NOT EXISTS repeat_mask TINYINT UNSIGNED NOT NULL DEFAULT 0")
+    cursor.execute("ALTER TABLE alarms ADD COLUMN IF NOT EXISTS next_fire_at DATETIME")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarms_next_fire ON alarms (enabled, next_fire_at)")
+    backfill_next_fire(cursor)
+
+def add_query_indexes(cursor):
+    """
+    Adds indexes for the hot alarm and telemetry queries.
+    """
+    # enabled alarms by date and time
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarms_enabled_date_time ON alarms (enabled, alarm_date, alarm_time)")
+    # keyset pagination on /alarm, with and without a clock filter
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarms_date_time_id ON alarms (alarm_date, alarm_time, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarms_clock_date_time_id ON alarms (clock_id, alarm_date, alarm_time, id)")
+    # per clock telemetry by time
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_weather_clock_time ON weather_data (clock_id, timestamp)")
+
+def add_fire_ledger(cursor):
+    """
+    Adds the fire ledger, one row per alarm occurrence that was fired. The primary key
+    makes claiming an occurrence atomic, so several checkers never ring it twice.
+    """
+    cursor.execute("""CREATE TABLE IF NOT EXISTS alarm_fires (
+            alarm_id INTEGER NOT NULL,
+            fire_at DATETIME NOT NULL,
+            clock_id INTEGER,
+            fired_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            checker VARCHAR(64),
+            PRIMARY KEY (alarm_id, fire_at)
+            )""")
+
+def add_snooze_tracking(cursor):
+    """
+    Prepares snooze_time and snooze_duration for the server side snoozes in check_alarm.py.
+    With explicit_defaults_for_timestamp off, older MariaDB versions gave the first TIMESTAMP
+    column DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP, which would make every
+    updated alarm look snoozed, so the column is made a plain nullable one and cleared
+    (nothing wrote real snoozes before this).
+    """
+    cursor.execute("ALTER TABLE alarms MODIFY snooze_time TIMESTAMP NULL DEFAULT NULL")
+    cursor.execute("UPDATE alarms SET snooze_time = NULL, snooze_duration = NULL")
+    # pending snoozes are loaded on startup
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarms_snooze_time ON alarms (snooze_time)")
+    # the alarm a clock last rang, looked up when it sends a snooze
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarm_fires_clock ON alarm_fires (clock_id, fire_at)")
+
+def add_clock_registry(cursor):
+    """
+    Adds the clocks table. The clock this deployment served before keeps its id and
+    old topics, other clock ids already used by alarms or telemetry are registered
+    with their id as topic key.
+    """
+    cursor.execute("""CREATE TABLE IF NOT EXISTS clocks (
+            id INTEGER PRIMARY KEY AUTO_INCREMENT NOT NULL,
+            topic_key VARCHAR(64) NOT NULL UNIQUE,
+            name VARCHAR(100),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )""")
+    cursor.execute("INSERT IGNORE INTO clocks (id, topic_key, name) VALUES (?, ?, ?)",
+                   (DEFAULT_CLOCK_ID, DEFAULT_CLOCK_KEY, DEFAULT_CLOCK_KEY))
+    for table in ('alarms', 'weather_data'):
+        cursor.execute(f"""INSERT IGNORE INTO clocks (id, topic_key, name)
+                SELECT DISTINCT clock_id, CAST(clock_id AS CHAR), CAST(clock_id AS CHAR) FROM {table}
+                WHERE clock_id IS NOT NULL""")
+
+def add_row_versions(cursor):
+    """
+    Adds updated_at to alarms, set by MariaDB on every insert and update (including fires),
+    and records deleted alarms in alarm_deletes, so print_alarms.py can read only what changed.
+    The delete trigger needs the TRIGGER privilege; without it deletes are not recorded.
+    """
+    cursor.execute("""ALTER TABLE alarms ADD COLUMN IF NOT EXISTS
+            updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)""")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_alarms_updated_at ON alarms (updated_at, id)")
+    cursor.execute("""CREATE TABLE IF NOT EXISTS alarm_deletes (
+            alarm_id INTEGER NOT NULL,
+            clock_id INTEGER,
+            deleted_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6),
+            INDEX idx_alarm_deletes_deleted_at (deleted_at)
+            )""")
+    try:
+        cursor.execute("""CREATE TRIGGER IF NOT EXISTS alarms_record_delete AFTER DELETE ON alarms FOR EACH ROW
+                INSERT INTO alarm_deletes (alarm_id, clock_id) VALUES (OLD.id, OLD.clock_id)""")
+    except mariadb.Error as e:
+        print(f"Could not create the alarm delete trigger, deleted alarms will not be reported: {e}")
+
+def add_humidity_counts(cursor):
+    """
+    Counts humidity samples separately in the rollups, since clocks without a humidity sensor
+    send none. Every sample before this migration had a humidity reading.
+    """
+    for table in ('weather_rollup_minute', 'weather_rollup_hour'):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS humidity_count INTEGER NOT NULL DEFAULT 0")
+        cursor.execute(f"UPDATE {table} SET humidity_count = sample_count WHERE humidity_sum IS NOT NULL AND humidity_count = 0")
+
+# (version, description, function taking a cursor), in the order they are applied
+MIGRATIONS = [
+    (1, "recurrence columns on alarms", add_recurrence_columns),
+    (2, "indexes for alarm and telemetry queries", add_query_indexes),
+    (3, "alarm fire ledger", add_fire_ledger),
+    (4, "snooze tracking", add_snooze_tracking),
+    (5, "clock registry", add_clock_registry),
+    (6, "alarm row versions", add_row_versions),
+    (7, "humidity sample counts in rollups", add_humidity_counts),
+]
+
+def current_version(cursor):
+    """
+    Returns the highest applied migration version, 0 for a fresh database.
+    """
+    cursor.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY NOT NULL,
+            description VARCHAR(255),
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )""")
+    cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+    return cursor.fetchone()[0]
+
+def migrate(cursor):
+    """
+    Applies every migration newer than the recorded schema version, committing after each one.
+    """
+    version = current_version(cursor)
+    for number, description, step in MIGRATIONS:
+        if number <= version:
+            continue
+        print(f"Applying migration {number}: {description}")
+        step(cursor)
+        cursor.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)", (number, description))
+        cursor.connection.commit()
+    return max([version] + [number for number, _, _ in MIGRATIONS])
+
+def main():
+    """
+    Brings the database schema up to date.
+    """
+    try:
+        with db.connect() as con:
+            cursor = con.cursor()
+            print(f"Database is at schema version {migrate(cursor)}")
+            cursor.close()
+    except mariadb.Error as error:
+        print("Failed to migrate database:", error)
+
+if __name__ == "__main__":
+    main()
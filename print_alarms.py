@@ -1,48 +1,182 @@
 '''
 get alarms from databsse and print to screen
+
+By default this watches today's alarms and prints what changed: + for new
+alarms, ~ with the changed fields for updated ones and - for deleted ones.
+After one full read at start it only asks for rows whose updated_at moved
+(an index range on idx_alarms_updated_at) and for new rows in alarm_deletes.
+
+    python print_alarms.py [--clock ID] [--date YYYY-MM-DD | --all] [--interval SECONDS]
+    python print_alarms.py --once [--clock ID] [--date YYYY-MM-DD | --all]   # JSON snapshot
 '''
+import argparse
+import json
 import mariadb
 import time
-from datetime import datetime
-cached_connection = None
-def get_database_connection():
-    global cached_connection
-    if cached_connection is None:
-        try:
-            cached_connection = mariadb.connect(
-                host='eg-db.bucknell.edu',
-                database='vk009_csci332',
-                user='vk009_csci332',
-                password='oat3ceegok1mei1R'
-            )
-        except mariadb.Error as e:
-            print(f"Error connecting to database: {e}")
-    return cached_connection
+from datetime import datetime, timedelta
+import db
 
-def print_alarm_tables():
-    connection = get_database_connection()
-    current_date = datetime.now().strftime("%Y-%m-%d")
-    if connection:
-        try:
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute("SELECT * FROM alarms WHERE alarm_date = ? ORDER BY alarm_date DESC, alarm_time DESC",( current_date,))
-            alarms = cursor.fetchall()
-            if alarms:
-                for alarm in alarms:
-                    print(f"Alarm ID: {alarm['id']}, Time: {alarm['alarm_time']}, Date: {alarm['alarm_date']}, Enabled: {alarm['enabled']}")
+# how often watch mode asks for changes, in seconds
+POLL_INTERVAL = 5
+
+# rows are re-read this far behind the newest updated_at seen. updated_at is set when a row is
+# written, not when its transaction commits, so a long transaction can commit rows older than
+# versions already seen. Re-read rows whose (id, updated_at) was already seen are skipped, so this
+# only costs reading the rows changed in the window; transactions longer than it can still be missed.
+VERSION_OVERLAP = timedelta(minutes=5)
+
+# columns that are not printed in diffs
+IGNORED_COLUMNS = ('updated_at',)
+
+def filters(clock_id=None, alarm_date=None):
+    """
+    Returns the WHERE conditions and parameters for the --clock and --date options.
+    """
+    conditions = []
+    params = []
+    if clock_id is not None:
+        conditions.append("clock_id = ?")
+        params.append(clock_id)
+    if alarm_date is not None:
+        conditions.append("alarm_date = ?")
+        params.append(alarm_date)
+    return conditions, params
+
+def fetch_alarms(cursor, clock_id=None, alarm_date=None, changed_since=None):
+    """
+    Returns the alarms matching the filters, only those updated at or after changed_since if given.
+    """
+    conditions, params = filters(clock_id, alarm_date)
+    if changed_since is not None:
+        conditions.insert(0, "updated_at >= ?")
+        params.insert(0, changed_since)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor.execute(f"SELECT * FROM alarms {where} ORDER BY updated_at, id", params)
+    return cursor.fetchall()
+
+def fetch_deletes(cursor, since):
+    """
+    Returns (alarm_id, deleted_at) for alarms deleted at or after since.
+    """
+    cursor.execute("SELECT alarm_id, deleted_at FROM alarm_deletes WHERE deleted_at >= ? ORDER BY deleted_at", (since,))
+    return cursor.fetchall()
+
+def describe(alarm):
+    return (f"Alarm ID: {alarm['id']}, Clock: {alarm['clock_id']}, Time: {alarm['alarm_time']}, Date: {alarm['alarm_date']}, "
+            f"Repeat: {alarm['repeat_days'] or '-'}, Enabled: {alarm['enabled']}")
+
+def diff(old, new):
+    """
+    Returns 'column: old -> new' for every printed column that differs between two versions of an alarm.
+    """
+    return [f"{column}: {old.get(column)} -> {value}" for column, value in new.items()
+            if column not in IGNORED_COLUMNS and old.get(column) != value]
+
+class AlarmWatcher:
+    """
+    Keeps the last seen version of every watched alarm and prints the differences on each poll.
+    """
+    def __init__(self, clock_id=None, alarm_date=None):
+        self.clock_id = clock_id
+        self.alarm_date = alarm_date
+        self.alarms = {}
+        self.version = None
+
+    def start(self, cursor):
+        """
+        Reads the watched alarms once and prints them.
+        """
+        # changes and deletes are read from now on, by the database clock
+        cursor.execute("SELECT CURRENT_TIMESTAMP(6) AS now")
+        self.version = self.deletes_since = cursor.fetchone()['now']
+        for alarm in fetch_alarms(cursor, self.clock_id, self.alarm_date):
+            self.alarms[alarm['id']] = alarm
+            print(f"  {describe(alarm)}")
+        if not self.alarms:
+            print("No alarms found in the database.")
+
+    def poll(self, cursor):
+        """
+        Prints the alarms inserted, updated or deleted since the last poll.
+        """
+        # the filters are applied here, so an update that moves a watched alarm out of them is seen
+        for alarm in fetch_alarms(cursor, changed_since=self.version - VERSION_OVERLAP):
+            self.version = max(self.version, alarm['updated_at'])
+            old = self.alarms.get(alarm['id'])
+            if old is not None and old['updated_at'] == alarm['updated_at']:
+                continue
+            if not self.matches(alarm):
+                if old is not None:
+                    del self.alarms[alarm['id']]
+                    print(f"- {describe(old)} (no longer matches)")
+                continue
+            if old is None:
+                print(f"+ {describe(alarm)}")
             else:
-                print("No alarms found in the database.")
+                changes = diff(old, alarm)
+                if changes:
+                    print(f"~ Alarm ID: {alarm['id']}, {', '.join(changes)}")
+            self.alarms[alarm['id']] = alarm
+        for row in fetch_deletes(cursor, self.deletes_since - VERSION_OVERLAP):
+            alarm = self.alarms.pop(row['alarm_id'], None)
+            if alarm is not None:
+                print(f"- {describe(alarm)}")
+            if row['deleted_at'] > self.deletes_since:
+                self.deletes_since = row['deleted_at']
+
+    def matches(self, alarm):
+        return ((self.clock_id is None or alarm['clock_id'] == self.clock_id) and
+                (self.alarm_date is None or str(alarm['alarm_date']) == self.alarm_date))
+
+def snapshot(clock_id=None, alarm_date=None):
+    """
+    Prints the matching alarms as one JSON document, for scripts.
+    """
+    with db.cursor(dictionary=True) as cursor:
+        alarms = fetch_alarms(cursor, clock_id, alarm_date)
+    version = max((alarm['updated_at'] for alarm in alarms), default=None)
+    print(json.dumps({'version': version, 'count': len(alarms), 'alarms': alarms}, default=str, indent=2))
+
+def watch(clock_id=None, alarm_date=None, interval=POLL_INTERVAL):
+    """
+    Prints the watched alarms, then their changes every interval seconds.
+    """
+    watcher = AlarmWatcher(clock_id, alarm_date)
+    with db.cursor(dictionary=True) as cursor:
+        watcher.start(cursor)
+    while True:
+        time.sleep(interval)
+        try:
+            # a pooled connection per poll, so a dropped connection is replaced
+            with db.cursor(dictionary=True) as cursor:
+                watcher.poll(cursor)
         except mariadb.Error as e:
             print(f"Error querying database: {e}")
-    else:
-        print("Error connecting to database")
 
 def main():
-    while True:
-        print_alarm_tables()
-        time.sleep(5)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clock', type=int, help="only alarms of this clock id")
+    dates = parser.add_mutually_exclusive_group()
+    dates.add_argument('--date', default='today', help="only alarms on this date (YYYY-MM-DD, default today)")
+    dates.add_argument('--all', action='store_true', help="alarms on every date")
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help="seconds between polls in watch mode")
+    parser.add_argument('--once', action='store_true', help="print a JSON snapshot and exit")
+    args = parser.parse_args()
+    if args.all:
+        alarm_date = None
+    elif args.date == 'today':
+        alarm_date = datetime.now().strftime("%Y-%m-%d")
+    else:
+        alarm_date = args.date
+    try:
+        if args.once:
+            snapshot(args.clock, alarm_date)
+        else:
+            watch(args.clock, alarm_date, args.interval)
+    except mariadb.Error as e:
+        print(f"Error querying database: {e}")
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == "__main__":
     main()
-
-
@@ -0,0 +1,86 @@
+'''
+Recurrence helpers for repeating alarms.
+
+repeat_days is stored as the text the user typed (e.g. "Mon,Wed,Fri") and as a
+weekday bitmask in repeat_mask, bit 0 is Monday to match datetime.weekday().
+'''
+from datetime import datetime, date, time, timedelta
+
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+ALL_DAYS = 0x7f
+
+def parse_repeat_days(repeat_days):
+    """
+    Parses a comma separated list of day names such as "Mon, Tue" into a weekday bitmask.
+    Empty input means the alarm does not repeat and gives 0. Raises ValueError on unknown days.
+    """
+    mask = 0
+    if not repeat_days:
+        return mask
+    for name in repeat_days.split(','):
+        name = name.strip()[:3].capitalize()
+        if not name:
+            continue
+        if name not in DAY_NAMES:
+            raise ValueError(f"Unknown repeat day: {name}")
+        mask |= 1 << DAY_NAMES.index(name)
+    return mask
+
+def format_repeat_days(mask):
+    """
+    Turns a weekday bitmask back into the "Mon,Tue" form shown on the dashboard.
+    """
+    return ",".join(name for i, name in enumerate(DAY_NAMES) if mask & (1 << i))
+
+def alarm_fire_time(alarm_date, alarm_time):
+    """
+    Combines an alarm's DATE and TIME values into a single datetime.
+    Accepts the form strings from set_alarm as well as the values MariaDB returns,
+    which hands TIME columns back as a timedelta since midnight.
+    """
+    if isinstance(alarm_date, str):
+        alarm_date = date.fromisoformat(alarm_date)
+    if isinstance(alarm_time, str):
+        alarm_time = time.fromisoformat(alarm_time)
+    if isinstance(alarm_time, timedelta):
+        return datetime.combine(alarm_date, time()) + alarm_time
+    return datetime.combine(alarm_date, alarm_time)
+
+def first_fire_time(alarm_date, alarm_time, mask, now=None):
+    """
+    Returns when a new alarm first rings. A one-off alarm rings at its date and time. A repeating
+    alarm rings at its time on the first day in mask that is on or after its date and not already
+    past, so a start date outside the schedule does not ring.
+    """
+    fire_at = alarm_fire_time(alarm_date, alarm_time)
+    if not mask & ALL_DAYS:
+        return fire_at
+    now = now or datetime.now()
+    if fire_at < now:
+        # jump whole weeks, which keeps the weekday, to land within the week before now
+        fire_at += timedelta(weeks=(now - fire_at).days // 7)
+    while fire_at < now or not mask & (1 << fire_at.weekday()):
+        fire_at += timedelta(days=1)
+    return fire_at
+
+def next_occurrence(mask, fired_at):
+    """
+    Returns the next time a repeating alarm should ring after it rang at fired_at,
+    or None if the alarm does not repeat.
+    """
+    if not mask & ALL_DAYS:
+        return None
+    for days in range(1, 8):
+        candidate = fired_at + timedelta(days=days)
+        if mask & (1 << candidate.weekday()):
+            return candidate
+    return None
+
+def next_occurrence_after(mask, fire_at, after):
+    """
+    Returns the first occurrence of a repeating alarm that is later than after,
+    skipping the ones that were missed. None if the alarm does not repeat.
+    """
+    while fire_at is not None and fire_at <= after:
+        fire_at = next_occurrence(mask, fire_at)
+    return fire_at
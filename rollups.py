@@ -0,0 +1,154 @@
+'''
+Minute and hour rollups of the weather_data telemetry.
+
+Each rollup row holds min, max, sum and count of temperature and humidity for one
+clock and one bucket, so new samples can be merged in without touching raw rows.
+The average is sum / count. Clocks without a humidity sensor send no humidity, so
+humidity has its own count and is NULL in buckets that have none.
+
+Run this file to rebuild the rollups from weather_data:
+
+    python rollups.py [chunk_size]
+'''
+import sys
+import mariadb
+import db
+
+# rollup table name -> DATE_FORMAT pattern truncating a timestamp to its bucket
+ROLLUP_TABLES = {
+    'weather_rollup_minute': '%Y-%m-%d %H:%i:00',
+    'weather_rollup_hour': '%Y-%m-%d %H:00:00',
+}
+
+BACKFILL_CHUNK_SIZE = 50000
+
+UPSERT_COLUMNS = """(clock_id, bucket_start, temp_min, temp_max, temp_sum, humidity_min, humidity_max, humidity_sum,
+            humidity_count, sample_count)"""
+
+# merges a new partial aggregate into an existing bucket; LEAST and GREATEST return NULL
+# if either side is, so the humidity columns fall back to whichever side has a value
+UPSERT_MERGE = """ON DUPLICATE KEY UPDATE
+            temp_min = LEAST(temp_min, VALUES(temp_min)),
+            temp_max = GREATEST(temp_max, VALUES(temp_max)),
+            temp_sum = temp_sum + VALUES(temp_sum),
+            humidity_min = LEAST(COALESCE(humidity_min, VALUES(humidity_min)), COALESCE(VALUES(humidity_min), humidity_min)),
+            humidity_max = GREATEST(COALESCE(humidity_max, VALUES(humidity_max)), COALESCE(VALUES(humidity_max), humidity_max)),
+            humidity_sum = COALESCE(humidity_sum + VALUES(humidity_sum), humidity_sum, VALUES(humidity_sum)),
+            humidity_count = humidity_count + VALUES(humidity_count),
+            sample_count = sample_count + VALUES(sample_count)"""
+
+def create_rollup_tables(cursor):
+    """
+    Creates the minute and hour rollup tables if they do not exist.
+    """
+    for table in ROLLUP_TABLES:
+        cursor.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+            clock_id INTEGER NOT NULL,
+            bucket_start DATETIME NOT NULL,
+            temp_min FLOAT,
+            temp_max FLOAT,
+            temp_sum DOUBLE,
+            humidity_min FLOAT,
+            humidity_max FLOAT,
+            humidity_sum DOUBLE,
+            humidity_count INTEGER NOT NULL DEFAULT 0,
+            sample_count INTEGER NOT NULL,
+            PRIMARY KEY (clock_id, bucket_start)
+            )""")
+
+def bucket_start(timestamp, table):
+    """
+    Truncates a datetime to the start of its minute or hour bucket.
+    """
+    if table == 'weather_rollup_hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(second=0, microsecond=0)
+
+def aggregate(samples, table):
+    """
+    Aggregates (clock_id, timestamp, temperature, humidity) samples into upsert rows for one rollup table.
+    humidity may be None; the humidity columns stay None in buckets without any humidity.
+    """
+    buckets = {}
+    for clock_id, timestamp, temperature, humidity in samples:
+        key = (clock_id, bucket_start(timestamp, table))
+        b = buckets.get(key)
+        if b is None:
+            b = buckets[key] = [temperature, temperature, 0.0, None, None, None, 0, 0]
+        b[0] = min(b[0], temperature)
+        b[1] = max(b[1], temperature)
+        b[2] += temperature
+        if humidity is not None:
+            if b[6]:
+                b[3] = min(b[3], humidity)
+                b[4] = max(b[4], humidity)
+                b[5] += humidity
+            else:
+                b[3] = b[4] = b[5] = humidity
+            b[6] += 1
+        b[7] += 1
+    return [key + tuple(b) for key, b in buckets.items()]
+
+def update_rollups(cursor, samples):
+    """
+    Merges a batch of samples into every rollup table. Runs inside the caller's transaction,
+    so the rollups are committed together with the raw rows.
+    """
+    for table in ROLLUP_TABLES:
+        rows = aggregate(samples, table)
+        if rows:
+            cursor.executemany(f"INSERT INTO {table} {UPSERT_COLUMNS} VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) {UPSERT_MERGE}", rows)
+
+def backfill_rollups(connection, chunk_size=BACKFILL_CHUNK_SIZE):
+    """
+    Rebuilds the rollup tables from weather_data, aggregating chunk_size raw rows at a time
+    in SQL and committing after every chunk so locks and undo logs stay small.
+
+    Safe while ingest is running: the rollups are cleared and the last raw row id read
+    under LOCK TABLES, which waits for open ingest transactions to commit and holds new
+    ones back. Rows up to that id are counted here and later rows by update_rollups only.
+    """
+    cursor = connection.cursor()
+    create_rollup_tables(cursor)
+    locks = ', '.join(f"{table} WRITE" for table in ROLLUP_TABLES)
+    cursor.execute(f"LOCK TABLES weather_data READ, {locks}")
+    try:
+        for table in ROLLUP_TABLES:
+            cursor.execute(f"DELETE FROM {table}")
+        cursor.execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM weather_data")
+        first_id, last_id = cursor.fetchone()
+        connection.commit()
+    finally:
+        cursor.execute("UNLOCK TABLES")
+
+    start = first_id - 1
+    while start < last_id:
+        end = min(start + chunk_size, last_id)
+        for table, pattern in ROLLUP_TABLES.items():
+            cursor.execute(f"""INSERT INTO {table} {UPSERT_COLUMNS}
+                SELECT clock_id, DATE_FORMAT(timestamp, '{pattern}'),
+                       MIN(temperature), MAX(temperature), SUM(temperature),
+                       MIN(humidity), MAX(humidity), SUM(humidity), COUNT(humidity), COUNT(*)
+                FROM weather_data
+                WHERE id > ? AND id <= ?
+                GROUP BY 1, 2
+                {UPSERT_MERGE}""", (start, end))
+        connection.commit()
+        print(f"Rolled up weather_data rows {start + 1} to {end} of {last_id}")
+        start = end
+    cursor.close()
+
+def main():
+    """
+    Rebuilds the rollup tables from the raw telemetry.
+    """
+    chunk_size = int(sys.argv[1]) if len(sys.argv) > 1 else BACKFILL_CHUNK_SIZE
+    try:
+        with db.connect() as con:
+            backfill_rollups(con, chunk_size)
+            print("Rollup backfill complete.")
+    except mariadb.Error as error:
+        print("Failed to backfill rollups:", error)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+'''
+Append-only on-disk spill log for telemetry.
+
+When the in-memory telemetry queue backs up (slow or unreachable database) the
+MQTT thread appends messages here instead of blocking. The writer replays them
+into the database in order once it has caught up, and a restart picks up from
+the last acknowledged position.
+
+Records are JSON lines in numbered segment files. The reader position is kept
+in a checkpoint file that is replaced atomically, and segments are deleted
+once every record in them has been written to the database.
+'''
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+CHECKPOINT = 'checkpoint'
+
+def segment_name(seq):
+    return f"segment-{seq:012d}.log"
+
+def encode(record):
+    return (json.dumps(record, default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v)) + "\n").encode()
+
+def decode(line):
+    record = json.loads(line)
+    if isinstance(record.get('timestamp'), str):
+        record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+    return record
+
+class SpillLog:
+    """
+    A segmented append-only log with one writer (the MQTT thread) and one reader (the DB writer).
+
+    Appends are fsynced in batches, every fsync_every records or fsync_interval seconds,
+    so a crash loses at most that window. While the log is active every new message must
+    be appended to it, even if the in-memory queue has room again, so records stay in order.
+
+    example:
+
+    spill = SpillLog('telemetry_spill')
+    spill.append({'temperature': 21.5, 'humidity': 40})
+    records, position = spill.read_batch(100)
+    ... write records to the database ...
+    spill.ack(position)
+    """
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, fsync_every=100, fsync_interval=0.2):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.read_pos = self._load_checkpoint()
+        segments = self._segments()
+        if segments and segments[0] > self.read_pos[0]:
+            # the checkpointed segment is gone, start from the oldest one left
+            self.read_pos = (segments[0], 0)
+        self.write_seq = max(segments[-1] if segments else 0, self.read_pos[0])
+        self._recover_tail()
+        self.file = open(self._path(self.write_seq), 'ab')
+        self.write_offset = self.file.tell()
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        # a restart with records left over keeps spilling until they are replayed
+        self.active = self._pending()
+        if self.active:
+            print(f"Recovered spilled telemetry from {directory}, replaying it first")
+
+    def _path(self, seq):
+        return os.path.join(self.directory, segment_name(seq))
+
+    def _segments(self):
+        return sorted(int(name[8:20]) for name in os.listdir(self.directory)
+                      if name.startswith('segment-') and name.endswith('.log'))
+
+    def _load_checkpoint(self):
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT)) as f:
+                seq, offset = f.read().split()
+                return int(seq), int(offset)
+        except (OSError, ValueError):
+            return 0, 0
+
+    def _recover_tail(self):
+        """
+        Cuts off a partial record left at the end of the last segment by a crash mid-write.
+        """
+        path = self._path(self.write_seq)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end != len(data):
+                print(f"Dropping {len(data) - end} bytes of a partial spilled record")
+                f.truncate(end)
+
+    def _pending(self):
+        return self.read_pos != (self.write_seq, self.write_offset)
+
+    def pending(self):
+        with self.lock:
+            return self._pending()
+
+    def append(self, record, activate=True):
+        """
+        Appends one record and, unless activate is False, marks the log active so later
+        messages follow it. Never blocks on the database.
+        """
+        data = encode(record)
+        with self.lock:
+            if self.write_offset >= self.segment_bytes:
+                self._sync()
+                self.file.close()
+                self.write_seq += 1
+                self.file = open(self._path(self.write_seq), 'ab')
+                self.write_offset = 0
+            self.file.write(data)
+            self.write_offset += len(data)
+            self.unsynced += 1
+            if activate:
+                self.active = True
+            if self.unsynced >= self.fsync_every or time.monotonic() - self.last_sync >= self.fsync_interval:
+                self._sync()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def read_batch(self, max_items):
+        """
+        Returns up to max_items records from the last acknowledged position, and the position
+        to acknowledge once they are safely in the database.
+        """
+        with self.lock:
+            # make buffered appends visible to the reader
+            self.file.flush()
+            write_seq = self.write_seq
+            write_offset = self.write_offset
+        seq, offset = self.read_pos
+        records = []
+        while len(records) < max_items and (seq, offset) != (write_seq, write_offset):
+            end = write_offset if seq == write_seq else None
+            with open(self._path(seq), 'rb') as f:
+                f.seek(offset)
+                while len(records) < max_items and (end is None or offset < end):
+                    line = f.readline()
+                    if not line.endswith(b"\n"):
+                        break
+                    offset += len(line)
+                    records.append(decode(line))
+            if seq < write_seq and len(records) < max_items:
+                # finished this segment, move on to the next one
+                seq, offset = seq + 1, 0
+        return records, (seq, offset)
+
+    def ack(self, position):
+        """
+        Records that everything before position is in the database, and deletes finished segments.
+        """
+        tmp = os.path.join(self.directory, CHECKPOINT + '.tmp')
+        with open(tmp, 'w') as f:
+            f.write(f"{position[0]} {position[1]}")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.directory, CHECKPOINT))
+        with self.lock:
+            old = self.read_pos[0]
+            self.read_pos = position
+        for seq in range(old, position[0]):
+            try:
+                os.remove(self._path(seq))
+            except FileNotFoundError:
+                pass
+
+    def deactivate_if_drained(self):
+        """
+        Switches new messages back to the in-memory queue once every spilled record was replayed.
+        Returns True if this call switched them back.
+        """
+        with self.lock:
+            if self.active and not self._pending():
+                self._sync()
+                self.active = False
+                return True
+            return False
+
+    def close(self):
+        with self.lock:
+            self._sync()
+            self.file.close()
@@ -1,21 +1,81 @@
 import mariadb
-from queue import Queue
+import math
+import os
+from queue import Queue, Empty, Full
+import time
 import threading
 from datetime import datetime
 from functools import partial
-import json
 import paho.mqtt.client as mqtt
+from rollups import create_rollup_tables, update_rollups
+from migrations import migrate
+import db
+import metrics
+import telemetry_format
+import clocks
+from spill import SpillLog, encode as encode_record
 
 # MQTT Broker configuration
 MQTT_BROKER_HOST = "mqtt.bucknell.edu"
 MQTT_BROKER_PORT = 1883
-MQTT_TOPIC = "iot/telemetry/vk009_csci332"
+# every clock publishes on iot/telemetry/<topic key>, see clocks.py
+MQTT_TOPIC = clocks.TELEMETRY_WILDCARD
+
+# Telemetry batching: write once BATCH_SIZE rows are waiting or BATCH_INTERVAL_MS has passed
+BATCH_SIZE = 200
+BATCH_INTERVAL_MS = 500
+
+# Telemetry queue size, and the depth past which new messages are spilled to disk instead
+QUEUE_SIZE = 1000
+SPILL_HIGH_WATER = 800
+# directory holding the spill log segments and their checkpoint
+SPILL_DIR = "telemetry_spill"
+# how long to wait before retrying a failed batch, doubling up to the maximum
+RETRY_DELAY = 1
+RETRY_DELAY_MAX = 30
+# errors that mean the server or connection is unavailable, so the same batch will succeed later
+# and is retried for as long as the outage lasts; any other error means the database rejects
+# the rows and retrying cannot help
+TRANSIENT_ERRORS = (mariadb.OperationalError, mariadb.InterfaceError)
+# JSON lines file in the spill directory holding the messages the database rejected
+DEAD_LETTER_FILE = "dead-letter.jsonl"
+
+# readings every telemetry message must carry as finite numbers, and readings it may leave
+# out or send as null (clocks without a humidity sensor)
+READING_FIELDS = ('temperature',)
+OPTIONAL_READING_FIELDS = ('humidity',)
+
+# where the /metrics endpoint of this daemon listens
+METRICS_PORT = 9102
+# log one in every LOG_SAMPLE_EVERY messages and batches
+LOG_SAMPLE_EVERY = 100
+
+messages_received = metrics.counter('telemetry_messages_total', 'Telemetry messages received over MQTT')
+message_errors = metrics.counter('telemetry_message_errors_total', 'Telemetry messages that could not be parsed')
+rows_inserted = metrics.counter('telemetry_rows_inserted_total', 'Telemetry rows written to weather_data')
+batch_errors = metrics.counter('telemetry_batch_errors_total', 'Telemetry batches that failed to insert')
+batch_sizes = metrics.histogram('telemetry_batch_size', 'Rows per telemetry insert batch',
+                                buckets=(1, 5, 10, 25, 50, 100, 200, 500, 1000))
+unknown_clock_messages = metrics.counter('telemetry_unknown_clock_total', 'Telemetry messages from topics of unregistered clocks')
+batch_commit_seconds = metrics.histogram('telemetry_batch_commit_seconds', 'Time to insert and commit one telemetry batch')
+spilled = metrics.counter('telemetry_spilled_total', 'Telemetry messages appended to the disk spill log')
+replayed = metrics.counter('telemetry_replayed_total', 'Spilled telemetry messages replayed into the database')
+dead_lettered = metrics.counter('telemetry_dead_lettered_total', 'Telemetry messages moved to the dead-letter file')
+
+# counters for the batching writer, updated by process_queue
+ingest_stats = {
+    'batches': 0,
+    'rows': 0,
+    'errors': 0,
+    'last_batch_size': 0,
+    'last_commit_ms': 0.0,
+}
 
 # Function to establish connection with MQTT broker
 def on_connect(client, userdata, flags, rc, props):
     """
     Callback function that is called when the client connects to the MQTT broker.
-    Subscribes to the MQTT_TOPIC to receive telemetry data.
+    Subscribes to the MQTT_TOPIC wildcard to receive telemetry data from every clock.
     """
     print(f"Connected to {MQTT_BROKER_HOST}:{MQTT_BROKER_PORT} with result code {rc}/{props}")
 
@@ -24,23 +84,93 @@ def on_connect(client, userdata, flags, rc, props):
     print(f"Subscribed to {MQTT_TOPIC}...")
 
 # Function to handle MQTT messages
-def on_message(client, userdata, msg, dbqueue):
+def on_message(client, userdata, msg, dbqueue, spill=None):
+    """
+    Callback function that is called when a new message is received on a clock's telemetry topic.
+    Parses the message payload as JSON or binary (see telemetry_format.py) and puts it into the database queue for processing.
+    With a spill log this never blocks: once the queue passes SPILL_HIGH_WATER, and until
+    the spilled messages have been replayed, new messages are appended to disk instead.
+    """
+    handle_payload(msg.topic, msg.payload, dbqueue, spill)
+
+# registered clocks, for looking up the clock id of a telemetry topic
+clock_registry = clocks.ClockRegistry()
+
+# Function to check the readings of a telemetry message
+def clean_payload(payload):
     """
-    Callback function that is called when a new message is received on the MQTT_TOPIC.
-    Parses the message payload as JSON and puts it into the database queue for processing.
+    Converts the readings of a decoded message to floats, or None for a missing optional one, and returns it.
+    Raises ValueError if the message is not an object or a reading is missing, not a number, NaN or infinite.
     """
+    if not isinstance(payload, dict):
+        raise ValueError("telemetry message is not an object")
+    for field in READING_FIELDS + OPTIONAL_READING_FIELDS:
+        if payload.get(field) is None:
+            if field in READING_FIELDS:
+                raise ValueError(f"{field} is missing")
+            payload[field] = None
+            continue
+        try:
+            value = float(payload[field])
+        except (TypeError, ValueError):
+            raise ValueError(f"{field} is not a number: {payload[field]!r}")
+        if not math.isfinite(value):
+            raise ValueError(f"{field} is not finite: {value}")
+        payload[field] = value
+    return payload
+
+# Function to parse one telemetry message and queue it for the database
+def handle_payload(topic, raw, dbqueue, spill=None, received=None, write_ahead=False):
+    """
+    Parses a raw JSON or binary telemetry payload, tags it with its clock_id and receive time and queues it,
+    spilling to disk if the queue is backed up. With write_ahead every message is appended to
+    the spill log, so none is lost if the process dies. The topic decides the clock; messages from
+    clocks that are not in the registry and messages with bad readings are dropped here,
+    so they never reach a batch or the spill log.
+    """
+    clock_id = clock_registry.clock_id(clocks.topic_key(topic))
+    if clock_id is None:
+        unknown_clock_messages.inc()
+        metrics.log_sampled('telemetry_unknown_clock', LOG_SAMPLE_EVERY, topic=topic)
+        return
     try:
-        payload = json.loads(msg.payload.decode())
-        print(f"Received telemetry data: {payload}")
-        payload['timestamp'] = datetime.now()
-        dbqueue.put(payload)
+        payload = clean_payload(telemetry_format.decode(raw))
+        messages_received.inc()
+        metrics.log_sampled('telemetry_received', LOG_SAMPLE_EVERY, payload=payload)
+        payload['clock_id'] = clock_id
+        # binary payloads may carry the time the device took the reading
+        if not isinstance(payload.get('timestamp'), datetime):
+            payload['timestamp'] = received or datetime.now()
+        if spill is None:
+            dbqueue.put(payload)
+        elif write_ahead:
+            # every message goes through the log, so there is no spilling to switch on and off
+            spill.append(payload, activate=False)
+        elif spill.active or dbqueue.qsize() >= SPILL_HIGH_WATER:
+            spill_message(spill, payload)
+        else:
+            try:
+                dbqueue.put_nowait(payload)
+            except Full:
+                spill_message(spill, payload)
     except Exception as e:
-        print(f"Error processing message {msg.payload.decode()}: {e}")
+        message_errors.inc()
+        print(f"Error processing message {raw!r}: {e}")
+
+# Function to append a message to the spill log
+def spill_message(spill, payload):
+    """
+    Appends a telemetry message to the disk spill log, logging when spilling starts.
+    """
+    if not spill.active:
+        print("Telemetry queue is backed up, spilling messages to disk")
+    spill.append(payload)
+    spilled.inc()
 
 # Function to create database tables if they do not exist
 def create_tables(cursor):
     """
-    Creates the 'alarms', 'weather_data', and 'sleep_schedule' tables in the database if they do not exist.
+    Creates the 'alarms', 'weather_data', 'sleep_schedule' and telemetry rollup tables in the database if they do not exist.
     """
     cursor.execute("""CREATE TABLE IF NOT EXISTS alarms (
              id INTEGER PRIMARY KEY AUTO_INCREMENT NOT NULL,
@@ -48,10 +178,13 @@ def create_tables(cursor):
              alarm_time TIME,
              alarm_date DATE,
              repeat_days VARCHAR(50),
+             repeat_mask TINYINT UNSIGNED NOT NULL DEFAULT 0,
+             next_fire_at DATETIME,
              enabled BOOLEAN,
-             snooze_time TIMESTAMP,
+             snooze_time TIMESTAMP NULL DEFAULT NULL,
              snooze_duration INTEGER,
-             state ENUM('ON', 'OFF')
+             state ENUM('ON', 'OFF'),
+             updated_at TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)
              )""")
 
     cursor.execute("""CREATE TABLE IF NOT EXISTS weather_data (
@@ -67,26 +200,160 @@ def create_tables(cursor):
             sleep_time TIME,
             wake_time TIME
             )""")
+    create_rollup_tables(cursor)
+    # indexes and changes to existing tables are applied as versioned migrations
+    migrate(cursor)
 
-# Function to process the queue and insert data into the database
-def process_queue(q, cursor):
+# Function to collect the next batch of telemetry from the queue
+def next_batch(q, batch_size=BATCH_SIZE, interval_ms=BATCH_INTERVAL_MS, timeout=None):
     """
-    Continuously processes the database queue and inserts data into the database.
+    Blocks until at least one item is queued, then keeps draining the queue until
+    batch_size items have been collected or interval_ms has passed since the first one.
+    With a timeout it returns an empty batch if nothing arrived in that many seconds.
     """
-    while True:
-        data = q.get()
+    try:
+        batch = [q.get(timeout=timeout)]
+    except Empty:
+        return []
+    deadline = time.monotonic() + interval_ms / 1000
+    while len(batch) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
         try:
-            if 'temperature' in data and 'humidity' in data:
-                cursor.execute("INSERT INTO weather_data (clock_id,timestamp, temperature, humidity) VALUES (1,?, ?, ?)",
-               (datetime.now(), data['temperature'], data['humidity']))
-                print("Inserted weather data into the database.")
+            batch.append(q.get(timeout=remaining))
+        except Empty:
+            break
+    return batch
 
-            cursor.connection.commit()
+# Function to insert one batch of telemetry into the database
+def write_batch(cursor, batch):
+    """
+    Inserts every telemetry sample in batch with a single executemany, merges the batch
+    into the minute and hour rollups and commits once. Returns None once committed, or
+    the error the batch was rolled back with.
+    """
+    rows = [(data['clock_id'], data['timestamp'], data['temperature'], data.get('humidity'))
+            for data in batch if 'temperature' in data]
+    try:
+        start = time.perf_counter()
+        if rows:
+            cursor.executemany("INSERT INTO weather_data (clock_id, timestamp, temperature, humidity) VALUES (?, ?, ?, ?)", rows)
+            update_rollups(cursor, rows)
+        cursor.connection.commit()
+        elapsed = time.perf_counter() - start
+        ingest_stats['last_commit_ms'] = elapsed * 1000
+        ingest_stats['batches'] += 1
+        ingest_stats['rows'] += len(rows)
+        ingest_stats['last_batch_size'] = len(rows)
+        batch_commit_seconds.observe(elapsed)
+        batch_sizes.observe(len(rows))
+        rows_inserted.inc(len(rows))
+        return None
+    except mariadb.Error as e:
+        ingest_stats['errors'] += 1
+        batch_errors.inc()
+        print(f"Error inserting data into tables: {e}")
+        try:
+            cursor.connection.rollback()
+        except mariadb.Error:
+            pass
+        return e
+
+# Function to write a batch, retrying while the database is unavailable
+def write_batch_retry(cursor, batch, dead_letter_path=DEAD_LETTER_FILE):
+    """
+    Calls write_batch, reconnecting and backing off between attempts for as long as the error is
+    one of TRANSIENT_ERRORS; the MQTT thread keeps spilling to disk meanwhile, so an outage loses
+    nothing and the order is kept. If the database rejects the batch, its messages are written one
+    at a time so only the rejected ones are moved to the dead-letter file.
+    """
+    delay = RETRY_DELAY
+    while True:
+        error = write_batch(cursor, batch)
+        if error is None:
+            return
+        if not isinstance(error, TRANSIENT_ERRORS):
+            break
+        print(f"Retrying telemetry batch of {len(batch)} in {delay}s")
+        time.sleep(delay)
+        delay = min(delay * 2, RETRY_DELAY_MAX)
+        try:
+            cursor.connection.reconnect()
         except mariadb.Error as e:
-            print(f"Error inserting data into tables: {e}")
+            print(f"Database still unavailable: {e}")
+    if len(batch) > 1:
+        for data in batch:
+            write_batch_retry(cursor, [data], dead_letter_path)
+        return
+    dead_letter(dead_letter_path, batch, error)
+
+# Function to keep messages the database did not accept
+def dead_letter(path, batch, error):
+    """
+    Appends the messages of a failed batch to the dead-letter file with the error, so the
+    writer can move on and the messages can be inspected or replayed by hand.
+    """
+    failed_at = datetime.now()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'ab') as f:
+        for data in batch:
+            f.write(encode_record({'failed_at': failed_at, 'error': str(error), 'message': data}))
+        f.flush()
+        os.fsync(f.fileno())
+    dead_lettered.inc(len(batch))
+    print(f"Moved {len(batch)} telemetry messages to {path}: {error}")
+
+# Function to process the queue and insert data into the database
+def process_once(q, cursor, spill=None, batch_size=BATCH_SIZE, interval_ms=BATCH_INTERVAL_MS):
+    """
+    Writes one batch and returns how many messages it held. Messages still in the queue
+    arrived before spilling started, so the queue is drained first and the spill log is
+    replayed, oldest first, only once the queue is empty. Rejected messages go to
+    DEAD_LETTER_FILE in the spill directory.
+    """
+    dead_letter_path = os.path.join(spill.directory if spill is not None else SPILL_DIR, DEAD_LETTER_FILE)
+    if spill is not None and q.empty() and spill.pending():
+        records, position = spill.read_batch(batch_size)
+        batch = []
+        for record in records:
+            # logs spilled by older versions may hold messages that were never checked
+            try:
+                batch.append(clean_payload(record))
+            except ValueError as e:
+                message_errors.inc()
+                print(f"Dropping spilled message {record!r}: {e}")
+        write_batch_retry(cursor, batch, dead_letter_path)
+        spill.ack(position)
+        replayed.inc(len(batch))
+        if spill.deactivate_if_drained():
+            print("Spilled telemetry replayed, back to the in-memory queue")
+        return len(batch)
+    # wake up now and then to replay the spill log even when nothing new arrives
+    batch = next_batch(q, batch_size, interval_ms, timeout=interval_ms / 1000 if spill is not None else None)
+    if not batch:
+        if spill is not None:
+            spill.deactivate_if_drained()
+        return 0
+    write_batch_retry(cursor, batch, dead_letter_path)
+    return len(batch)
+
+# Function to process the queue and insert data into the database
+def process_queue(q, cursor, spill=None, batch_size=BATCH_SIZE, interval_ms=BATCH_INTERVAL_MS, stop=None):
+    """
+    Continuously drains the database queue and the spill log in batches and inserts them into the database.
+    If a stop event is given it returns once the event is set and the queue is empty; anything
+    left in the spill log is replayed on the next start.
+    """
+    while stop is None or not stop.is_set() or not q.empty():
+        if not process_once(q, cursor, spill, batch_size, interval_ms):
+            continue
+        metrics.log_sampled('telemetry_batch', LOG_SAMPLE_EVERY, rows=ingest_stats['last_batch_size'],
+                            commit_ms=round(ingest_stats['last_commit_ms'], 1), total_rows=ingest_stats['rows'],
+                            queue_depth=q.qsize(), spilling=spill is not None and spill.active)
 
 # Function to start MQTT client
-def start_mqtt(q):
+def start_mqtt(q, spill=None):
     """
     Creates an MQTT client, sets up the on_connect and on_message callbacks, connects to the MQTT broker,
     and starts the MQTT client loop to handle incoming messages.
@@ -94,7 +361,7 @@ def start_mqtt(q):
     client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
     client.on_connect = on_connect
     # partial allows us to add the queue to the on_message arguments
-    client.on_message = partial(on_message, dbqueue=q)
+    client.on_message = partial(on_message, dbqueue=q, spill=spill)
 
     # Connect to MQTT broker
     client.connect(MQTT_BROKER_HOST, MQTT_BROKER_PORT, 60)
@@ -109,23 +376,30 @@ def main():
     """
     Main function that sets up the database connection, creates tables if they do not exist, and starts the MQTT client.
     """
-    q = Queue(maxsize=1000)
-    client = start_mqtt(q)
+    q = Queue(maxsize=QUEUE_SIZE)
+    spill = SpillLog(SPILL_DIR)
+    metrics.gauge('telemetry_queue_depth', 'Telemetry messages waiting to be written', fn=q.qsize)
+    metrics.gauge('telemetry_queue_capacity', 'Size of the telemetry queue', fn=lambda: q.maxsize)
+    metrics.gauge('telemetry_spill_active', 'Whether new telemetry is being spilled to disk', fn=lambda: int(spill.active))
+    metrics.start_http_server(METRICS_PORT)
+    client = None
     try:
-        with mariadb.connect(host="eg-db.bucknell.edu",
-                             database="vk009_csci332",
-                             user="vk009_csci332",
-                             password="oat3ceegok1mei1R") as con:
+        with db.connect() as con:
             print("Connected to database")
             cursor = con.cursor()
             create_tables(cursor)
-            process_queue(q, cursor)
+            # the registry has to be readable before messages arrive
+            clock_registry.refresh(force=True)
+            client = start_mqtt(q, spill)
+            process_queue(q, cursor, spill)
     except KeyboardInterrupt:
         print("Stopping MQTT database logger...")
     except mariadb.Error as error:
         print("Failed to insert record into MariaDB table:", error)
     finally:
-        client.loop_stop()
+        if client is not None:
+            client.loop_stop()
+        spill.close()
 
 if __name__ == "__main__":
     main()
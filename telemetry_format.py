@@ -0,0 +1,86 @@
+'''
+Binary telemetry encoding shared by the server ingest and iot_data.py.
+
+A binary message starts with the MAGIC byte, which a JSON object never does, so
+the same topic carries both. The second byte is the layout version. Every layout
+is little endian and fixed size; new sensors get a new version that appends
+fields, and older versions keep decoding.
+
+Version 1, 12 bytes:
+
+    B  magic (0xA7)
+    B  version (1)
+    H  clock id, 0 if the topic says which clock it is
+    I  unix timestamp in seconds, 0 to use the time the server received it
+    h  temperature in hundredths of a degree C
+    H  humidity in hundredths of a percent
+
+Version 2, 10 bytes, for clocks without a humidity sensor: version 1 without
+the humidity field.
+
+example:
+
+    raw = encode(21.5, 40.25, clock_id=3)
+    decode(raw)  # {'clock_id': 3, 'temperature': 21.5, 'humidity': 40.25}
+    decode(encode(21.5))  # {'temperature': 21.5}
+'''
+import json
+import struct
+from datetime import datetime
+
+MAGIC = 0xA7
+VERSION = 1
+NO_HUMIDITY_VERSION = 2
+
+# version -> (layout after the magic and version bytes, field names)
+LAYOUTS = {
+    1: (struct.Struct('<HIhH'), ('clock_id', 'timestamp', 'temperature', 'humidity')),
+    2: (struct.Struct('<HIh'), ('clock_id', 'timestamp', 'temperature')),
+}
+
+# fields stored as hundredths
+SCALED = ('temperature', 'humidity')
+
+HEADER = struct.Struct('<BB')
+
+def encode(temperature, humidity=None, clock_id=0, timestamp=0, version=None):
+    """
+    Packs one reading into the binary format, by default version 1, or version 2 without a humidity reading.
+    """
+    if version is None:
+        version = VERSION if humidity is not None else NO_HUMIDITY_VERSION
+    layout, names = LAYOUTS[version]
+    values = {'clock_id': clock_id, 'timestamp': int(timestamp), 'temperature': temperature, 'humidity': humidity}
+    return HEADER.pack(MAGIC, version) + layout.pack(*(round(values[name] * 100) if name in SCALED else values[name]
+                                                       for name in names))
+
+def decode(raw):
+    """
+    Decodes a binary or JSON telemetry payload into a dict. Binary payloads are read
+    straight from the buffer with unpack_from; zero clock ids and timestamps are left out.
+    Raises ValueError on a payload it cannot decode.
+    """
+    view = memoryview(raw)
+    if not view or view[0] != MAGIC:
+        return json.loads(raw)
+    if len(view) < HEADER.size:
+        raise ValueError("truncated binary telemetry header")
+    layout = LAYOUTS.get(view[1])
+    if layout is None:
+        raise ValueError(f"unknown binary telemetry version {view[1]}")
+    fmt, names = layout
+    if len(view) < HEADER.size + fmt.size:
+        raise ValueError(f"binary telemetry version {view[1]} needs {HEADER.size + fmt.size} bytes, got {len(view)}")
+    payload = {}
+    for name, value in zip(names, fmt.unpack_from(view, HEADER.size)):
+        if name in SCALED:
+            payload[name] = value / 100
+        elif name == 'timestamp':
+            if value:
+                payload[name] = datetime.fromtimestamp(value)
+        elif name == 'clock_id':
+            if value:
+                payload[name] = value
+        else:
+            payload[name] = value
+    return payload
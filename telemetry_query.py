@@ -0,0 +1,144 @@
+'''
+Downsampled telemetry history for /api/telemetry.
+
+A query asks for one clock, a time range and a bucket width in seconds. The
+buckets are computed in SQL from the coarsest table that fits: the hour rollup
+when the width is a whole number of hours, the minute rollup for whole minutes
+and weather_data itself otherwise. The range is aligned to the bucket width and
+may hold at most MAX_POINTS buckets, so a result is small whatever the range.
+'''
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+
+# buckets are aligned to multiples of their width counted from this instant
+ALIGN_EPOCH = datetime(2000, 1, 1)
+
+DEFAULT_RANGE = timedelta(days=1)
+DEFAULT_BUCKET = 300
+# a year, wider buckets are no use and overflow the date arithmetic
+MAX_BUCKET = 366 * 24 * 3600
+MAX_POINTS = 5000
+
+COLUMNS = ['bucket_start', 'samples', 'temp_min', 'temp_avg', 'temp_max', 'humidity_min', 'humidity_avg', 'humidity_max']
+
+# merges rollup rows into wider buckets, in COLUMNS order after bucket_start
+ROLLUP_AGGREGATES = """SUM(sample_count), MIN(temp_min), SUM(temp_sum) / SUM(sample_count), MAX(temp_max),
+               MIN(humidity_min), SUM(humidity_sum) / NULLIF(SUM(humidity_count), 0), MAX(humidity_max)"""
+
+# source table -> (time column, aggregate expressions over its rows)
+SOURCES = {
+    'weather_rollup_hour': ('bucket_start', ROLLUP_AGGREGATES),
+    'weather_rollup_minute': ('bucket_start', ROLLUP_AGGREGATES),
+    'weather_data': ('timestamp', """COUNT(*), MIN(temperature), AVG(temperature), MAX(temperature),
+               MIN(humidity), AVG(humidity), MAX(humidity)"""),
+}
+
+def align(moment, bucket, up=False):
+    """
+    Rounds a datetime down (or up) to a multiple of bucket seconds.
+    """
+    seconds = int((moment - ALIGN_EPOCH).total_seconds())
+    if up:
+        seconds = -(-seconds // bucket) * bucket
+    else:
+        seconds = seconds // bucket * bucket
+    return ALIGN_EPOCH + timedelta(seconds=seconds)
+
+def parse_time(value):
+    """
+    Parses an ISO datetime. The telemetry is stored in the server's local time without a
+    zone, so a time with a zone or offset (e.g. ...Z) is converted to local time.
+    """
+    moment = datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment
+
+def parse_args(args, now=None):
+    """
+    Parses the clock_id, start, end, bucket and format query arguments into a query key
+    (clock_id, start, end, bucket) and the output format. Raises ValueError on bad input.
+    """
+    if not args.get('clock_id'):
+        raise ValueError("clock_id is required")
+    clock_id = int(args['clock_id'])
+    bucket = int(args.get('bucket', DEFAULT_BUCKET))
+    if not 0 < bucket <= MAX_BUCKET:
+        raise ValueError(f"bucket must be between 1 and {MAX_BUCKET} seconds")
+    try:
+        end = parse_time(args['end']) if args.get('end') else (now or datetime.now())
+        start = parse_time(args['start']) if args.get('start') else end - DEFAULT_RANGE
+        # aligning makes repeated queries for "the last day" share a cache key within a bucket
+        start, end = align(start, bucket), align(end, bucket, up=True)
+    except OverflowError:
+        raise ValueError("start or end is out of range")
+    if end <= start:
+        raise ValueError("end must be after start")
+    if (end - start).total_seconds() / bucket > MAX_POINTS:
+        raise ValueError(f"range holds more than {MAX_POINTS} buckets, use a wider bucket")
+    fmt = args.get('format', 'json')
+    if fmt not in ('json', 'csv'):
+        raise ValueError("format must be json or csv")
+    return (clock_id, start, end, bucket), fmt
+
+def source_for(bucket):
+    """
+    Picks the coarsest table whose rows fit whole inside a bucket of this width.
+    """
+    if bucket % 3600 == 0:
+        return 'weather_rollup_hour'
+    if bucket % 60 == 0:
+        return 'weather_rollup_minute'
+    return 'weather_data'
+
+def fetch(cursor, key):
+    """
+    Runs the bucketed query for a (clock_id, start, end, bucket) key and returns one dict per non-empty bucket.
+    """
+    clock_id, start, end, bucket = key
+    table = source_for(bucket)
+    time_column, aggregates = SOURCES[table]
+    cursor.execute(f"""SELECT TIMESTAMPDIFF(SECOND, ?, {time_column}) DIV ? AS bucket_index,
+               {aggregates}
+               FROM {table}
+               WHERE clock_id = ? AND {time_column} >= ? AND {time_column} < ?
+               GROUP BY bucket_index ORDER BY bucket_index""", (start, bucket, clock_id, start, end))
+    points = []
+    for row in cursor.fetchall():
+        point = dict(zip(COLUMNS, row))
+        point['bucket_start'] = start + timedelta(seconds=int(row[0]) * bucket)
+        point['samples'] = int(point['samples'])
+        for column in COLUMNS[2:]:
+            if point[column] is not None:
+                point[column] = round(float(point[column]), 2)
+        points.append(point)
+    return points
+
+def iter_json(key, points):
+    """
+    Yields a JSON document describing the query and its points, one point per chunk.
+    """
+    clock_id, start, end, bucket = key
+    header = {'clock_id': clock_id, 'start': start.isoformat(), 'end': end.isoformat(),
+              'bucket': bucket, 'source': source_for(bucket)}
+    yield json.dumps(header)[:-1] + ', "points": ['
+    for i, point in enumerate(points):
+        yield ("," if i else "") + json.dumps({**point, 'bucket_start': point['bucket_start'].isoformat()})
+    yield "]}"
+
+def iter_csv(points):
+    """
+    Yields the points as CSV with a header row, in chunks of about 64 KiB.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for point in points:
+        writer.writerow([point['bucket_start'].isoformat()] + [point[column] for column in COLUMNS[1:]])
+        if buffer.tell() > 64 * 1024:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
@@ -0,0 +1,36 @@
+'''
+Makes the top level modules importable from the tests, and shares the fixtures that run
+the web app against the SQLite stand-in database of benchmark.py.
+'''
+import importlib
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def standin(tmp_path, monkeypatch):
+    pytest.importorskip("mariadb")
+    pytest.importorskip("paho.mqtt.client")
+    import benchmark
+    import db
+    # install_standin_db replaces these, put them back afterwards
+    monkeypatch.setattr(db, 'checkout', db.checkout)
+    monkeypatch.setattr(db, 'connect', db.connect)
+    path = str(tmp_path / 'alarms.db')
+    benchmark.install_standin_db(path)
+    return path
+
+@pytest.fixture
+def alarm_clock(standin, monkeypatch):
+    """
+    A freshly imported web app, connected to the fake MQTT broker.
+    """
+    pytest.importorskip("flask")
+    import paho.mqtt.client as mqtt
+    import benchmark
+    # alarm_clock connects to the broker when it is imported
+    monkeypatch.setattr(mqtt, 'Client', benchmark.FakeClient)
+    monkeypatch.delitem(sys.modules, 'alarm_clock', raising=False)
+    return importlib.import_module('alarm_clock')
@@ -0,0 +1,47 @@
+'''
+Tests for the web app routes, run against the SQLite stand-in database of benchmark.py.
+'''
+import json
+from datetime import date, timedelta
+import pytest
+
+pytest.importorskip("mariadb")
+pytest.importorskip("flask")
+pytest.importorskip("paho.mqtt.client")
+import db
+from recurrence import alarm_fire_time
+
+TOMORROW = (date.today() + timedelta(days=1)).isoformat()
+
+def alarm_count():
+    with db.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM alarms")
+        return cursor.fetchone()[0]
+
+def test_set_alarm_on_a_fresh_app_knows_the_clocks(alarm_clock):
+    assert alarm_clock.clock_registry.loaded_at is None
+    response = alarm_clock.app.test_client().post('/set_alarm', data={
+        'alarm_time': '07:00', 'alarm_date': TOMORROW, 'repeat_days': '', 'clock_id': '1'})
+    assert response.status_code == 302
+    assert alarm_count() == 1
+
+def test_bulk_import_on_a_fresh_app_knows_the_clocks(alarm_clock):
+    rows = [{'clock_id': 1, 'alarm_date': TOMORROW, 'alarm_time': '07:00', 'repeat_days': ''}]
+    response = alarm_clock.app.test_client().post('/api/alarms/bulk', data=json.dumps(rows),
+                                                  content_type='application/json')
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['inserted'] == 1
+    assert alarm_count() == 1
+
+def test_export_then_import_gives_the_same_alarms(alarm_clock):
+    client = alarm_clock.app.test_client()
+    rows = [{'clock_id': 1, 'alarm_date': TOMORROW, 'alarm_time': time, 'repeat_days': 'Mon'} for time in ('06:05', '18:30')]
+    assert client.post('/api/alarms/bulk', data=json.dumps(rows), content_type='application/json').status_code == 200
+    exported = client.get('/api/alarms/bulk?format=csv').get_data()
+    response = client.post('/api/alarms/bulk', data=exported, content_type='text/csv')
+    assert response.status_code == 200, response.get_json()
+    with db.cursor(dictionary=True) as cursor:
+        cursor.execute("SELECT * FROM alarms ORDER BY id")
+        alarms = [(alarm['clock_id'], alarm_fire_time(alarm['alarm_date'], alarm['alarm_time']), alarm['repeat_days'],
+                   alarm['next_fire_at'], bool(alarm['enabled'])) for alarm in cursor.fetchall()]
+    assert alarms[2:] == alarms[:2]
@@ -0,0 +1,44 @@
+'''
+Tests for the keyset pagination of /alarm, run against the SQLite stand-in database of benchmark.py.
+'''
+import pytest
+
+pytest.importorskip("mariadb")
+pytest.importorskip("flask")
+pytest.importorskip("paho.mqtt.client")
+import benchmark
+import db
+
+@pytest.fixture
+def alarms(standin, alarm_clock):
+    benchmark.fill_alarms(standin, 57)
+    with db.cursor(dictionary=True) as cursor:
+        cursor.execute("SELECT * FROM alarms ORDER BY alarm_date, alarm_time, id")
+        return cursor.fetchall()
+
+def pages(alarm_clock, args):
+    ids = []
+    while True:
+        after, limit, clock_id, enabled = alarm_clock.parse_alarm_page_args(args)
+        page, next_after = alarm_clock.fetch_alarm_page(after, limit, clock_id, enabled)
+        assert len(page) <= limit
+        ids.extend(alarm['id'] for alarm in page)
+        if next_after is None:
+            return ids
+        args = dict(args, after=next_after)
+
+def test_pages_cover_every_alarm_once_in_order(alarm_clock, alarms):
+    assert pages(alarm_clock, {'limit': '10'}) == [alarm['id'] for alarm in alarms]
+
+def test_pages_with_filters(alarm_clock, alarms):
+    expected = [alarm['id'] for alarm in alarms if alarm['clock_id'] == 3 and alarm['enabled']]
+    assert pages(alarm_clock, {'limit': '2', 'clock_id': '3', 'enabled': 'true'}) == expected
+
+def test_page_args_are_clamped(alarm_clock):
+    assert alarm_clock.parse_alarm_page_args({'limit': '0'})[1] == 1
+    assert alarm_clock.parse_alarm_page_args({'limit': '100000'})[1] == alarm_clock.MAX_ALARM_PAGE_SIZE
+
+@pytest.mark.parametrize('args', [{'limit': 'x'}, {'after': 'nope'}, {'after': '2026-10-20_07:00:00_x'}, {'clock_id': 'x'}])
+def test_bad_page_args_raise_value_error(alarm_clock, args):
+    with pytest.raises(ValueError):
+        alarm_clock.parse_alarm_page_args(args)
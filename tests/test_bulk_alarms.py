@@ -0,0 +1,78 @@
+'''
+Tests for parsing and validating bulk alarm imports in bulk_alarms.py.
+'''
+import io
+import json
+from datetime import date, datetime, timedelta
+import pytest
+import bulk_alarms
+from recurrence import parse_repeat_days
+
+def rows(body, content_type, chunk_size=None):
+    stream = io.BytesIO(body.encode())
+    if chunk_size is not None:
+        return list(enumerate(bulk_alarms.iter_json_array(io.TextIOWrapper(stream, encoding='utf-8'), chunk_size), start=1))
+    return list(bulk_alarms.iter_rows(stream, content_type))
+
+ALARMS = [{'clock_id': 1, 'alarm_date': '2030-01-07', 'alarm_time': '07:00', 'repeat_days': 'mon, fri'},
+          {'clock_id': '2', 'alarm_date': '2030-01-08', 'alarm_time': '06:30:00', 'enabled': 'no'}]
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_json_array_is_read_one_row_at_a_time(chunk_size):
+    assert rows(json.dumps(ALARMS, indent=2), 'application/json', chunk_size) == list(enumerate(ALARMS, start=1))
+
+def test_json_lines_and_csv_give_numbered_rows():
+    lines = "\n".join(json.dumps(alarm) for alarm in ALARMS)
+    assert rows(lines, 'application/x-ndjson') == list(enumerate(ALARMS, start=1))
+    body = "clock_id,alarm_date,alarm_time\n1,2030-01-07,07:00\n"
+    assert rows(body, 'text/csv') == [(2, {'clock_id': '1', 'alarm_date': '2030-01-07', 'alarm_time': '07:00'})]
+
+@pytest.mark.parametrize('body', ['{"clock_id": 1}', '[{"clock_id": 1}', '[1 2]'])
+def test_malformed_json_array_raises_value_error(body):
+    with pytest.raises(ValueError):
+        rows(body, 'application/json')
+
+def test_valid_rows_become_insert_values():
+    clock_id, alarm_time, alarm_date, repeat_days, repeat_mask, next_fire_at, enabled = bulk_alarms.validate_row(ALARMS[0])
+    assert (clock_id, alarm_time, alarm_date, enabled) == (1, '07:00', '2030-01-07', True)
+    assert (repeat_days, repeat_mask) == ('Mon,Fri', parse_repeat_days('Mon,Fri'))
+    # 2030-01-07 is a Monday
+    assert next_fire_at == datetime(2030, 1, 7, 7, 0)
+    assert bulk_alarms.validate_row(ALARMS[1])[0] == 2
+    assert bulk_alarms.validate_row(ALARMS[1])[-1] is False
+
+@pytest.mark.parametrize('change', [
+    {'clock_id': None},
+    {'clock_id': [1]},
+    {'clock_id': True},
+    {'clock_id': 'one'},
+    {'clock_id': 1.5},
+    {'alarm_date': None},
+    {'alarm_date': 20300107},
+    {'alarm_date': '2030-13-01'},
+    {'alarm_time': '25:00'},
+    {'repeat_days': ['Mon']},
+    {'repeat_days': 3},
+    {'repeat_days': 'Funday'},
+])
+def test_invalid_rows_raise_value_error(change):
+    with pytest.raises(ValueError):
+        bulk_alarms.validate_row({**ALARMS[0], **change})
+
+def test_unknown_clock_is_rejected():
+    with pytest.raises(ValueError):
+        bulk_alarms.validate_row(ALARMS[0], clock_exists=lambda clock_id: False)
+
+@pytest.mark.parametrize('fmt, content_type', [('csv', 'text/csv'), ('json', 'application/x-ndjson')])
+def test_export_round_trips_through_import(fmt, content_type):
+    # as MariaDB returns them, TIME as a timedelta
+    stored = [{'id': 1, 'clock_id': 1, 'alarm_date': date(2030, 1, 7), 'alarm_time': timedelta(hours=7, minutes=5),
+               'repeat_days': 'Mon,Fri', 'enabled': True, 'next_fire_at': datetime(2030, 1, 7, 7, 5)},
+              {'id': 2, 'clock_id': 2, 'alarm_date': date(2030, 1, 8), 'alarm_time': timedelta(hours=23, seconds=30),
+               'repeat_days': '', 'enabled': False, 'next_fire_at': datetime(2030, 1, 8, 23, 0, 30)}]
+    body = ''.join(bulk_alarms.iter_export(iter(stored), fmt))
+    imported = [bulk_alarms.validate_row(row) for _, row in rows(body, content_type)]
+    assert [(values[0], values[2], values[1], values[3], values[6], values[5]) for values in imported] == [
+        (1, '2030-01-07', '07:05:00', 'Mon,Fri', True, datetime(2030, 1, 7, 7, 5)),
+        (2, '2030-01-08', '23:00:30', '', False, datetime(2030, 1, 8, 23, 0, 30)),
+    ]
@@ -0,0 +1,166 @@
+'''
+Tests for TTLCache in cache.py, and for the /weather route it caches against a local stub
+of the weather API.
+'''
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+import pytest
+
+import cache
+from cache import TTLCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache, 'time', SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+class BlockingLoader:
+    """
+    Returns 'value 1', 'value 2', ... but each call waits until release() is called.
+    """
+    def __init__(self):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release_event = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        assert self.release_event.wait(5)
+        return f"value {self.calls}"
+
+    def release(self):
+        self.release_event.set()
+
+def wait_for_refresh(ttl_cache, key):
+    deadline = time.monotonic() + 5
+    while key in ttl_cache.inflight and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+def test_concurrent_misses_call_the_loader_once():
+    ttl_cache = TTLCache(ttl=60)
+    loader = BlockingLoader()
+    with ThreadPoolExecutor(8) as pool:
+        results = [pool.submit(ttl_cache.get, 'k', loader) for _ in range(8)]
+        assert loader.started.wait(5)
+        # let every request reach the cache before the load finishes
+        time.sleep(0.05)
+        loader.release()
+        assert [result.result(5) for result in results] == ["value 1"] * 8
+    assert loader.calls == 1
+    assert ttl_cache.get('k', loader) == "value 1"
+    assert loader.calls == 1
+
+def test_stale_entry_is_served_while_one_refresh_runs(clock):
+    ttl_cache = TTLCache(ttl=60, stale_ttl=300)
+    assert ttl_cache.get('k', lambda: "old") == "old"
+    clock.now += 61
+    loader = BlockingLoader()
+    assert ttl_cache.get('k', loader) == "old"
+    assert loader.started.wait(5)
+    assert ttl_cache.get('k', loader) == "old"
+    loader.release()
+    wait_for_refresh(ttl_cache, 'k')
+    assert loader.calls == 1
+    assert ttl_cache.get('k', loader) == "value 1"
+    assert ttl_cache.stale_hits == 2
+
+def test_entry_past_the_stale_window_is_loaded_again(clock):
+    ttl_cache = TTLCache(ttl=60, stale_ttl=300)
+    ttl_cache.get('k', lambda: "old")
+    clock.now += 361
+    assert ttl_cache.get('k', lambda: "new") == "new"
+
+def test_errors_are_not_cached():
+    ttl_cache = TTLCache(ttl=60)
+    calls = []
+
+    def failing():
+        calls.append(1)
+        raise OSError("down")
+
+    for _ in range(2):
+        with pytest.raises(OSError):
+            ttl_cache.get('k', failing)
+    assert len(calls) == 2
+    assert ttl_cache.get('k', lambda: "up") == "up"
+
+def test_failed_refresh_keeps_serving_the_stale_entry(clock):
+    ttl_cache = TTLCache(ttl=60, stale_ttl=300)
+    ttl_cache.get('k', lambda: "old")
+    clock.now += 61
+
+    def failing():
+        raise OSError("down")
+
+    assert ttl_cache.get('k', failing) == "old"
+    wait_for_refresh(ttl_cache, 'k')
+    assert ttl_cache.get('k', failing) == "old"
+
+def test_oldest_entry_is_evicted(clock):
+    ttl_cache = TTLCache(ttl=60, max_entries=2)
+    for key in ('a', 'b', 'c'):
+        ttl_cache.get(key, lambda: key)
+        clock.now += 1
+    assert sorted(ttl_cache.entries) == ['b', 'c']
+
+def test_invalidate():
+    ttl_cache = TTLCache(ttl=60)
+    ttl_cache.get('a', lambda: 1)
+    ttl_cache.get('b', lambda: 2)
+    ttl_cache.invalidate('a')
+    assert list(ttl_cache.entries) == ['b']
+    ttl_cache.invalidate()
+    assert ttl_cache.entries == {}
+
+class WeatherAPIStub(BaseHTTPRequestHandler):
+    requests = 0
+    body = json.dumps({
+        'location': {'name': 'Lewisburg', 'region': 'Pennsylvania', 'country': 'USA', 'localtime': '2026-10-20 07:00'},
+        'current': {'temp_c': 12.0, 'temp_f': 53.6, 'condition': {'text': 'Sunny'}, 'wind_kph': 5.0, 'humidity': 60},
+    }).encode()
+
+    def do_GET(self):
+        WeatherAPIStub.requests += 1
+        # slow enough that the concurrent page views all miss together
+        time.sleep(0.1)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def weather_api():
+    WeatherAPIStub.requests = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), WeatherAPIStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1/current.json"
+    server.shutdown()
+    server.server_close()
+
+def test_concurrent_weather_page_views_call_the_api_once(alarm_clock, weather_api, monkeypatch):
+    monkeypatch.setattr(alarm_clock, 'weather_url', weather_api)
+    client = alarm_clock.app.test_client()
+    with ThreadPoolExecutor(8) as pool:
+        responses = list(pool.map(lambda _: client.get('/weather'), range(8)))
+    assert [response.status_code for response in responses] == [200] * 8
+    assert b'Lewisburg' in responses[0].data
+    assert WeatherAPIStub.requests == 1
+    client.get('/weather')
+    assert WeatherAPIStub.requests == 1
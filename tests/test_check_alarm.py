@@ -0,0 +1,83 @@
+'''
+Tests for the snooze handling of check_alarm.py, with two checkers sharing the SQLite
+stand-in database of benchmark.py.
+'''
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("mariadb")
+pytest.importorskip("paho.mqtt.client")
+import check_alarm
+import db
+import timing_wheel
+from timing_wheel import TimingWheel
+
+# an hour ago, so every snooze is already due
+START = datetime.now().replace(microsecond=0) - timedelta(hours=1)
+
+class RecordingClient:
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.published.append((topic, payload))
+
+def frozen_now(moment):
+    class FrozenDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return moment
+    return FrozenDatetime
+
+@pytest.fixture
+def rung_alarm(standin, monkeypatch):
+    # lets the test move the wheels' clock forward
+    clock = [START.timestamp()]
+    monkeypatch.setattr(timing_wheel, 'time', SimpleNamespace(time=lambda: clock[0]))
+    monkeypatch.setattr(check_alarm, 'clock_registry', check_alarm.clocks.ClockRegistry())
+    with db.cursor() as cursor:
+        cursor.execute("INSERT INTO alarms (id, clock_id, alarm_time, alarm_date, repeat_days, enabled) "
+                       "VALUES (1, 1, '07:00:00', ?, '', 0)", (START.date(),))
+        cursor.execute("INSERT INTO alarm_fires (alarm_id, fire_at, clock_id) VALUES (1, ?, 1)", (START,))
+    return clock
+
+def ring(client, wheel, clock):
+    clock[0] += 1
+    check_alarm.ring_snoozed_alarms(client, wheel)
+
+def test_snooze_seen_by_two_checkers_rings_once(rung_alarm, monkeypatch):
+    clock = rung_alarm
+    wheels = [TimingWheel(), TimingWheel()]
+    clients = [RecordingClient(), RecordingClient()]
+    # the checkers handle the same snooze event a second apart
+    for i, wheel in enumerate(wheels):
+        monkeypatch.setattr(check_alarm, 'datetime', frozen_now(START + timedelta(seconds=i)))
+        check_alarm.snooze_alarm(wheel, 1, 60)
+    monkeypatch.setattr(check_alarm, 'datetime', datetime)
+    clock[0] = (START + timedelta(minutes=5)).timestamp()
+    for _ in range(3):
+        for client, wheel in zip(clients, wheels):
+            ring(client, wheel, clock)
+    assert sum(len(client.published) for client in clients) == 1
+    with db.cursor() as cursor:
+        cursor.execute("SELECT snooze_time FROM alarms WHERE id = 1")
+        assert cursor.fetchone()[0] is None
+
+def test_checker_holding_an_older_snooze_time_takes_over_the_stored_one(rung_alarm, monkeypatch):
+    clock = rung_alarm
+    wheel = TimingWheel()
+    client = RecordingClient()
+    monkeypatch.setattr(check_alarm, 'datetime', frozen_now(START))
+    check_alarm.snooze_alarm(wheel, 1, 60)
+    monkeypatch.setattr(check_alarm, 'datetime', datetime)
+    # another checker snoozed it again later, and then went away
+    with db.cursor() as cursor:
+        cursor.execute("UPDATE alarms SET snooze_time = ? WHERE id = 1", (START + timedelta(seconds=90),))
+    clock[0] = (START + timedelta(seconds=60)).timestamp()
+    ring(client, wheel, clock)
+    assert client.published == []
+    assert 1 in wheel
+    clock[0] = (START + timedelta(seconds=90)).timestamp()
+    ring(client, wheel, clock)
+    assert client.published == [('iot/alarm/vk009_csci332', "Alarm is ringing")]
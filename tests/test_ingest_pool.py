@@ -0,0 +1,17 @@
+'''
+Tests for routing telemetry to the ingest workers in ingest_pool.py.
+'''
+import pytest
+
+pytest.importorskip("mariadb")
+pytest.importorskip("paho.mqtt.client")
+import ingest_pool
+
+def test_a_clock_always_goes_to_the_same_worker():
+    index = ingest_pool.worker_for('iot/telemetry/kitchen', 4)
+    assert 0 <= index < 4
+    assert all(ingest_pool.worker_for('iot/telemetry/kitchen', 4) == index for _ in range(10))
+
+def test_clocks_are_spread_over_the_workers():
+    used = {ingest_pool.worker_for(f'iot/telemetry/clock{i}', 4) for i in range(100)}
+    assert used == {0, 1, 2, 3}
@@ -0,0 +1,111 @@
+'''
+Tests for the clock firmware in iot_data.py, with the MicroPython modules stubbed out.
+'''
+import importlib
+import sys
+import time
+import types
+import pytest
+
+import telemetry_format
+
+class FakePin:
+    OUT = 1
+    IN = 0
+    PULL_UP = 1
+    IRQ_FALLING = 4
+    created = []
+
+    def __init__(self, number, mode=None, pull=None):
+        self.number = number
+        self.state = None
+        self.handler = None
+        FakePin.created.append(self)
+
+    def value(self, state=None):
+        if state is None:
+            return self.state
+        self.state = state
+
+    def irq(self, trigger, handler):
+        self.handler = handler
+
+class FakeADC:
+    def __init__(self, channel):
+        self.channel = channel
+        self.reading = 0
+
+    def read_u16(self):
+        return self.reading
+
+class FakeNeoPixel:
+    ORDER = (1, 0, 2)
+
+    def __init__(self, pin, count):
+        self.buf = bytearray(3 * count)
+
+    def write(self):
+        pass
+
+def module(name, **attrs):
+    mod = types.ModuleType(name)
+    mod.__dict__.update(attrs)
+    return mod
+
+@pytest.fixture
+def iot_data(monkeypatch):
+    FakePin.created = []
+    stubs = {
+        'usocket': module('usocket'),
+        'umqtt': module('umqtt'),
+        'umqtt.simple': module('umqtt.simple', MQTTClient=object),
+        'neopixel': module('neopixel', NeoPixel=FakeNeoPixel),
+        'framebuf': module('framebuf', FrameBuffer=lambda *args: object(), RGB565=1),
+        'machine': module('machine', Pin=FakePin, ADC=FakeADC, unique_id=lambda: b'\x01\x02\x03\x04'),
+        'utime': module('utime', gmtime=time.gmtime, time=lambda: 1760000000, localtime=time.localtime,
+                        ticks_ms=lambda: 0, ticks_diff=lambda a, b: a - b),
+        'uasyncio': module('uasyncio', ThreadSafeFlag=object),
+        'network': module('network'),
+        'ntptime': module('ntptime'),
+        'secMgr': module('secMgr', SecretsManager=object),
+    }
+    for name, stub in stubs.items():
+        monkeypatch.setitem(sys.modules, name, stub)
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    monkeypatch.delitem(sys.modules, 'iot_data', raising=False)
+    return importlib.import_module('iot_data')
+
+def test_import_does_not_touch_the_hardware(iot_data):
+    assert FakePin.created == []
+    assert iot_data.temperature_sensor is None
+
+def test_setup_hardware_turns_outputs_off_and_registers_buttons(iot_data):
+    iot_data.setup_hardware()
+    assert iot_data.alarm_pin.value() == 0
+    assert iot_data.button1_LED_pin.value() == 0
+    assert iot_data.button2_LED_pin.value() == 0
+    assert iot_data.button1_value.handler is not None
+    assert iot_data.button2_value.handler is not None
+    assert iot_data.temperature_sensor.channel == 4
+
+def test_read_temperature_converts_the_sensor_voltage(iot_data):
+    iot_data.setup_hardware()
+    # 0.706 V is 27 degrees
+    iot_data.temperature_sensor.reading = round(0.706 / 3.3 * 65535)
+    assert iot_data.read_temperature() == pytest.approx(27, abs=0.1)
+
+def test_encode_telemetry_decodes_on_the_server_without_humidity(iot_data):
+    payload = telemetry_format.decode(iot_data.encode_telemetry(21.57))
+    assert payload['clock_id'] == iot_data.CLOCK_ID
+    assert payload['temperature'] == 21.57
+    assert 'humidity' not in payload
+    assert len(iot_data.encode_telemetry(21.57)) == 10
+
+def test_start_and_stop_ringing(iot_data):
+    iot_data.setup_hardware()
+    iot_data.pressed[iot_data.SNOOZE] = True
+    iot_data.start_ringing()
+    assert iot_data.alarm_pin.value() == 1
+    assert iot_data.pressed == [False, False]
+    iot_data.stop_ringing()
+    assert iot_data.alarm_pin.value() == 0
@@ -0,0 +1,51 @@
+'''
+Tests for the schema migration runner.
+'''
+import pytest
+
+pytest.importorskip("mariadb")
+import migrations
+
+class FakeConnection:
+    def __init__(self):
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+
+class FakeCursor:
+    def __init__(self, version):
+        self.connection = FakeConnection()
+        self.version = version
+        self.recorded = []
+
+    def execute(self, sql, params=()):
+        if sql.startswith("INSERT INTO schema_version"):
+            self.recorded.append(params[0])
+
+    def fetchone(self):
+        return (self.version,)
+
+@pytest.fixture
+def applied(monkeypatch):
+    applied = []
+    steps = [(number, f"step {number}", lambda cursor, number=number: applied.append(number)) for number in (1, 2, 3)]
+    monkeypatch.setattr(migrations, 'MIGRATIONS', steps)
+    return applied
+
+def test_migrate_applies_pending_versions_in_order(applied):
+    cursor = FakeCursor(1)
+    assert migrations.migrate(cursor) == 3
+    assert applied == [2, 3]
+    assert cursor.recorded == [2, 3]
+    assert cursor.connection.commits == 2
+
+def test_migrate_on_current_schema_does_nothing(applied):
+    cursor = FakeCursor(3)
+    assert migrations.migrate(cursor) == 3
+    assert applied == []
+    assert cursor.connection.commits == 0
+
+def test_migration_versions_are_unique_and_increasing():
+    numbers = [number for number, _, _ in migrations.MIGRATIONS]
+    assert numbers == sorted(set(numbers))
@@ -0,0 +1,73 @@
+'''
+Tests for the alarm change watcher in print_alarms.py, run against a fake cursor.
+'''
+from datetime import datetime, timedelta
+import pytest
+
+pytest.importorskip("mariadb")
+import print_alarms
+
+NOW = datetime(2026, 10, 20, 7, 0)
+
+class FakeCursor:
+    def __init__(self):
+        self.alarms = {}
+        self.deletes = []
+        self.result = []
+
+    def execute(self, sql, params=()):
+        if "CURRENT_TIMESTAMP" in sql:
+            self.result = [{'now': NOW}]
+        elif "FROM alarm_deletes" in sql:
+            self.result = [row for row in self.deletes if row['deleted_at'] >= params[0]]
+        elif "updated_at >= ?" in sql:
+            self.result = [dict(alarm) for alarm in self.alarms.values() if alarm['updated_at'] >= params[0]]
+        else:
+            self.result = [dict(alarm) for alarm in self.alarms.values()]
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return sorted(self.result, key=lambda row: (row.get('updated_at'), row.get('id')))
+
+    def write(self, alarm_id, updated_at, **columns):
+        alarm = self.alarms.setdefault(alarm_id, {'id': alarm_id, 'clock_id': 1, 'alarm_time': '07:00:00',
+                                                  'alarm_date': '2026-10-20', 'repeat_days': '', 'enabled': 1})
+        alarm.update(columns, updated_at=updated_at)
+
+@pytest.fixture
+def watched(capsys):
+    cursor = FakeCursor()
+    cursor.write(1, NOW - timedelta(days=1))
+    watcher = print_alarms.AlarmWatcher()
+    watcher.start(cursor)
+    capsys.readouterr()
+    return cursor, watcher
+
+def test_changes_are_printed_once(watched, capsys):
+    cursor, watcher = watched
+    cursor.write(1, NOW + timedelta(seconds=1), enabled=0)
+    cursor.write(2, NOW + timedelta(seconds=2))
+    watcher.poll(cursor)
+    watcher.poll(cursor)
+    lines = capsys.readouterr().out.splitlines()
+    assert lines == ["~ Alarm ID: 1, enabled: 1 -> 0", f"+ {print_alarms.describe(cursor.alarms[2])}"]
+
+def test_row_committed_late_with_an_older_version_is_seen(watched, capsys):
+    cursor, watcher = watched
+    cursor.write(2, NOW + timedelta(minutes=2))
+    watcher.poll(cursor)
+    capsys.readouterr()
+    # a transaction that wrote a minute earlier commits after the poll above
+    cursor.write(3, NOW + timedelta(minutes=1))
+    watcher.poll(cursor)
+    assert capsys.readouterr().out.splitlines() == [f"+ {print_alarms.describe(cursor.alarms[3])}"]
+
+def test_deletes_are_printed_once(watched, capsys):
+    cursor, watcher = watched
+    deleted = cursor.alarms.pop(1)
+    cursor.deletes.append({'alarm_id': 1, 'deleted_at': NOW + timedelta(seconds=5)})
+    watcher.poll(cursor)
+    watcher.poll(cursor)
+    assert capsys.readouterr().out.splitlines() == [f"- {print_alarms.describe(deleted)}"]
@@ -0,0 +1,46 @@
+'''
+Tests for the repeat_days parsing and the fire time calculations in recurrence.py.
+'''
+from datetime import datetime, timedelta
+import pytest
+from recurrence import (parse_repeat_days, format_repeat_days, alarm_fire_time, first_fire_time,
+                        next_occurrence, next_occurrence_after)
+
+MON_WED_FRI = parse_repeat_days("Mon,Wed,Fri")
+
+def test_start_date_outside_the_mask_moves_to_the_next_scheduled_day():
+    # 2026-10-20 is a Tuesday
+    now = datetime(2026, 10, 19, 12, 0)
+    assert first_fire_time("2026-10-20", "07:00", MON_WED_FRI, now) == datetime(2026, 10, 21, 7, 0)
+
+def test_start_date_in_the_mask_rings_that_day():
+    now = datetime(2026, 10, 19, 12, 0)
+    assert first_fire_time("2026-10-23", "07:00", MON_WED_FRI, now) == datetime(2026, 10, 23, 7, 0)
+
+def test_past_start_date_rings_at_the_next_scheduled_time_after_now():
+    # Thursday 2026-10-22 at noon, the 07:00 Friday alarm is next
+    now = datetime(2026, 10, 22, 12, 0)
+    assert first_fire_time("2025-01-01", "07:00", MON_WED_FRI, now) == datetime(2026, 10, 23, 7, 0)
+
+def test_one_off_alarm_rings_at_its_date_and_time():
+    now = datetime(2026, 10, 30)
+    assert first_fire_time("2026-10-20", "07:00", 0, now) == datetime(2026, 10, 20, 7, 0)
+
+def test_repeat_days_round_trip():
+    assert parse_repeat_days("mon, wednesday,FRI") == MON_WED_FRI
+    assert format_repeat_days(MON_WED_FRI) == "Mon,Wed,Fri"
+    assert parse_repeat_days("") == 0
+    with pytest.raises(ValueError):
+        parse_repeat_days("Funday")
+
+def test_mysql_time_values_are_accepted():
+    assert alarm_fire_time(datetime(2026, 10, 20).date(), timedelta(hours=7, minutes=30)) == datetime(2026, 10, 20, 7, 30)
+
+def test_next_occurrence_follows_the_mask():
+    friday = datetime(2026, 10, 23, 7, 0)
+    assert next_occurrence(MON_WED_FRI, friday) == datetime(2026, 10, 26, 7, 0)
+    assert next_occurrence(0, friday) is None
+
+def test_next_occurrence_after_skips_missed_occurrences():
+    monday = datetime(2026, 10, 19, 7, 0)
+    assert next_occurrence_after(MON_WED_FRI, monday, datetime(2026, 10, 23, 8, 0)) == datetime(2026, 10, 26, 7, 0)
@@ -0,0 +1,71 @@
+'''
+Tests for the minute and hour telemetry rollups.
+'''
+from datetime import datetime
+import pytest
+
+pytest.importorskip("mariadb")
+import rollups
+
+def test_aggregate_buckets_by_clock_and_minute():
+    samples = [
+        (1, datetime(2026, 10, 20, 7, 0, 5), 20.0, 40.0),
+        (1, datetime(2026, 10, 20, 7, 0, 50), 22.0, 50.0),
+        (1, datetime(2026, 10, 20, 7, 1, 0), 21.0, 45.0),
+        (2, datetime(2026, 10, 20, 7, 0, 10), 19.0, 30.0),
+    ]
+    rows = sorted(rollups.aggregate(samples, 'weather_rollup_minute'))
+    assert rows == [
+        (1, datetime(2026, 10, 20, 7, 0), 20.0, 22.0, 42.0, 40.0, 50.0, 90.0, 2, 2),
+        (1, datetime(2026, 10, 20, 7, 1), 21.0, 21.0, 21.0, 45.0, 45.0, 45.0, 1, 1),
+        (2, datetime(2026, 10, 20, 7, 0), 19.0, 19.0, 19.0, 30.0, 30.0, 30.0, 1, 1),
+    ]
+
+def test_aggregate_hour_bucket():
+    samples = [(1, datetime(2026, 10, 20, 7, minute), float(minute), 40.0) for minute in (0, 30, 59)]
+    (row,) = rollups.aggregate(samples, 'weather_rollup_hour')
+    assert row[:5] == (1, datetime(2026, 10, 20, 7, 0), 0.0, 59.0, 89.0)
+    assert row[-1] == 3
+
+def test_aggregate_counts_humidity_separately():
+    samples = [
+        (1, datetime(2026, 10, 20, 7, 0, 5), 20.0, None),
+        (1, datetime(2026, 10, 20, 7, 0, 15), 21.0, 50.0),
+        (1, datetime(2026, 10, 20, 7, 0, 25), 22.0, None),
+    ]
+    (row,) = rollups.aggregate(samples, 'weather_rollup_minute')
+    assert row[5:] == (50.0, 50.0, 50.0, 1, 3)
+
+def test_aggregate_without_any_humidity_leaves_it_null():
+    (row,) = rollups.aggregate([(1, datetime(2026, 10, 20, 7, 0), 20.0, None)], 'weather_rollup_minute')
+    assert row[5:] == (None, None, None, 0, 1)
+
+class RecordingConnection:
+    def __init__(self, first_id, last_id):
+        self.ids = (first_id, last_id)
+        self.log = []
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql, params=()):
+        self.log.append((' '.join(sql.split()), params))
+
+    def fetchone(self):
+        return self.ids
+
+    def commit(self):
+        self.log.append(('COMMIT', ()))
+
+    def close(self):
+        pass
+
+def test_backfill_clears_and_bounds_under_a_table_lock():
+    connection = RecordingConnection(1, 25)
+    rollups.backfill_rollups(connection, chunk_size=10)
+    statements = [sql.split(' ')[0] for sql, _ in connection.log if not sql.startswith('CREATE')]
+    # nothing can commit raw rows between clearing the rollups and reading the last id
+    assert statements[:6] == ['LOCK', 'DELETE', 'DELETE', 'SELECT', 'COMMIT', 'UNLOCK']
+    chunks = sorted({params for sql, params in connection.log if sql.startswith('INSERT')})
+    # only rows up to the id read under the lock, later rows are merged by update_rollups
+    assert chunks == [(0, 10), (10, 20), (20, 25)]
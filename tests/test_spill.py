@@ -0,0 +1,97 @@
+'''
+Tests for the on-disk telemetry spill log in spill.py.
+'''
+import os
+from datetime import datetime
+
+from spill import SpillLog, segment_name
+
+def records(count, start=0):
+    return [{'clock_id': 1, 'temperature': float(i)} for i in range(start, start + count)]
+
+def replay(spill, batch_size=1000):
+    records, position = spill.read_batch(batch_size)
+    spill.ack(position)
+    return records
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.startswith('segment-'))
+
+def test_records_are_read_back_in_order_and_acked(tmp_path):
+    spill = SpillLog(str(tmp_path))
+    for record in records(5):
+        spill.append(record)
+    assert spill.active
+    first, position = spill.read_batch(3)
+    assert first == records(3)
+    # not acknowledged yet, so the same records are read again
+    assert spill.read_batch(3)[0] == records(3)
+    spill.ack(position)
+    assert replay(spill) == records(2, start=3)
+    assert not spill.pending()
+    assert spill.deactivate_if_drained()
+    assert not spill.deactivate_if_drained()
+    assert not spill.active
+
+def test_timestamps_come_back_as_datetimes(tmp_path):
+    spill = SpillLog(str(tmp_path))
+    spill.append({'temperature': 20.0, 'timestamp': datetime(2026, 10, 20, 7, 0, 5)})
+    assert replay(spill) == [{'temperature': 20.0, 'timestamp': datetime(2026, 10, 20, 7, 0, 5)}]
+
+def test_append_without_activate_keeps_the_log_inactive(tmp_path):
+    spill = SpillLog(str(tmp_path))
+    spill.append(records(1)[0], activate=False)
+    assert not spill.active
+    assert spill.pending()
+    assert not spill.deactivate_if_drained()
+
+def test_segments_rotate_and_are_deleted_once_replayed(tmp_path):
+    spill = SpillLog(str(tmp_path), segment_bytes=100)
+    for record in records(20):
+        spill.append(record)
+    assert len(segment_files(tmp_path)) > 3
+    # batches stop part way through segments and carry on in the next one
+    replayed = []
+    while spill.pending():
+        replayed.extend(replay(spill, batch_size=3))
+    assert replayed == records(20)
+    assert segment_files(tmp_path) == [segment_name(spill.write_seq)]
+
+def test_restart_resumes_from_the_checkpoint_and_stays_active(tmp_path):
+    spill = SpillLog(str(tmp_path), segment_bytes=100)
+    for record in records(10):
+        spill.append(record)
+    assert replay(spill, batch_size=4) == records(4)
+    spill.close()
+
+    spill = SpillLog(str(tmp_path), segment_bytes=100)
+    assert spill.active
+    spill.append(records(1, start=10)[0])
+    assert replay(spill) == records(7, start=4)
+    assert spill.deactivate_if_drained()
+    spill.close()
+
+    assert not SpillLog(str(tmp_path)).active
+
+def test_partial_record_at_the_tail_is_cut_off(tmp_path):
+    spill = SpillLog(str(tmp_path))
+    for record in records(3):
+        spill.append(record)
+    spill.close()
+    with open(tmp_path / segment_name(spill.write_seq), 'ab') as f:
+        f.write(b'{"clock_id": 1, "temper')
+
+    spill = SpillLog(str(tmp_path))
+    spill.append(records(1, start=3)[0])
+    assert replay(spill) == records(4)
+
+def test_missing_checkpointed_segment_starts_from_the_oldest_left(tmp_path):
+    spill = SpillLog(str(tmp_path), segment_bytes=100)
+    for record in records(10):
+        spill.append(record)
+    spill.close()
+    os.remove(tmp_path / segment_name(0))
+
+    spill = SpillLog(str(tmp_path), segment_bytes=100)
+    replayed = replay(spill)
+    assert replayed and replayed == records(10)[-len(replayed):]
@@ -0,0 +1,103 @@
+'''
+Tests for the telemetry ingest in tables.py, run against a fake cursor.
+'''
+import json
+import time
+from datetime import datetime
+from queue import Queue
+import pytest
+
+pytest.importorskip("mariadb")
+pytest.importorskip("paho.mqtt.client")
+import tables
+
+class FakeConnection:
+    def __init__(self):
+        self.commits = 0
+        self.rollbacks = 0
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+class FakeCursor:
+    def __init__(self):
+        self.connection = FakeConnection()
+        self.rows = {}
+
+    def executemany(self, sql, rows):
+        table = sql.split()[2]
+        self.rows.setdefault(table, []).extend(rows)
+
+@pytest.fixture(autouse=True)
+def registry():
+    tables.clock_registry.by_key = {'kitchen': 3}
+    tables.clock_registry.by_id = {3: 'kitchen'}
+    tables.clock_registry.loaded_at = time.monotonic()
+
+def test_bad_message_is_dropped_and_good_one_in_same_batch_is_written():
+    q = Queue()
+    tables.handle_payload('iot/telemetry/kitchen', b'{"temperature": "abc", "humidity": 40}', q)
+    tables.handle_payload('iot/telemetry/kitchen', b'{"temperature": "21.5", "humidity": 40}', q)
+    cursor = FakeCursor()
+    assert tables.process_once(q, cursor, interval_ms=10) == 1
+    (row,) = cursor.rows['weather_data']
+    assert row[0] == 3
+    assert row[2:] == (21.5, 40.0)
+    assert cursor.connection.commits == 1
+
+@pytest.mark.parametrize('payload', [
+    [1, 2],
+    {'humidity': 40},
+    {'temperature': None, 'humidity': 40},
+    {'temperature': float('nan'), 'humidity': 40},
+    {'temperature': 20, 'humidity': float('inf')},
+])
+def test_clean_payload_rejects_bad_readings(payload):
+    with pytest.raises(ValueError):
+        tables.clean_payload(payload)
+
+class RejectingCursor(FakeCursor):
+    """
+    Fails every insert holding a row with the given temperature, like a poison row would.
+    """
+    def __init__(self, error, poison, times=None):
+        super().__init__()
+        self.error = error
+        self.poison = poison
+        # fail only this many times, then accept the row
+        self.times = times
+        self.connection.reconnect = lambda: None
+
+    def executemany(self, sql, rows):
+        if any(row[2] == self.poison for row in rows) and self.times != 0:
+            if self.times is not None:
+                self.times -= 1
+            raise self.error("rejected")
+        super().executemany(sql, rows)
+
+def message(temperature):
+    return {'clock_id': 3, 'timestamp': datetime(2026, 10, 20, 7, 0), 'temperature': temperature, 'humidity': 40.0}
+
+def read_dead_letters(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+def test_rejected_rows_are_dead_lettered_and_the_rest_written(tmp_path, monkeypatch):
+    monkeypatch.setattr(tables, 'RETRY_DELAY', 0)
+    cursor = RejectingCursor(tables.mariadb.DataError, poison=99.0)
+    path = tmp_path / 'dead-letter.jsonl'
+    tables.write_batch_retry(cursor, [message(20.0), message(99.0), message(21.0)], str(path))
+    assert [row[2] for row in cursor.rows['weather_data']] == [20.0, 21.0]
+    (dead,) = read_dead_letters(path)
+    assert dead['message']['temperature'] == 99.0
+
+def test_transient_errors_are_retried_until_the_database_is_back(tmp_path, monkeypatch):
+    monkeypatch.setattr(tables, 'RETRY_DELAY', 0)
+    cursor = RejectingCursor(tables.mariadb.OperationalError, poison=20.0, times=50)
+    path = tmp_path / 'dead-letter.jsonl'
+    tables.write_batch_retry(cursor, [message(20.0), message(21.0)], str(path))
+    assert cursor.connection.rollbacks == 50
+    assert [row[2] for row in cursor.rows['weather_data']] == [20.0, 21.0]
+    assert not path.exists()
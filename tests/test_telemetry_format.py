@@ -0,0 +1,33 @@
+'''
+Tests for the binary telemetry format shared by tables.py and the clock.
+'''
+from datetime import datetime
+import pytest
+
+import telemetry_format
+
+def test_version_1_round_trip():
+    raw = telemetry_format.encode(21.5, 40.25, clock_id=3, timestamp=1760000000)
+    assert len(raw) == 12
+    assert telemetry_format.decode(raw) == {'clock_id': 3, 'timestamp': datetime.fromtimestamp(1760000000),
+                                            'temperature': 21.5, 'humidity': 40.25}
+
+def test_version_2_has_no_humidity():
+    raw = telemetry_format.encode(-3.25)
+    assert raw[1] == telemetry_format.NO_HUMIDITY_VERSION
+    assert len(raw) == 10
+    assert telemetry_format.decode(raw) == {'temperature': -3.25}
+
+def test_json_payloads_still_decode():
+    assert telemetry_format.decode(b'{"temperature": 20, "humidity": 50}') == {'temperature': 20, 'humidity': 50}
+
+@pytest.mark.parametrize('raw', [
+    bytes([telemetry_format.MAGIC]),
+    telemetry_format.encode(21.5, 40.25)[:-1],
+    bytes([telemetry_format.MAGIC, 99]) + bytes(10),
+    b'',
+    b'not json',
+])
+def test_undecodable_payloads_raise_value_error(raw):
+    with pytest.raises(ValueError):
+        telemetry_format.decode(raw)
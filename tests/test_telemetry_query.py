@@ -0,0 +1,39 @@
+'''
+Tests for the argument parsing of /api/telemetry in telemetry_query.py.
+'''
+from datetime import datetime, timezone
+import pytest
+import telemetry_query
+
+NOW = datetime(2026, 10, 20, 12, 34, 56)
+
+def test_range_is_aligned_to_the_bucket():
+    (clock_id, start, end, bucket), fmt = telemetry_query.parse_args({'clock_id': '1', 'bucket': '3600'}, now=NOW)
+    assert (clock_id, bucket, fmt) == (1, 3600, 'json')
+    assert start == datetime(2026, 10, 19, 12, 0)
+    assert end == datetime(2026, 10, 20, 13, 0)
+
+def test_times_with_a_zone_are_converted_to_local_time():
+    key, _ = telemetry_query.parse_args({'clock_id': '1', 'bucket': '60',
+                                         'start': '2026-10-20T10:00:00Z', 'end': '2026-10-20T11:00:00+00:00'}, now=NOW)
+    local = datetime(2026, 10, 20, 10, 0, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    assert key[1] == local
+    assert key[1].tzinfo is None and key[2].tzinfo is None
+
+@pytest.mark.parametrize('args', [
+    {},
+    {'clock_id': '1', 'bucket': '0'},
+    {'clock_id': '1', 'bucket': str(10 ** 30)},
+    {'clock_id': '1', 'end': '0001-01-01T00:00:00'},
+    {'clock_id': '1', 'start': '2026-10-20T00:00:00', 'end': '2026-10-19T00:00:00'},
+    {'clock_id': '1', 'bucket': '1', 'start': '2026-01-01T00:00:00', 'end': '2026-10-01T00:00:00'},
+    {'clock_id': '1', 'format': 'xml'},
+])
+def test_bad_arguments_raise_value_error(args):
+    with pytest.raises(ValueError):
+        telemetry_query.parse_args(args, now=NOW)
+
+def test_source_for_picks_the_coarsest_table():
+    assert telemetry_query.source_for(7200) == 'weather_rollup_hour'
+    assert telemetry_query.source_for(300) == 'weather_rollup_minute'
+    assert telemetry_query.source_for(45) == 'weather_data'
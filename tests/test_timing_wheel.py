@@ -0,0 +1,58 @@
+'''
+Tests for the hierarchical timing wheel used for snoozes in check_alarm.py.
+'''
+import random
+import pytest
+
+from timing_wheel import TimingWheel
+
+def test_timer_expires_at_its_due_time():
+    wheel = TimingWheel(start=1000)
+    wheel.add('a', 1005, 'clock')
+    assert wheel.advance(1004) == []
+    assert wheel.advance(1005) == [('a', 'clock', 1005)]
+    assert len(wheel) == 0
+
+def test_past_timer_expires_on_next_advance():
+    wheel = TimingWheel(start=1000)
+    wheel.add('a', 10)
+    assert wheel.advance(1001) == [('a', None, 1001)]
+
+def test_cancel_and_replace():
+    wheel = TimingWheel(start=0)
+    wheel.add('a', 5)
+    assert wheel.cancel('a')
+    assert not wheel.cancel('a')
+    wheel.add('b', 5)
+    wheel.add('b', 8)
+    assert 'b' in wheel
+    assert wheel.advance(7) == []
+    assert [key for key, _, _ in wheel.advance(8)] == ['b']
+
+def test_timers_cascade_through_every_level_in_order():
+    # 4 slots and 3 levels, so due times past 64 ticks start in the top level
+    wheel = TimingWheel(slots=4, levels=3, start=0)
+    rng = random.Random(1)
+    due = {key: rng.randint(1, 200) for key in range(50)}
+    for key, when in due.items():
+        wheel.add(key, when)
+    fired = {}
+    for now in range(0, 201, 3):
+        for key, _, when in wheel.advance(now):
+            assert when <= now
+            fired[key] = when
+    assert fired == due
+
+def test_next_expiry():
+    wheel = TimingWheel(slots=8, levels=2, start=0)
+    assert wheel.next_expiry() is None
+    wheel.add('soon', 3)
+    assert wheel.next_expiry() == 3
+    wheel.cancel('soon')
+    wheel.add('later', 20)
+    # the timer is in the next rotation, so the wheel wakes at the end of this one to cascade it
+    assert wheel.next_expiry() == 8
+
+def test_slots_must_be_a_power_of_two():
+    with pytest.raises(ValueError):
+        TimingWheel(slots=6)
@@ -0,0 +1,116 @@
+'''
+Hierarchical timing wheel for the snoozed alarms in check_alarm.py.
+
+Level 0 has one slot per tick; each higher level has one slot per full rotation
+of the level below. A timer lives in the lowest level whose rotation still
+contains its due tick and drops down a level (cascades) when the wheel reaches
+that slot. Slots are dicts, so adding and cancelling a timer are O(1) however
+many are pending, and advancing costs one slot per tick that passed.
+
+example:
+
+wheel = TimingWheel()
+wheel.add(alarm_id, time.time() + 300, clock_id)
+wheel.cancel(alarm_id)
+for alarm_id, clock_id, due in wheel.advance(time.time()):
+    ...
+'''
+import time
+
+class TimingWheel:
+    """
+    Timers keyed by any hashable key, due at a unix time, with tick second resolution.
+    slots must be a power of two. With the defaults the lowest three levels cover
+    64 ** 3 seconds (three days), timers further out wait in the top level.
+    """
+    def __init__(self, tick=1, slots=64, levels=4, start=None):
+        if slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.bits = slots.bit_length() - 1
+        self.mask = slots - 1
+        self.wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        # the last tick that was processed
+        self.current = int((time.time() if start is None else start) // tick)
+        self.entries = {}  # key -> (level, slot)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def add(self, key, due, value=None):
+        """
+        Schedules key to expire at the unix time due, replacing a timer already set for key.
+        Times in the past expire on the next advance.
+        """
+        self.cancel(key)
+        due_tick = max(-int(-due // self.tick), self.current + 1)
+        self._place(key, due_tick, value)
+
+    def cancel(self, key):
+        """
+        Removes the timer for key. Returns False if there was none.
+        """
+        location = self.entries.pop(key, None)
+        if location is None:
+            return False
+        level, slot = location
+        del self.wheels[level][slot][key]
+        return True
+
+    def _place(self, key, due_tick, value):
+        # the lowest level where the due tick is in the same rotation as the current tick
+        level = 0
+        while level < self.levels - 1 and (due_tick >> (self.bits * (level + 1))) != (self.current >> (self.bits * (level + 1))):
+            level += 1
+        slot = (due_tick >> (self.bits * level)) & self.mask
+        self.wheels[level][slot][key] = (due_tick, value)
+        self.entries[key] = (level, slot)
+
+    def advance(self, now=None):
+        """
+        Moves the wheel up to the unix time now and returns (key, value, due time) for every timer that expired.
+        """
+        target = int((time.time() if now is None else now) // self.tick)
+        expired = []
+        if not self.entries:
+            self.current = max(self.current, target)
+            return expired
+        while self.current < target:
+            self.current += 1
+            tick = self.current
+            # cascade from the top so timers can fall through several levels at once
+            for level in range(self.levels - 1, 0, -1):
+                if tick & ((1 << (self.bits * level)) - 1) == 0:
+                    slot = (tick >> (self.bits * level)) & self.mask
+                    timers = self.wheels[level][slot]
+                    self.wheels[level][slot] = {}
+                    for key, (due_tick, value) in timers.items():
+                        del self.entries[key]
+                        self._place(key, max(due_tick, tick), value)
+            timers = self.wheels[0][tick & self.mask]
+            if timers:
+                self.wheels[0][tick & self.mask] = {}
+                for key, (due_tick, value) in timers.items():
+                    del self.entries[key]
+                    expired.append((key, value, due_tick * self.tick))
+            if not self.entries:
+                self.current = target
+        return expired
+
+    def next_expiry(self):
+        """
+        Returns the unix time the wheel next needs advancing: the next busy slot of the current
+        rotation, or the end of the rotation when later timers have to cascade. None if empty.
+        """
+        if not self.entries:
+            return None
+        end = (self.current | self.mask) + 1
+        for tick in range(self.current + 1, end):
+            if self.wheels[0][tick & self.mask]:
+                return tick * self.tick
+        return end * self.tick